@@ -24,8 +24,237 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import re
+import json
+import time
+
+from adbatch import AdBatch
+from geo import ZipCentroids
+
+
+class KeywordMatcher(object):
+    """
+    Matches a list of keywords against a text. The keywords are lowercased and
+    prepared once: for "any" matches they are compiled into one regular
+    expression that finds the first of them in a single pass, so the cost of a
+    check grows with the length of the text rather than with the number of
+    keywords. For "all" matches keywords that are contained in other keywords
+    are dropped, and the rest is checked longest (i.e. most selective) first.
+    Texts passed to the matcher must be lowercased already.
+    """
+
+    batch_substring_limit = 4   # batches test up to this many keywords one by one
+
+    def __init__(self, keywords):
+        lowered = set(kwd.lower() for kwd in keywords)
+        self._matches_empty = "" in lowered     # "" is found in every text
+        lowered.discard("")
+        ordered = sorted(lowered, key=len, reverse=True)
+        self._ordered = ordered
+        self._single = ordered[0] if len(ordered) == 1 else None
+        self._search = re.compile("|".join(re.escape(kwd) for kwd in ordered)) if len(ordered) > 1 else None
+        self._required = [kwd for i, kwd in enumerate(ordered)
+                          if not any(kwd in longer for longer in ordered[:i])]
+
+    def any(self, text):
+        """
+        True if at least one of the keywords is part of `text`.
+        """
+        if self._matches_empty:
+            return True
+        if self._single is not None:
+            return self._single in text
+        return self._search is not None and self._search.search(text) is not None
+
+    def all(self, text):
+        """
+        True if all keywords are part of `text`.
+        """
+        for kwd in self._required:
+            if kwd not in text:
+                return False
+        return True
+
+    def any_batch(self, batch, tagname):
+        """
+        The mask of all ads in an AdBatch whose `tagname` contains at least one
+        of the keywords.
+        """
+        if self._matches_empty:
+            return batch.full(True)
+        if len(self._ordered) > self.batch_substring_limit:
+            return batch.search(tagname, self._search)
+        mask = batch.full(False)
+        for kwd in self._ordered:   # a few substring tests are faster than the regular expression
+            mask = batch.either(mask, batch.contains(tagname, kwd))
+        return mask
+
+    def all_batch(self, batch, tagname):
+        """
+        The mask of all ads in an AdBatch whose `tagname` contains all keywords.
+        """
+        mask = batch.full(True)
+        for kwd in self._required:
+            mask = batch.both(mask, batch.contains(tagname, kwd))
+            if not batch.count(mask):
+                break
+        return mask
+
+
+def edit_distance(a, b, bound):
+    """
+    The Levenshtein distance of `a` and `b`, or `bound` + 1 if it exceeds
+    `bound`.
+    """
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > bound:
+            return bound + 1
+        previous = current
+    return min(previous[-1], bound + 1)
+
+
+class FuzzyKeywordMatcher(object):
+    """
+    Finds keywords in a text while tolerating typos. A text matches if it
+    contains a keyword exactly, or if one of its words is within the edit
+    distance bound of a keyword ("rebaorder", "re-boarder", "rebord"). The
+    default bound is a third of the keyword length, at most 3, and 0 up to 3
+    characters. An index of character bigrams selects the keywords that share
+    enough bigrams with a word to be within the bound; only those are
+    compared by edit distance. The outcome per word is cached, since the same
+    words occur in many ads. Keywords with spaces are only matched exactly.
+    Texts passed to the matcher must be lowercased already.
+    """
+
+    q = 2   # n-gram length
+    cache_size = 100000
+
+    _word = re.compile(r"[^\W_]+(?:[-.'][^\W_]+)*")
+    _joiners = re.compile(r"[-.']")
+
+    def __init__(self, keywords, max_distance=None):
+        lowered = sorted(set(kwd.lower() for kwd in keywords))
+        self._exact = KeywordMatcher(lowered)
+        self._keywords = []
+        self._bounds = []
+        self._index = dict()    # bigram -> [(keyword number, occurrences)]
+        self._unindexed = []    # keywords so short for their bound that any word may be close
+        for kwd in lowered:
+            bound = max_distance if max_distance is not None else self.default_bound(kwd)
+            if not kwd or " " in kwd or bound <= 0:
+                continue
+            number = len(self._keywords)
+            self._keywords.append(kwd)
+            self._bounds.append(bound)
+            if len(kwd) + self.q - 1 - bound * self.q <= 0:
+                self._unindexed.append(number)
+            counts = dict()
+            for gram in self._grams(kwd):
+                counts[gram] = counts.get(gram, 0) + 1
+            for gram, count in counts.items():
+                self._index.setdefault(gram, []).append((number, count))
+        self._words = dict()
+
+    @staticmethod
+    def default_bound(keyword):
+        return 0 if len(keyword) <= 3 else min(3, len(keyword) // 3)
+
+    @classmethod
+    def _grams(cls, word):
+        padded = "\x02" * (cls.q - 1) + word + "\x03" * (cls.q - 1)
+        return [padded[i:i + cls.q] for i in range(len(padded) - cls.q + 1)]
+
+    def _candidates(self, word):
+        """
+        Numbers of the keywords that may be within their bound of `word`. Two
+        strings within edit distance d share at least max(len) + q - 1 - d*q
+        padded q-grams. Only keywords found in the index are considered, and
+        those for which the bound allows any word.
+        """
+        counts = dict()
+        for gram in self._grams(word):
+            counts[gram] = counts.get(gram, 0) + 1
+        shared = dict.fromkeys(self._unindexed, 0)
+        for gram, count in counts.items():
+            for number, occurrences in self._index.get(gram, ()):
+                shared[number] = shared.get(number, 0) + min(count, occurrences)
+        for number in shared:
+            kwd = self._keywords[number]
+            bound = self._bounds[number]
+            if abs(len(kwd) - len(word)) > bound:
+                continue
+            if shared.get(number, 0) >= max(len(kwd), len(word)) + self.q - 1 - bound * self.q:
+                yield number
+
+    def _matches_word(self, word):
+        try:
+            return self._words[word]
+        except KeyError:
+            pass
+        found = any(edit_distance(word, self._keywords[number], self._bounds[number]) <= self._bounds[number]
+                    for number in self._candidates(word))
+        if len(self._words) >= self.cache_size:
+            self._words.clear()
+        self._words[word] = found
+        return found
+
+    def any(self, text):
+        """
+        True if at least one of the keywords is part of `text`, exactly or
+        as a word with a few typos.
+        """
+        if self._exact.any(text):
+            return True
+        if not self._keywords:
+            return False
+        for word in set(self._word.findall(text)):
+            if self._matches_word(self._joiners.sub("", word)):
+                return True
+        return False
+
+
+def _lowered(ad, tagname, cache):
+    """
+    The lowercased value of a tag. Each tag is lowercased only once per ad.
+    """
+    try:
+        return cache[("lower", tagname)]
+    except KeyError:
+        text = cache[("lower", tagname)] = ad[tagname].lower()
+        return text
+
+
+def _memoized(key, evaluate):
+    def memoized(ad, cache):
+        try:
+            return cache[key]
+        except KeyError:
+            result = cache[key] = evaluate(ad, cache)
+            return result
+    return memoized
+
+
+class CriterionError(ValueError):
+    """
+    Raised if the data of a criterion is invalid.
+    """
+    pass
+
 
 class AdCriterion(object):
+    _registry = dict()  # criterion_type -> class
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "criterion_type" in cls.__dict__:
+            AdCriterion._registry[cls.criterion_type] = cls
+
     def __init__(self, data):
         self._tagname = ""
 
@@ -38,12 +267,57 @@ class AdCriterion(object):
 
     def check(self, ad):
         raise NotImplementedError("AdCriterion has to be subclassed.")
+
+    def evaluate(self, ad, cache):
+        """
+        Same as check(), but `cache` is a dictionary shared by all criteria
+        during the assessment of one ad. Criteria can use it to avoid redundant
+        work (e.g. lowercasing the same tag twice).
+        """
+        return self.check(ad)
+
+    def check_batch(self, batch):
+        """
+        Checks all ads of an AdBatch at once and returns a boolean mask.
+        Criteria that cannot work on columns are evaluated ad by ad.
+        """
+        return batch.evaluate(self.evaluate)
+
+    @property
+    def key(self):
+        """
+        A canonical representation of the criterion. Equal criteria have equal keys.
+        """
+        try:
+            return self._key
+        except AttributeError:
+            self._key = json.dumps(self.serialize(), sort_keys=True, default=str)
+            return self._key
+
+    def subexpressions(self):
+        """
+        The criterion itself and all criteria nested within.
+        """
+        yield self
+
+    def compile(self, shared=frozenset()):
+        """
+        Returns an evaluator `f(ad, cache)` for this criterion, or `True` or
+        `False` if the outcome does not depend on the ad. If the key of the
+        criterion is in `shared`, the same criterion occurs several times in
+        an assessor and its result is memoized in the cache.
+        """
+        return _memoized(self.key, self.evaluate) if self.key in shared else self.evaluate
     
     @classmethod
     def from_json(cls, data):
-        for subclass in AdCriterion.__subclasses__():
-            if subclass.criterion_type == data["type"]:
-                return subclass(data)
+        """
+        Creates a criterion of the registered type `data["type"]`. Returns
+        None for unknown types.
+        """
+        criterion_type = AdCriterion._registry.get(data["type"])
+        if criterion_type is not None:
+            return criterion_type(data)
 
 
 class AdCriterionLessThan(AdCriterion):
@@ -59,6 +333,9 @@ class AdCriterionLessThan(AdCriterion):
         else:
             return False
 
+    def check_batch(self, batch):
+        return batch.at_most(self._tagname, self._limit)
+
     def serialize(self):
         d = super(AdCriterionLessThan, self).serialize()
         d["type"] = self.criterion_type
@@ -79,6 +356,9 @@ class AdCriterionGreaterThan(AdCriterion):
         else:
             return False
 
+    def check_batch(self, batch):
+        return batch.at_least(self._tagname, self._limit)
+
     def serialize(self):
         d = super(AdCriterionGreaterThan, self).serialize()
         d["type"] = self.criterion_type
@@ -92,12 +372,16 @@ class AdCriterionKeywordsAll(AdCriterion):
     def __init__(self, data):
         self._tagname = data["tag"]
         self._keywords = data["keywords"]
+        self._matcher = KeywordMatcher(self._keywords)
     
     def check(self, ad):
-        for kwd in self._keywords:
-            if ad[self._tagname].lower().find(kwd.lower()) < 0:
-                return False
-        return True
+        return self.evaluate(ad, {})
+
+    def evaluate(self, ad, cache):
+        return self._matcher.all(_lowered(ad, self._tagname, cache))
+
+    def check_batch(self, batch):
+        return self._matcher.all_batch(batch, self._tagname)
 
     def serialize(self):
         d = super(AdCriterionKeywordsAll, self).serialize()
@@ -112,12 +396,16 @@ class AdCriterionKeywordsAny(AdCriterion):
     def __init__(self, data):
         self._tagname = data["tag"]
         self._keywords = data["keywords"]
+        self._matcher = KeywordMatcher(self._keywords)
 
     def check(self, ad):
-        for kwd in self._keywords:
-            if ad[self._tagname].lower().find(kwd.lower()) >= 0:
-                return True
-        return False
+        return self.evaluate(ad, {})
+
+    def evaluate(self, ad, cache):
+        return self._matcher.any(_lowered(ad, self._tagname, cache))
+
+    def check_batch(self, batch):
+        return self._matcher.any_batch(batch, self._tagname)
 
     def serialize(self):
         d = super(AdCriterionKeywordsAny, self).serialize()
@@ -132,12 +420,16 @@ class AdCriterionKeywordsNot(AdCriterion):
     def __init__(self, data):
         self._tagname = data["tag"]
         self._keywords = data["keywords"]
+        self._matcher = KeywordMatcher(self._keywords)
 
     def check(self, ad):
-        for kwd in self._keywords:
-            if ad[self._tagname].lower().find(kwd.lower()) >= 0:
-                return False
-        return True
+        return self.evaluate(ad, {})
+
+    def evaluate(self, ad, cache):
+        return not self._matcher.any(_lowered(ad, self._tagname, cache))
+
+    def check_batch(self, batch):
+        return batch.negated(self._matcher.any_batch(batch, self._tagname))
 
     def serialize(self):
         d = super(AdCriterionKeywordsNot, self).serialize()
@@ -146,24 +438,560 @@ class AdCriterionKeywordsNot(AdCriterion):
         return d
 
 
-class AdAssessor:
-    
+class AdCriterionKeywordsFuzzy(AdCriterion):
+    """
+    Like keywords_any, but tolerates typos (see FuzzyKeywordMatcher). The
+    optional `max_distance` overrides the default edit distance bound.
+    """
+    criterion_type = "keywords_fuzzy"
+
+    def __init__(self, data):
+        self._tagname = data["tag"]
+        self._keywords = data["keywords"]
+        self._max_distance = data.get("max_distance")
+        if self._max_distance is not None and (type(self._max_distance) is not int or self._max_distance < 0):
+            raise CriterionError("max_distance must be a non-negative integer")
+        self._matcher = FuzzyKeywordMatcher(self._keywords, self._max_distance)
+
+    def check(self, ad):
+        return self.evaluate(ad, {})
+
+    def evaluate(self, ad, cache):
+        return self._matcher.any(_lowered(ad, self._tagname, cache))
+
+    def serialize(self):
+        d = super(AdCriterionKeywordsFuzzy, self).serialize()
+        d["type"] = self.criterion_type
+        d["keywords"] = self._keywords
+        if self._max_distance is not None:
+            d["max_distance"] = self._max_distance
+        return d
+
+
+class AdCriterionRegex(AdCriterion):
+    """
+    The tag matches a regular expression somewhere. The pattern is compiled
+    once. Unless `ignore_case` is false, it is matched against the lowercased
+    tag.
+    """
+    criterion_type = "regex"
+
+    def __init__(self, data):
+        self._tagname = data["tag"]
+        self._pattern = data["pattern"]
+        self._ignore_case = data.get("ignore_case", True)
+        try:
+            self._regex = re.compile(self._pattern, re.IGNORECASE if self._ignore_case else 0)
+        except (re.error, TypeError) as error:
+            raise CriterionError("Invalid pattern {!r}: {}".format(self._pattern, error))
+
+    def check(self, ad):
+        return self.evaluate(ad, {})
+
+    def evaluate(self, ad, cache):
+        text = _lowered(ad, self._tagname, cache) if self._ignore_case else ad[self._tagname]
+        return self._regex.search(text) is not None
+
+    def check_batch(self, batch):
+        if self._ignore_case:
+            return batch.search(self._tagname, self._regex)
+        return batch.evaluate(self.evaluate)
+
+    def serialize(self):
+        d = super(AdCriterionRegex, self).serialize()
+        d["type"] = self.criterion_type
+        d["pattern"] = self._pattern
+        d["ignore_case"] = self._ignore_case
+        return d
+
+
+class AdCriterionBetween(AdCriterion):
+    """
+    lower <= tag <= upper. The limits are converted to numbers once.
+    """
+    criterion_type = "between"
+
+    def __init__(self, data):
+        self._tagname = data["tag"]
+        try:
+            self._lower = float(data["lower"])
+            self._upper = float(data["upper"])
+        except (TypeError, ValueError) as error:
+            raise CriterionError("Invalid limits for between: {}".format(error))
+        if self._lower > self._upper:
+            raise CriterionError("The lower limit of between must not exceed the upper limit")
+
+    def check(self, ad):
+        return self._lower <= ad[self._tagname] <= self._upper
+
+    def check_batch(self, batch):
+        return batch.both(batch.at_least(self._tagname, self._lower), batch.at_most(self._tagname, self._upper))
+
+    def serialize(self):
+        d = super(AdCriterionBetween, self).serialize()
+        d["type"] = self.criterion_type
+        d["lower"] = self._lower
+        d["upper"] = self._upper
+        return d
+
+
+class AdCriterionInSet(AdCriterion):
+    """
+    The tag equals one of the given values (e.g. one of several zip codes).
+    Values are compared as case-insensitive texts, so a zip code matches
+    whether it was parsed as a number or as a text. The values are put into a
+    set once, so a check costs the same for any number of values.
+    """
+    criterion_type = "in_set"
+
+    def __init__(self, data):
+        self._tagname = data["tag"]
+        self._values = data["values"]
+        if not isinstance(self._values, (list, tuple)):
+            raise CriterionError("The values of in_set must be a list")
+        self._set = frozenset(self._text(value) for value in self._values)
+
+    @staticmethod
+    def _text(value):
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)  # 1100.0 is written as 1100
+        return str(value).lower()
+
+    def check(self, ad):
+        return self.evaluate(ad, {})
+
+    def evaluate(self, ad, cache):
+        value = ad[self._tagname]
+        if isinstance(value, str):
+            return _lowered(ad, self._tagname, cache) in self._set
+        return self._text(value) in self._set
+
+    def serialize(self):
+        d = super(AdCriterionInSet, self).serialize()
+        d["type"] = self.criterion_type
+        d["values"] = self._values
+        return d
+
+
+class AdCriterionWithinRadius(AdCriterion):
+    """
+    The postal code in the tag lies within `radius_km` of `center`, which is
+    either a postal code or a [lat, lon] pair. The codes within the radius
+    are looked up once in the bundled offline table (see geo.ZipCentroids),
+    so a check is a set lookup.
+    """
+    criterion_type = "within_radius"
+
+    def __init__(self, data):
+        self._tagname = data["tag"]
+        self._center = data["center"]
+        table = ZipCentroids.bundled()
+        try:
+            self._radius = float(data["radius_km"])
+            if isinstance(self._center, (list, tuple)):
+                location = (float(self._center[0]), float(self._center[1]))
+            else:
+                location = table.locate(self._center)
+        except (TypeError, ValueError, IndexError) as error:
+            raise CriterionError("Invalid within_radius criterion: {}".format(error))
+        if location is None:
+            raise CriterionError("Unknown postal code: {}".format(self._center))
+        self._codes = table.within(location, self._radius)
+
+    def check(self, ad):
+        return str(ad[self._tagname]).strip() in self._codes
+
+    def serialize(self):
+        d = super(AdCriterionWithinRadius, self).serialize()
+        d["type"] = self.criterion_type
+        d["center"] = self._center
+        d["radius_km"] = self._radius
+        return d
+
+
+class AdCriterionGroup(object):
+    """
+    Common behaviour of the boolean groups `and`, `or` and `not`, which nest
+    other criteria. A group compiles its tree into a single evaluator: nested
+    groups of the same kind are flattened, duplicates are dropped, constant
+    parts (e.g. empty groups) are folded and double negations removed.
+    """
+
+    def serialize(self):
+        return {"type": self.criterion_type, "criteria": [criterion.serialize() for criterion in self._criteria]}
+
+    def _parse(self, data):
+        criteria = [AdCriterion.from_json(child) for child in data]
+        if any(criterion is None for criterion in criteria):
+            raise TypeError("Unknown criterion type in {}".format(data))
+        return criteria
+
+    @property
+    def tagname(self):
+        return None
+
+    @property
+    def criteria(self):
+        return self._criteria
+
+    def subexpressions(self):
+        yield self
+        for criterion in self._criteria:
+            for sub in criterion.subexpressions():
+                yield sub
+
+    def check(self, ad):
+        return self.evaluate(ad, {})
+
+    def evaluate(self, ad, cache):
+        try:
+            compiled = self._compiled
+        except AttributeError:
+            compiled = self._compiled = self.compile()
+        if compiled is True or compiled is False:
+            return compiled
+        return compiled(ad, cache)
+
+    def _flat(self):
+        for criterion in self._criteria:
+            if type(criterion) is type(self):
+                for nested in criterion._flat():
+                    yield nested
+            else:
+                yield criterion
+
+    def _compile_junction(self, shared, absorbing):
+        """
+        Compiles an `and` (absorbing=False) or an `or` (absorbing=True).
+        """
+        keys = set()
+        parts = []
+        for criterion in self._flat():
+            if criterion.key in keys:
+                continue
+            keys.add(criterion.key)
+            part = criterion.compile(shared)
+            if part is absorbing:
+                return absorbing
+            if part is not (not absorbing):
+                parts.append(part)
+        for criterion in self._flat():
+            if isinstance(criterion, AdCriterionNot) and criterion.criteria[0].key in keys:
+                return absorbing    # x and not x, x or not x
+        if not parts:
+            return not absorbing
+        if len(parts) == 1:
+            evaluate = parts[0]
+        elif absorbing:
+            def evaluate(ad, cache):
+                for part in parts:
+                    if part(ad, cache):
+                        return True
+                return False
+        else:
+            def evaluate(ad, cache):
+                for part in parts:
+                    if not part(ad, cache):
+                        return False
+                return True
+        return _memoized(self.key, evaluate) if self.key in shared else evaluate
+
+
+class AdCriterionAnd(AdCriterionGroup, AdCriterion):
+    criterion_type = "and"
+
+    def __init__(self, data):
+        self._criteria = self._parse(data["criteria"])
+
+    def check_batch(self, batch):
+        mask = batch.full(True)
+        for criterion in self._criteria:
+            mask = batch.within(mask, criterion.check_batch)
+            if not batch.count(mask):
+                break
+        return mask
+
+    def compile(self, shared=frozenset()):
+        return self._compile_junction(shared, absorbing=False)
+
+
+class AdCriterionOr(AdCriterionGroup, AdCriterion):
+    criterion_type = "or"
+
+    def __init__(self, data):
+        self._criteria = self._parse(data["criteria"])
+
+    def check_batch(self, batch):
+        mask = batch.full(False)
+        for criterion in self._criteria:
+            mask = batch.either(mask, batch.within(batch.negated(mask), criterion.check_batch))
+            if batch.count(mask) == len(batch):
+                break
+        return mask
+
+    def compile(self, shared=frozenset()):
+        return self._compile_junction(shared, absorbing=True)
+
+
+class AdCriterionNot(AdCriterionGroup, AdCriterion):
+    criterion_type = "not"
+
+    def __init__(self, data):
+        self._criteria = self._parse([data["criterion"]])
+
+    def serialize(self):
+        return {"type": self.criterion_type, "criterion": self._criteria[0].serialize()}
+
+    def check_batch(self, batch):
+        return batch.negated(self._criteria[0].check_batch(batch))
+
+    def compile(self, shared=frozenset()):
+        inner = self._criteria[0]
+        if isinstance(inner, AdCriterionNot):
+            return inner.criteria[0].compile(shared)
+        part = inner.compile(shared)
+        if part is True or part is False:
+            return not part
+        def evaluate(ad, cache):
+            return not part(ad, cache)
+        return _memoized(self.key, evaluate) if self.key in shared else evaluate
+
+
+class TimingHistogram(object):
+    """
+    Counts durations in buckets of powers of two nanoseconds.
+    """
+
+    __slots__ = ("counts",)
+
     def __init__(self):
+        self.counts = [0] * 64
+
+    def add(self, ns):
+        self.counts[min(ns.bit_length(), 63)] += 1
+
+    def serialize(self):
+        """
+        The non-empty buckets as [upper bound in ns, count] pairs.
+        """
+        return [[1 << i, count] for i, count in enumerate(self.counts) if count]
+
+
+class CriterionStats(object):
+    """
+    Observed behaviour of a criterion within an assessor. The timing
+    histogram is optional, since it is not needed for ordering criteria.
+    """
+
+    __slots__ = ("evaluations", "rejections", "ns", "histogram")
+
+    def __init__(self, histogram=False):
+        self.evaluations = 0
+        self.rejections = 0
+        self.ns = 0     # cumulative time spent in evaluations
+        self.histogram = TimingHistogram() if histogram else None
+
+    @property
+    def passes(self):
+        return self.evaluations - self.rejections
+
+    @property
+    def rejection_rate(self):
+        return self.rejections / self.evaluations if self.evaluations else 0.0
+
+    @property
+    def mean_ns(self):
+        return self.ns / self.evaluations if self.evaluations else 0.0
+
+    @property
+    def rank(self):
+        """
+        Expected cost per rejection. Criteria with a low rank are evaluated
+        first. The rejection rate is smoothed, so criteria that never rejected
+        yet (or were rarely evaluated) are not pushed to the end forever.
+        """
+        return self.mean_ns * (self.evaluations + 2) / (self.rejections + 1)
+
+    def serialize(self):
+        d = {"evaluations": self.evaluations, "passes": self.passes, "rejections": self.rejections, "ns": self.ns}
+        if self.histogram is not None:
+            d["histogram"] = self.histogram.serialize()
+        return d
+
+
+class AdAssessor:
+    """
+    Checks ads against a list of criteria that all must be met. Evaluation
+    stops at the first criterion that fails. The assessor measures the cost
+    and the rejection rate of each criterion and periodically reorders them,
+    so cheap and selective criteria (e.g. a price limit) run before expensive
+    ones (e.g. long keyword lists). With `histograms` set, the durations of
+    all checks and evaluations are recorded in timing histograms as well.
+    """
+
+    reorder_interval = 100  # checks between two reorderings
+
+    def __init__(self, histograms=False):
+        self._histograms = histograms
         self._criteria = []
+        self._stats = []
+        self._order = []
+        self._compiled = []
+        self._checks = 0
+        self._totals = CriterionStats(histograms)   # whole checks
     
     def add_criterion(self, criterion):
         if not isinstance(criterion, AdCriterion):
             raise TypeError("Expected type AdCriterion. Got {}".format(type(criterion)))
         self._criteria.append(criterion)
+        self._stats.append(CriterionStats(self._histograms))
+        self._order.append(len(self._criteria) - 1)
+        self._compile()
+
+    def _compile(self):
+        """
+        Compiles all criteria. Subexpressions that occur more than once are
+        evaluated only once per ad.
+        """
+        counts = dict()
+        for criterion in self._criteria:
+            for sub in criterion.subexpressions():
+                counts[sub.key] = counts.get(sub.key, 0) + 1
+        shared = frozenset(key for key, count in counts.items() if count > 1)
+        self._compiled = [self._constant(criterion.compile(shared)) for criterion in self._criteria]
+
+    @staticmethod
+    def _constant(compiled):
+        if compiled is True or compiled is False:
+            return lambda ad, cache: compiled
+        return compiled
     
     def add_criteria(self, *args):
         for arg in args:
             self.add_criterion(arg)
+
+    def updated(self, criteria):
+        """
+        A new assessor with `criteria`. Criteria this assessor has already are
+        taken over with their statistics, so their compiled matchers and their
+        learned position are kept. This assessor is not changed and can be
+        used until the new one replaces it.
+        """
+        assessor = AdAssessor(self._histograms)
+        known = dict()
+        for criterion, stats in zip(self._criteria, self._stats):
+            known.setdefault(criterion.key, (criterion, stats))
+        for criterion in criteria:
+            if not isinstance(criterion, AdCriterion):
+                raise TypeError("Expected type AdCriterion. Got {}".format(type(criterion)))
+            criterion, stats = known.pop(criterion.key, (criterion, None))
+            assessor._criteria.append(criterion)
+            assessor._stats.append(stats if stats is not None else CriterionStats(self._histograms))
+            assessor._order.append(len(assessor._criteria) - 1)
+        assessor._reorder()
+        assessor._compile()
+        return assessor
             
     @property
     def criteria(self):
+        """
+        The criteria in the order they were added.
+        """
         return self._criteria
-    
-    def check(self, ad):
-        return all([criterion.check(ad) for criterion in self._criteria])
 
+    @property
+    def order(self):
+        """
+        The criteria in the order they are currently evaluated.
+        """
+        return [self._criteria[i] for i in self._order]
+
+    def statistics(self):
+        """
+        Per-criterion statistics in the order the criteria were added.
+        """
+        positions = {i: position for position, i in enumerate(self._order)}
+        return [dict(criterion=criterion.serialize(), position=positions[i], **self._stats[i].serialize())
+                for i, criterion in enumerate(self._criteria)]
+
+    def totals(self):
+        """
+        Statistics of whole checks: every check is one evaluation, which is
+        rejected if any criterion fails.
+        """
+        return self._totals.serialize()
+
+    def _reorder(self):
+        # A list that is sorted in place reads as empty meanwhile, so other
+        # threads (e.g. statistics()) get a new list instead.
+        self._order = sorted(self._order, key=lambda i: self._stats[i].rank)
+    
+    def check(self, ad, cache=None):
+        """
+        True if `ad` meets all criteria. Assessors that check the same ad may
+        share a `cache`; it only holds values that depend on the ad alone.
+        """
+        cache = dict() if cache is None else cache
+        compiled = self._compiled
+        stats = self._stats
+        result = True
+        total_ns = 0
+        for i in self._order:
+            start = time.perf_counter_ns()
+            passed = compiled[i](ad, cache)
+            ns = time.perf_counter_ns() - start
+            total_ns += ns
+            stat = stats[i]
+            stat.ns += ns
+            stat.evaluations += 1
+            if stat.histogram is not None:
+                stat.histogram.add(ns)
+            if not passed:
+                stat.rejections += 1
+                result = False
+                break
+        totals = self._totals
+        totals.evaluations += 1
+        totals.ns += total_ns
+        if not result:
+            totals.rejections += 1
+        if totals.histogram is not None:
+            totals.histogram.add(total_ns)
+        self._checks += 1
+        if self._checks % self.reorder_interval == 0:
+            self._reorder()
+        return result
+
+    def check_batch(self, ads):
+        """
+        Checks a whole page of ads at once and returns a boolean mask with one
+        entry per ad. The ads are converted into columns (see AdBatch), so
+        numeric criteria become vector comparisons and keyword criteria scan
+        all ads in one go. This pays off for backfills and replays of many ads.
+        Like check(), each criterion only sees the ads that passed all criteria
+        before it, so the result is the same. Counters are updated per ad that
+        was evaluated, but histograms are not, since single ads are not timed.
+        """
+        batch = ads if isinstance(ads, AdBatch) else AdBatch(ads)
+        mask = batch.full(True)
+        remaining = len(batch)
+        total_ns = 0
+        for i in self._order:
+            if not remaining:
+                break
+            start = time.perf_counter_ns()
+            mask = batch.within(mask, self._criteria[i].check_batch)
+            passed = batch.count(mask)
+            ns = time.perf_counter_ns() - start
+            total_ns += ns
+            stat = self._stats[i]
+            stat.ns += ns
+            stat.evaluations += remaining
+            stat.rejections += remaining - passed
+            remaining = passed
+        self._totals.evaluations += len(batch)
+        self._totals.rejections += len(batch) - remaining
+        self._totals.ns += total_ns
+        self._checks += len(batch)
+        self._reorder()
+        return mask
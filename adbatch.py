@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+try:
+    import numpy
+except ImportError:     # batches work without NumPy, just slower
+    numpy = None
+
+
+class AdBatch(object):
+    """
+    A page of ads in columns, for checking all of them at once. Columns are
+    built on first use and cached: numeric columns are NumPy arrays, text
+    columns are lists of lowercased texts that keyword criteria scan in one
+    tight loop. Masks are NumPy boolean arrays, or lists of bools if NumPy is
+    missing.
+    """
+
+    def __init__(self, ads):
+        self._ads = list(ads)
+        self._numbers = dict()
+        self._texts = dict()
+        self._caches = None
+
+    def __len__(self):
+        return len(self._ads)
+
+    @property
+    def ads(self):
+        return self._ads
+
+    def _ad_caches(self):
+        """
+        One cache per ad for evaluating criteria ad by ad.
+        """
+        if self._caches is None:
+            self._caches = [dict() for _ in self._ads]
+        return self._caches
+
+    def evaluate(self, evaluate):
+        """
+        The mask of a criterion that can only be evaluated ad by ad.
+        """
+        return self._mask(evaluate(ad, cache) for ad, cache in zip(self._ads, self._ad_caches()))
+
+    def _mask(self, values):
+        if numpy is not None:
+            return numpy.array(list(values), dtype=bool).reshape(len(self._ads))
+        return list(values)
+
+    def full(self, value):
+        if numpy is not None:
+            return numpy.full(len(self._ads), value, dtype=bool)
+        return [value] * len(self._ads)
+
+    def both(self, mask, other):
+        if numpy is not None:
+            return mask & other
+        return [a and b for a, b in zip(mask, other)]
+
+    def either(self, mask, other):
+        if numpy is not None:
+            return mask | other
+        return [a or b for a, b in zip(mask, other)]
+
+    def negated(self, mask):
+        if numpy is not None:
+            return ~mask
+        return [not a for a in mask]
+
+    def indices(self, mask):
+        """
+        The positions of all ads selected by `mask`.
+        """
+        if numpy is not None:
+            return numpy.flatnonzero(mask).tolist()
+        return [i for i, selected in enumerate(mask) if selected]
+
+    def select(self, indices):
+        """
+        A batch of the ads at `indices`. The ad caches are shared with this
+        batch, columns are built anew.
+        """
+        selected = AdBatch([self._ads[i] for i in indices])
+        caches = self._ad_caches()
+        selected._caches = [caches[i] for i in indices]
+        return selected
+
+    def within(self, mask, check):
+        """
+        The mask of all ads selected by `mask` that pass `check`, a function
+        that returns the mask of a batch. Only the selected ads are passed to
+        `check`, just as a criterion is not evaluated for an ad that an earlier
+        one already rejected.
+        """
+        count = self.count(mask)
+        if count == len(self._ads):
+            return check(self)
+        result = self.full(False)
+        if count:
+            indices = self.indices(mask)
+            hits = check(self.select(indices))
+            if numpy is not None:
+                result[indices] = hits
+            else:
+                for i, hit in zip(indices, hits):
+                    result[i] = hit
+        return result
+
+    def count(self, mask):
+        return int(numpy.count_nonzero(mask)) if numpy is not None else sum(mask)
+
+    def _numeric(self, tagname):
+        """
+        A numeric column as NumPy array, or None if NumPy is missing or the
+        values are not all numbers.
+        """
+        try:
+            return self._numbers[tagname]
+        except KeyError:
+            pass
+        column = None
+        if numpy is not None:
+            values = [ad[tagname] for ad in self._ads]
+            if all(type(value) in (int, float) for value in values):
+                column = numpy.array(values)
+        self._numbers[tagname] = column
+        return column
+
+    def at_most(self, tagname, limit):
+        """
+        The mask of all ads with `tagname` <= `limit`.
+        """
+        column = self._numeric(tagname)
+        if column is None:
+            return self._mask(limit >= ad[tagname] for ad in self._ads)
+        return column <= limit
+
+    def at_least(self, tagname, limit):
+        """
+        The mask of all ads with `tagname` >= `limit`.
+        """
+        column = self._numeric(tagname)
+        if column is None:
+            return self._mask(limit <= ad[tagname] for ad in self._ads)
+        return column >= limit
+
+    def lowered(self, tagname):
+        """
+        The lowercased texts of a tag, one per ad.
+        """
+        try:
+            return self._texts[tagname]
+        except KeyError:
+            column = self._texts[tagname] = [ad[tagname].lower() for ad in self._ads]
+            return column
+
+    def contains(self, tagname, keyword):
+        """
+        The mask of all ads whose lowercased `tagname` contains `keyword`.
+        """
+        return self._mask([keyword in text for text in self.lowered(tagname)])
+
+    def search(self, tagname, pattern):
+        """
+        The mask of all ads whose lowercased `tagname` matches the compiled
+        regular expression `pattern` somewhere.
+        """
+        search = pattern.search
+        return self._mask([search(text) is not None for text in self.lowered(tagname)])
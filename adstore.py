@@ -24,9 +24,12 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import os
 import pickle
 import datetime
-from threading import RLock
+from threading import RLock, Lock
+from collections.abc import Mapping
+from storewriter import StoreWriter
 
 
 class AdKeyError(Exception):
@@ -63,17 +66,129 @@ class Ad(dict):
         self[self._datetime_tag] = value
 
 
+class AdRecord(Mapping):
+    """
+    A compact, read-mostly alternative to `Ad`. Concrete record types are
+    created per profile schema with `ad_record_type()`. The field layout is
+    shared by all records of a type, so each record only stores its values in
+    `__slots__` instead of carrying a dictionary of its own. Records behave like
+    read-only mappings (`ad["title"]`, `"{title}".format(**ad)`), existing tags
+    can be reassigned with `ad["price"] = 30`.
+    """
+
+    __slots__ = ()
+    _fields = ()
+    _slot_of = {}
+    _key_tag = None
+    _datetime_tag = None
+
+    def __init__(self, tags):
+        for tag, value in tags.items():
+            try:
+                setattr(self, self._slot_of[tag], value)
+            except KeyError:
+                raise AttributeError("Tag '{}' is not part of the record layout.".format(tag))
+        if (self._key_tag not in tags.keys()):
+            raise AttributeError("Key tag not present.")
+        if (self._datetime_tag not in tags.keys()):
+            raise AttributeError("Datetime tag not present.")
+
+    def __getitem__(self, tag):
+        try:
+            return getattr(self, self._slot_of[tag])
+        except AttributeError:
+            raise KeyError(tag)
+
+    def __setitem__(self, tag, value):
+        if tag not in self._slot_of:
+            raise KeyError("Tag '{}' is not part of the record layout.".format(tag))
+        setattr(self, self._slot_of[tag], value)
+
+    def __iter__(self):
+        for tag in self._fields:
+            if hasattr(self, self._slot_of[tag]):
+                yield tag
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, dict(self))
+
+    def __reduce__(self):
+        tags = tuple(self)
+        values = tuple(self[tag] for tag in tags)
+        if len(tags) == len(self._fields):
+            tags = None     # the common case, saves repeating the tag names for every record
+        return (_make_record, (self._fields, self._key_tag, self._datetime_tag, tags, values))
+
+    @property
+    def key(self):
+        return self[self._key_tag]
+
+    @key.setter
+    def key(self, value):
+        self[self._key_tag] = value
+
+    @property
+    def datetime(self):
+        return self[self._datetime_tag]
+
+    @datetime.setter
+    def datetime(self, value):
+        self[self._datetime_tag] = value
+
+
+_record_types = {}
+_record_types_lock = RLock()
+
+
+def ad_record_type(tags, key_tag, datetime_tag, name="AdRecord"):
+    """
+    Returns the record type for the given schema. Types are cached, so all
+    connectors using the same profile share one class and one field layout.
+    """
+    fields = tuple(sorted(set(tags) | {key_tag, datetime_tag}))
+    with _record_types_lock:
+        try:
+            return _record_types[(fields, key_tag, datetime_tag)]
+        except KeyError:
+            pass
+        slots = tuple("_f{}".format(i) for i in range(len(fields)))
+        record_type = type(name, (AdRecord,), {
+            "__slots__": slots,
+            "_fields": fields,
+            "_slot_of": dict(zip(fields, slots)),
+            "_key_tag": key_tag,
+            "_datetime_tag": datetime_tag,
+        })
+        _record_types[(fields, key_tag, datetime_tag)] = record_type
+        return record_type
+
+
+def _make_record(fields, key_tag, datetime_tag, tags, values):
+    record_type = ad_record_type(fields, key_tag, datetime_tag)
+    return record_type(dict(zip(fields if tags is None else tags, values)))
+
+
 class AdStore(object):
     
-    def __init__(self, path = None, autosave = True, autosort = True):
+    def __init__(self, path = None, autosave = True, autosort = True, write_behind = False,
+                 flush_interval = 5.0, flush_threshold = 100):
         """
-        'flag' has the same meaning as the 'flag' parameter in anydbm.open()
+        If 'write_behind' is set, autosave does not write to disk within add_ads()
+        and remove_ads(). A background StoreWriter saves the store instead, after
+        'flush_interval' seconds or 'flush_threshold' changes.
         """
         self._path = path
         self._autosave = autosave
         self._autosort = autosort
         self._lock = RLock()
+        self._save_lock = Lock()
+        self._writer = None
         self.load()
+        if write_behind and path:
+            self._writer = StoreWriter(self, flush_interval, flush_threshold)
     
     def _sort_by_date(self):
         try:
@@ -85,14 +200,44 @@ class AdStore(object):
         return len(self._ads)
     
     def save(self):
-        self._lock.acquire()
         if not self._path: return
-        try:
-            with open(self._path, "wb") as f:
-                pickler = pickle.Pickler(f)
-                pickler.dump(self._ads)
-        except: raise
+        self._lock.acquire()
+        ads = list(self._ads)   # a snapshot, so mutations don't have to wait for the disk
         self._lock.release()
+        with self._save_lock:
+            tmp_path = self._path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickler = pickle.Pickler(f)
+                pickler.dump(ads)
+            os.replace(tmp_path, self._path)
+        return True
+
+    def _changed(self, mutations):
+        if not self._autosave or mutations == 0: return
+        writer = self._writer
+        if writer is not None:
+            writer.notify(mutations)
+        else:
+            self.save()
+
+    def flush(self):
+        """
+        Writes all pending changes to disk.
+        """
+        writer = self._writer
+        if writer is not None:
+            return writer.flush()
+        return self.save()
+
+    def close(self):
+        """
+        Writes all pending changes and stops the background writer. Later
+        changes are saved synchronously again. Returns `False` if pending
+        changes could not be saved.
+        """
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            return writer.close()
         return True
     
     def load(self):
@@ -117,14 +262,14 @@ class AdStore(object):
         """
         self._lock.acquire()
         added_ads = []
-        cur_keys = [ad.key for ad in self._ads]
-        new_keys = [ad.key for ad in ads]
-        for i in range(len(new_keys)):
-            if new_keys[i] not in cur_keys:
-                self._ads.append(ads[i])
-                added_ads.append(ads[i])
+        cur_keys = set(ad.key for ad in self._ads)
+        for ad in ads:
+            if ad.key not in cur_keys:
+                cur_keys.add(ad.key)
+                self._ads.append(ad)
+                added_ads.append(ad)
         if self._autosort: self._sort_by_date()
-        if self._autosave: self.save()
+        self._changed(len(added_ads))
         self._lock.release()
         return added_ads
     
@@ -140,7 +285,7 @@ class AdStore(object):
                 del cur_keys[idx]
                 removed_ads.append(ads[i])
         if self._autosort: self._sort_by_date()
-        if self._autosave: self.save()
+        self._changed(len(removed_ads))
         self._lock.release()
         return removed_ads
 
@@ -57,7 +57,7 @@ def api_call(handler):
         finally:
             # Make sure the API can be used from every other domain (CORS)
             bottle.response.headers['Access-Control-Allow-Origin'] = '*'
-            bottle.response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, OPTIONS'
+            bottle.response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, PATCH, OPTIONS'
             bottle.response.headers['Access-Control-Allow-Headers'] = 'Origin, Accept, Content-Type, X-Requested-With, X-CSRF-Token'
     return wrapper
 
@@ -86,6 +86,10 @@ class WebApi(CommandApi):
     def _get_observer(self, name):
         return {"command": "get_observer", "name": name}
 
+    @api_call
+    def _get_observer_statistics(self, name):
+        return {"command": "get_observer", "name": name, "statistics": True}
+
     @api_call
     def _set_config(self, pathname=None):
         try:
@@ -114,6 +118,13 @@ class WebApi(CommandApi):
         cmd["name"] = name
         return cmd
 
+    @api_call
+    def _update_observer(self, name):
+        cmd = bottle.request.json
+        cmd["command"] = "update_observer"
+        cmd["name"] = name
+        return cmd
+
     @api_call
     def _remove_observer(self, name):
         return {"command": "remove_observer", "name": name}
@@ -125,6 +136,14 @@ class WebApi(CommandApi):
         cmd["observer"] = name
         return cmd
 
+    @api_call
+    def _evaluate_criteria(self, name=None):
+        cmd = bottle.request.json
+        cmd["command"] = "evaluate_criteria"
+        if name is not None:
+            cmd["observer"] = name
+        return cmd
+
     @api_call
     def _pause_observer(self, name):
         return {"command": "pause_observer", "name": name}
@@ -147,11 +166,15 @@ class WebApi(CommandApi):
         self._bottle.route("/api/list/commands", "GET")(self._list_commands)
         self._bottle.route("/api/observer/<name>", "GET")(self._get_observer)
         self._bottle.route("/api/observer/<name>", ["PUT", "OPTIONS"])(self._create_observer)
+        self._bottle.route("/api/observer/<name>", "PATCH")(self._update_observer)
         self._bottle.route("/api/observer/<name>", "DELETE")(self._remove_observer)
         self._bottle.route("/api/observer/<name>/pause", ["PUT", "OPTIONS"])(self._pause_observer)
         self._bottle.route("/api/observer/<name>/resume", ["PUT", "OPTIONS"])(self._resume_observer)
         self._bottle.route("/api/observer/<name>/state", "GET")(self._observer_state)
+        self._bottle.route("/api/observer/<name>/statistics", "GET")(self._get_observer_statistics)
         self._bottle.route("/api/observer/<name>/notification", ["POST", "OPTIONS"])(self._add_notification)
+        self._bottle.route("/api/observer/<name>/evaluate", ["POST", "OPTIONS"])(self._evaluate_criteria)
+        self._bottle.route("/api/evaluate", ["POST", "OPTIONS"])(self._evaluate_criteria)
         self._bottle.route("/api/config", ["GET", "OPTIONS"])(self._get_config)
         self._bottle.route("/api/config/<pathname:path>", ["GET", "OPTIONS"])(self._get_config)
         self._bottle.route("/api/config", "PUT")(self._set_config)
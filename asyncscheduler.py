@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import heapq
+import asyncio
+import logging
+from itertools import count
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Event, current_thread
+from scheduler import ready_entry, record_lateness
+
+
+class AsyncScheduler(object):
+    """
+    Runs the polls of all observers as coroutines on a single event loop
+    thread. It is a drop-in replacement for the Scheduler: schedule() and
+    cancel() may be called from any thread. Jobs with a `poll_async(executor)`
+    coroutine are awaited on the loop, other jobs get their `poll()` run in
+    the executor. Blocking work (fetching, parsing, notifications) is done by
+    `workers` executor threads, so thousands of observers share a handful of
+    threads. A job is never polled twice at the same time.
+
+    At most `workers` polls run at once. Due jobs wait in the same order by
+    priority, deadline and `aging` as in the Scheduler.
+    """
+
+    def __init__(self, workers=8, aging=60.0):
+        self._workers = workers
+        self._aging = aging
+        self._loop = None
+        self._thread = None
+        self._executor = None
+        self._handles = dict()  # job -> asyncio.TimerHandle
+        self._running = dict()  # job -> True if it should be polled again right away, includes ready jobs
+        self._ready = []        # heap of ready_entry() tuples
+        self._polls = 0         # polls in progress
+        self._sequence = count()
+        self._quit = False
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        self._executor = ThreadPoolExecutor(self._workers, thread_name_prefix="AsyncSchedulerWorker")
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(self._executor)
+        self._thread = Thread(target=self._run_loop, name="AsyncScheduler", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+            self._executor.shutdown(wait=False)
+
+    def schedule(self, job, delay=0, keep_earlier=False):
+        """
+        Polls `job` after `delay` seconds. A job that is already scheduled is
+        moved to the new time, unless `keep_earlier` is set and it is due
+        earlier than that.
+        """
+        if self._quit:
+            return
+        self._start()
+        due = time.monotonic() + delay
+        self._call(self._schedule, job, due, keep_earlier)
+
+    def cancel(self, job):
+        """
+        Removes `job` from the schedule. A poll that is running already is
+        not interrupted.
+        """
+        if self._thread is not None and not self._quit:
+            self._call(self._cancel, job)
+
+    def _call(self, callback, *args):
+        """
+        Runs `callback` on the loop and waits for it, so the schedule is up to
+        date when schedule() or cancel() return.
+        """
+        if current_thread() is self._thread:
+            callback(*args)
+            return
+        done = Event()
+        def call():
+            try:
+                callback(*args)
+            finally:
+                done.set()
+        try:
+            self._loop.call_soon_threadsafe(call)
+        except RuntimeError:
+            return  # the loop is closed after quit()
+        while not done.wait(0.1):
+            if not self._thread.is_alive():
+                return
+
+    def __len__(self):
+        """
+        The number of scheduled jobs.
+        """
+        return len(self._handles)
+
+    def _schedule(self, job, due, keep_earlier):
+        if self._quit:
+            return
+        handle = self._handles.get(job)
+        if handle is not None:
+            if keep_earlier and self._due(handle) <= due:
+                return
+            handle.cancel()
+        when = self._loop.time() + max(0.0, due - time.monotonic())
+        self._handles[job] = self._loop.call_at(when, self._dispatch, job, due)
+
+    def _due(self, handle):
+        return time.monotonic() + handle.when() - self._loop.time()
+
+    def _cancel(self, job):
+        handle = self._handles.pop(job, None)
+        if handle is not None:
+            handle.cancel()
+        if job in self._running:
+            self._running[job] = False
+
+    def _dispatch(self, job, due):
+        del self._handles[job]
+        if job in self._running:
+            self._running[job] = True   # polled again as soon as the running poll is done
+            return
+        self._running[job] = False
+        heapq.heappush(self._ready, ready_entry(job, due, next(self._sequence), self._aging))
+        self._start_polls()
+
+    def _start_polls(self):
+        while self._ready and self._polls < self._workers:
+            *_, due, job = heapq.heappop(self._ready)
+            self._polls += 1
+            self._loop.create_task(self._poll(job, due))
+
+    async def _poll(self, job, due):
+        record_lateness(job, due)
+        try:
+            if hasattr(job, "poll_async"):
+                delay = await job.poll_async(self._executor)
+            else:
+                delay = await self._loop.run_in_executor(self._executor, job.poll)
+        except Exception:
+            logging.exception("Scheduled job {} failed and is not polled again".format(job))
+            delay = None
+        self._polls -= 1
+        self._start_polls()
+        if self._running.pop(job) and delay is not None:
+            delay = 0   # it was due again during the poll
+        if delay is not None:
+            self._schedule(job, time.monotonic() + delay, keep_earlier=True)
+        if self._quit and not self._running:
+            self._loop.stop()
+
+    def quit(self):
+        """
+        Stops the event loop. Running polls are finished first.
+        """
+        self._quit = True
+        if self._thread is not None:
+            self._call(self._stop)
+
+    def _stop(self):
+        for handle in self._handles.values():
+            handle.cancel()
+        self._handles.clear()
+        for *_, job in self._ready:
+            del self._running[job]
+        self._ready.clear()
+        for job in self._running:
+            self._running[job] = False
+        if not self._running:
+            self._loop.stop()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+Memory per ad of dict based `Ad` objects versus slotted `AdRecord` objects.
+
+Usage: python3 benchmark/benchadrecord.py [number of ads]
+"""
+
+import sys
+import pickle
+
+from common import WILLHABEN_TAGS, willhaben_like_tags, measure
+from adstore import Ad, ad_record_type
+
+
+def main(n):
+    record_type = ad_record_type(WILLHABEN_TAGS, "id", "datetime", "WillhabenAd")
+    all_tags = [willhaben_like_tags(nr) for nr in range(n)]     # the values are shared by both variants
+
+    print("{:<12} {:>18} {:>18} {:>12}".format("{} ads".format(n), "bytes per ad", "pickled per ad", "build [s]"))
+    for label, build in (("Ad", lambda: [Ad(tags, "id", "datetime") for tags in all_tags]),
+                         ("AdRecord", lambda: [record_type(tags) for tags in all_tags])):
+        ads, size, elapsed = measure(build)
+        pickled = len(pickle.dumps(ads))
+        print("{:<12} {:>18.1f} {:>18.1f} {:>12.3f}".format(label, size / n, pickled / n, elapsed))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
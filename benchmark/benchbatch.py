@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+Checking ads one by one with AdAssessor.check() versus whole pages with
+AdAssessor.check_batch(), for numeric, keyword and mixed criteria.
+
+Usage: python3 benchmark/benchbatch.py [number of ads]
+"""
+
+import sys
+import time
+import random
+
+from common import willhaben_like_tags
+import adbatch
+from adstore import Ad
+from adassessor import AdAssessor, AdCriterion
+
+CRITERIA = {
+    "numeric": [{"type": "less_than", "tag": "price", "limit": 300},
+                {"type": "greater_than", "tag": "price", "limit": 50}],
+    "keywords": [{"type": "keywords_any", "tag": "title", "keywords": ["buggy", "reboarder", "kinderwagen"]},
+                 {"type": "keywords_not", "tag": "description", "keywords": ["defekt", "bastler"]}],
+    "mixed": [{"type": "less_than", "tag": "price", "limit": 300},
+              {"type": "keywords_all", "tag": "title", "keywords": ["reboarder", "nummer 1"]},
+              {"type": "keywords_not", "tag": "description", "keywords": ["defekt"]}],
+}
+
+
+def assessor(criteria):
+    assessor = AdAssessor()
+    for criterion in criteria:
+        assessor.add_criterion(AdCriterion.from_json(criterion))
+    return assessor
+
+
+def main(n):
+    rnd = random.Random(1)
+    ads = []
+    for nr in range(n):
+        tags = willhaben_like_tags(nr)
+        tags["price"] = float(rnd.randint(0, 1000))
+        ads.append(Ad(tags, "id", "datetime"))
+    print("NumPy: {}".format("yes" if adbatch.numpy is not None else "no (pure Python fallback)"))
+    print("{:>10} {:>14} {:>14} {:>14}".format("criteria", "per ad [ms]", "batch [ms]", "hits"))
+    for name, criteria in CRITERIA.items():
+        start = time.perf_counter()
+        per_ad = assessor(criteria)
+        expected = [per_ad.check(ad) for ad in ads]
+        single = (time.perf_counter() - start) * 1e3
+        start = time.perf_counter()
+        mask = assessor(criteria).check_batch(ads)
+        batch = (time.perf_counter() - start) * 1e3
+        assert [bool(hit) for hit in mask] == expected
+        print("{:>10} {:>14.1f} {:>14.1f} {:>14}".format(name, single, batch, sum(expected)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
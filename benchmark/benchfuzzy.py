@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+keywords_fuzzy: comparing every word of an ad with every keyword by edit
+distance versus the FuzzyKeywordMatcher with its bigram prefilter and word
+cache.
+
+Usage: python3 benchmark/benchfuzzy.py [number of ads]
+"""
+
+import re
+import sys
+import time
+import random
+
+from common import willhaben_like_tags
+from adassessor import FuzzyKeywordMatcher, edit_distance
+
+
+def naive_any(keywords, text):
+    words = re.findall(r"\w+", text)
+    return any(kwd in text or any(edit_distance(word, kwd, 2) <= 2 for word in words) for kwd in keywords)
+
+
+def main(n):
+    rnd = random.Random(1)
+    vocabulary = ["wort{}".format(i) for i in range(2000)]
+    texts = []
+    for nr in range(n):
+        tags = willhaben_like_tags(nr)
+        texts.append((" ".join(rnd.sample(vocabulary, 8)) + " " + tags["description"]).lower())
+    print("{:>10} {:>16} {:>16}".format("keywords", "naive [us/ad]", "fuzzy [us/ad]"))
+    for count in (1, 10, 50):
+        keywords = (["laufrad", "hochstuhl", "wickeltisch"] + ["begriff{:03d}".format(i) for i in range(count)])[:count]
+        start = time.perf_counter()
+        for text in texts[:max(1, n // 10)]:
+            naive_any(keywords, text)
+        naive = (time.perf_counter() - start) / max(1, n // 10) * 1e6
+        matcher = FuzzyKeywordMatcher(keywords)
+        start = time.perf_counter()
+        for text in texts:
+            matcher.any(text)
+        fuzzy = (time.perf_counter() - start) / n * 1e6
+        print("{:>10} {:>16.1f} {:>16.1f}".format(len(keywords), naive, fuzzy))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+Keyword criteria: the former per-keyword str.find() scan versus the
+compiled KeywordMatcher, for growing keyword lists.
+
+Usage: python3 benchmark/benchkeywords.py [number of ads]
+"""
+
+import sys
+import time
+import random
+
+from common import willhaben_like_tags
+from adassessor import AdCriterionKeywordsAny, AdCriterionKeywordsAll
+
+
+def find_any(keywords, tagname, ad):
+    for kwd in keywords:
+        if ad[tagname].lower().find(kwd.lower()) >= 0:
+            return True
+    return False
+
+
+def find_all(keywords, tagname, ad):
+    for kwd in keywords:
+        if ad[tagname].lower().find(kwd.lower()) < 0:
+            return False
+    return True
+
+
+def timed(check, ads):
+    start = time.perf_counter()
+    for ad in ads:
+        check(ad)
+    return (time.perf_counter() - start) / len(ads) * 1e6
+
+
+def main(n):
+    rnd = random.Random(1)
+    ads = [willhaben_like_tags(nr) for nr in range(n)]
+    words = ["kw{:04d}".format(i) for i in range(1000)]
+    print("{:>10} {:>16} {:>16} {:>16} {:>16}".format("keywords", "find any [us]", "compiled any", "find all [us]",
+                                                     "compiled all"))
+    for count in (1, 5, 50, 500):
+        keywords = rnd.sample(words, count - 1) + ["reboarder"]
+        criterion_any = AdCriterionKeywordsAny({"tag": "description", "keywords": keywords})
+        keywords_all = ["reboarder", "wien"] + keywords[:count - 2]     # mostly misses, like a real all-list
+        criterion_all = AdCriterionKeywordsAll({"tag": "description", "keywords": keywords_all})
+        print("{:>10} {:>16.2f} {:>16.2f} {:>16.2f} {:>16.2f}".format(
+            count,
+            timed(lambda ad: find_any(keywords, "description", ad), ads),
+            timed(criterion_any.check, ads),
+            timed(lambda ad: find_all(keywords_all, "description", ad), ads),
+            timed(criterion_all.check, ads)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
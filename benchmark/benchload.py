@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+Runs a server with many observers against a local stand-in for willhaben.at
+(fakewillhaben.py) and reports for every number of observers the CPU load and
+memory of the server process, its thread count, the page fetch latency and
+the time from publishing an ad to its notification. Observers are created by
+a JsonScript or through the web API. The stand-in runs in a process of its own
+so its load is not counted.
+
+Usage: python3 benchmark/benchload.py [--observers 100 500 1000 2000] [--runtime threads|asyncio]
+           [--workers 8] [--interval 10] [--rate 0.02] [--warmup 10] [--duration 30] [--api script|web]
+"""
+
+import os
+import json
+import time
+import argparse
+import tempfile
+import threading
+import resource
+import multiprocessing
+import urllib.request
+
+import common     # noqa: F401 (puts the repository on sys.path)
+import fakewillhaben
+from server import Server
+from connector import Connector
+from notifications import Notification
+from api.jsonscript import JsonScript
+
+
+class Probe(Notification):
+    """
+    Records the delay from publishing to notification of every found ad.
+    """
+
+    def __init__(self, delays):
+        self._delays = delays
+
+    def notify(self, ad):
+        published = float(ad["description"].rsplit(" ", 1)[1])
+        self._delays.append(time.time() - published)
+
+    def serialize(self):
+        return dict(type="probe")
+
+
+class FetchTimer(object):
+    """
+    Records the duration of every page fetch of all connectors.
+    """
+
+    def __init__(self):
+        self.durations = list()
+        self._get_page = Connector._get_page
+        Connector._get_page = self._timed_get_page_factory()
+
+    def _timed_get_page_factory(self):
+        get_page = self._get_page
+        durations = self.durations
+
+        def timed_get_page(connector, page):
+            start = time.perf_counter()
+            try:
+                return get_page(connector, page)
+            finally:
+                durations.append(time.perf_counter() - start)
+        return timed_get_page
+
+    def restore(self):
+        Connector._get_page = self._get_page
+
+
+def start_stand_in(rate, page_size):
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.get_context("spawn").Process(
+        target=fakewillhaben.serve, args=(0, rate, page_size, sender), daemon=True)
+    process.start()
+    return process, receiver.recv()
+
+
+def rss():
+    """
+    The resident memory of this process in MB. Without /proc the peak is
+    taken instead.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def observer_commands(number, run, port, interval):
+    return [dict(command="create_observer", name="load{}-{}".format(run, i),
+                 url="http://127.0.0.1:{}/run{}/category{}".format(port, run, i),
+                 profile="Willhaben", store=False, criteria=[], interval=interval)
+            for i in range(number)]
+
+
+def create_by_script(server, commands):
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(commands, f)
+    try:
+        JsonScript(server, f.name).run()
+    finally:
+        os.remove(f.name)
+
+
+def create_by_web_api(server, commands):
+    server.start_web_api()
+    server._web_api.wait_ready()
+    for cmd in commands:
+        cmd = dict(cmd)
+        url = "http://{}:{}/api/observer/{}".format(server.config.web.host, server.config.web.port,
+                                                     cmd.pop("name"))
+        del cmd["command"]
+        request = urllib.request.Request(url, data=json.dumps(cmd).encode("utf-8"), method="PUT",
+                                         headers={"Content-Type": "application/json"})
+        urllib.request.urlopen(request).read()
+
+
+def measure(number, run, args, port, fetch_timer):
+    server = Server()
+    server.start()
+    config = dict(command="set_config", config=dict(scheduler=dict(workers=args.workers, runtime=args.runtime),
+                                                    web=dict(port=args.web_port)))
+    commands = observer_commands(number, run, port, args.interval)
+    start = time.perf_counter()
+    if args.api == "web":
+        create_by_script(server, [config])
+        create_by_web_api(server, commands)
+    else:
+        create_by_script(server, [config] + commands)
+    setup = time.perf_counter() - start
+
+    delays = list()
+    for observer in server:
+        observer.notifications.add_notification(Probe(delays))
+    time.sleep(args.warmup)
+
+    del delays[:]
+    del fetch_timer.durations[:]
+    threads = 0
+    wall, cpu = time.perf_counter(), time.process_time()
+    end = wall + args.duration
+    while time.perf_counter() < end:
+        threads = max(threads, threading.active_count())
+        time.sleep(min(1.0, max(0.0, end - time.perf_counter())))
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    fetches, notified = list(fetch_timer.durations), list(delays)
+    memory = rss()
+
+    server.quit()
+    server.join()
+    return dict(observers=number, setup=setup, cpu=100 * cpu / wall, rss=memory, threads=threads,
+                fetches=len(fetches) / wall, fetch_p50=1000 * percentile(fetches, 0.5),
+                fetch_p95=1000 * percentile(fetches, 0.95), notified=len(notified),
+                notify_p50=percentile(notified, 0.5), notify_p95=percentile(notified, 0.95),
+                notify_max=max(notified, default=float("nan")))
+
+
+def main(args):
+    stand_in, port = start_stand_in(args.rate, args.page_size)
+    fetch_timer = FetchTimer()
+    print("runtime {}, {} workers, interval {} s, {} ads/s per observer, {} s per run, observers created by {}"
+          .format(args.runtime, args.workers, args.interval, args.rate, args.duration, args.api))
+    print("{:>9} {:>8} {:>6} {:>8} {:>8} {:>10} {:>10} {:>10} {:>9} {:>9} {:>9} {:>9}".format(
+          "observers", "setup s", "cpu %", "rss MB", "threads", "fetches/s", "fetch p50", "fetch p95",
+          "notified", "delay p50", "delay p95", "delay max"))
+    try:
+        for run, number in enumerate(args.observers):
+            result = measure(number, run, args, port, fetch_timer)
+            print("{observers:>9} {setup:>8.2f} {cpu:>6.1f} {rss:>8.1f} {threads:>8} {fetches:>10.1f} "
+                  "{fetch_p50:>8.1f}ms {fetch_p95:>8.1f}ms {notified:>9} {notify_p50:>8.2f}s "
+                  "{notify_p95:>8.2f}s {notify_max:>8.2f}s".format(**result))
+    finally:
+        fetch_timer.restore()
+        stand_in.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--observers", type=int, nargs="+", default=[100, 500, 1000, 2000])
+    parser.add_argument("--runtime", choices=["threads", "asyncio"], default="threads")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--interval", type=float, default=10, help="seconds between polls of an observer")
+    parser.add_argument("--rate", type=float, default=0.02, help="ads per second and observer")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--warmup", type=float, default=10, help="seconds before measuring")
+    parser.add_argument("--duration", type=float, default=30, help="seconds measured per run")
+    parser.add_argument("--api", choices=["script", "web"], default="script")
+    parser.add_argument("--web-port", type=int, default=8119)
+    main(parser.parse_args())
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+Many saved searches on one feed: checking every ad with every search's
+assessor versus the Percolator, which only checks the searches its keyword
+and range index returns.
+
+Usage: python3 benchmark/benchpercolator.py [number of ads]
+"""
+
+import sys
+import time
+import random
+
+from common import willhaben_like_tags
+from adstore import Ad
+from adassessor import AdAssessor, AdCriterion
+from percolator import Percolator
+
+
+def search(rnd, words):
+    assessor = AdAssessor()
+    kind = rnd.random()
+    if kind < 0.5:
+        assessor.add_criterion(AdCriterion.from_json(
+            {"type": "keywords_all", "tag": "title", "keywords": rnd.sample(words, 2)}))
+    elif kind < 0.9:
+        assessor.add_criterion(AdCriterion.from_json(
+            {"type": "keywords_any", "tag": "title", "keywords": rnd.sample(words, 3)}))
+    assessor.add_criterion(AdCriterion.from_json(
+        {"type": "less_than", "tag": "price", "limit": rnd.randint(0, 100) if kind >= 0.9 else 1000}))
+    return assessor
+
+
+def main(n):
+    rnd = random.Random(1)
+    words = ["wort{:04d}".format(i) for i in range(3000)]
+    ads = []
+    for nr in range(n):
+        tags = willhaben_like_tags(nr)
+        tags["title"] = " ".join(rnd.sample(words, 5))
+        ads.append(Ad(tags, "id", "datetime"))
+    print("{:>10} {:>16} {:>16} {:>12} {:>10}".format("searches", "each [us/ad]", "percolator", "candidates", "hits"))
+    for count in (10, 100, 1000, 5000):
+        assessors = [search(rnd, words) for _ in range(count)]
+        percolator = Percolator()
+        for nr, assessor in enumerate(assessors):
+            percolator.add(nr, assessor)
+        percolator.candidates(ads[0])   # builds the index
+        start = time.perf_counter()
+        expected = [[nr for nr, assessor in enumerate(assessors) if assessor.check(ad)] for ad in ads]
+        each = (time.perf_counter() - start) / n * 1e6
+        start = time.perf_counter()
+        found = [sorted(percolator.match(ad)) for ad in ads]
+        percolated = (time.perf_counter() - start) / n * 1e6
+        assert found == expected
+        candidates = sum(len(percolator.candidates(ad)) for ad in ads) / n
+        print("{:>10} {:>16.1f} {:>16.1f} {:>12.1f} {:>10}".format(
+            count, each, percolated, candidates, sum(len(hits) for hits in found)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+Processing one fetch in Observer._process_ads: checking, clearing duplicates,
+storing and updating the time mark. Compares the former implementation
+(frozenset based duplicate removal and sorting for the time mark) with the
+single pass over large pages. Every ad occurs twice, as on pages that shift
+while they are fetched.
+
+Usage: python3 benchmark/benchprocess.py [number of ads]
+"""
+
+import sys
+import time
+import datetime
+from itertools import compress
+
+from common import willhaben_like_tags, WILLHABEN_TAGS
+from adstore import Ad, AdStore, ad_record_type
+from adassessor import AdAssessor, AdCriterion
+from observer import Observer
+
+CRITERIA = [{"type": "less_than", "tag": "price", "limit": 300}]
+
+
+def observer():
+    assessor = AdAssessor()
+    for criterion in CRITERIA:
+        assessor.add_criterion(AdCriterion.from_json(criterion))
+    observer = Observer("http://www.willhaben.at/", "Willhaben", AdStore(), assessor, None)
+    observer._time_mark = datetime.datetime(2000, 1, 1)    # before all synthetic ads
+    return observer
+
+
+def former_process_ads(observer, ads):
+    hits = map(observer._assessor.check, ads)
+    hit_ads = [ad for ad in compress(ads, hits)]
+    new_ads = observer._store.add_ads(hit_ads)
+    new_ads = [dict(y) for y in set([frozenset(x.items()) for x in new_ads])]
+    observer._time_mark = sorted(ads, key = lambda ad: ad.datetime)[-1].datetime
+    return new_ads
+
+
+def main(n):
+    record_type = ad_record_type(WILLHABEN_TAGS, "id", "datetime")
+    print("{:>8} {:>8} {:>14} {:>14} {:>8}".format("ads", "type", "former [ms]", "stream [ms]", "stored"))
+    for size in (n // 10, n):
+        tags = [willhaben_like_tags(nr) for nr in range(size // 2)] * 2
+        for name, make in (("Ad", lambda t: Ad(t, "id", "datetime")), ("record", record_type)):
+            ads = [make(t) for t in tags]
+            former = observer()
+            start = time.perf_counter()
+            former_process_ads(former, ads)
+            former_ms = (time.perf_counter() - start) * 1e3
+            current = observer()
+            start = time.perf_counter()
+            current._process_ads(ads)
+            current_ms = (time.perf_counter() - start) * 1e3
+            assert current._time_mark == former._time_mark
+            assert current.store.length() == len(set(ad.key for ad in ads if ad["price"] <= 300))
+            print("{:>8} {:>8} {:>14.1f} {:>14.1f} {:>8}".format(size, name, former_ms, current_ms,
+                                                               current.store.length()))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
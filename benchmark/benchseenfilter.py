@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+Memory per key of the different ways to remember processed ads.
+
+Usage: python3 benchmark/benchseenfilter.py [number of keys]
+"""
+
+import sys
+
+from common import willhaben_like_tags, measure
+from adstore import Ad, AdStore
+from seenfilter import SeenFilter
+
+
+def willhaben_like_ad(nr):
+    return Ad(willhaben_like_tags(nr), "id", "datetime")
+
+
+def main(n):
+    print("{:<32} {:>14} {:>12} {:>10}".format("variant ({} keys)".format(n), "bytes per key", "build [s]", "fp rate"))
+
+    def build_store():
+        store = AdStore(autosave=False, autosort=False)
+        store.add_ads([willhaben_like_ad(nr) for nr in range(n)])
+        return store
+    _, size, elapsed = measure(build_store)
+    print("{:<32} {:>14.1f} {:>12.3f} {:>10}".format("AdStore (full ads)", size / n, elapsed, "-"))
+
+    _, size, elapsed = measure(lambda: set(100000000 + nr for nr in range(n)))
+    print("{:<32} {:>14.1f} {:>12.3f} {:>10}".format("set of keys", size / n, elapsed, "-"))
+
+    for error_rate in (0.01, 0.001, 0.0001):
+        def build_filter():
+            seen = SeenFilter(capacity=n, error_rate=error_rate)
+            for nr in range(n):
+                seen.add(100000000 + nr)
+            return seen
+        seen, size, elapsed = measure(build_filter)
+        probes = min(n, 100000)
+        fp = sum(1 for nr in range(probes) if 200000000 + nr in seen) / probes
+        print("{:<32} {:>14.2f} {:>12.3f} {:>10.5f}".format(
+            "SeenFilter (p={})".format(error_rate), seen.size_in_bytes / n, elapsed, fp))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+Time to open a store with a large history and to answer the first lookup,
+pickle based AdStore versus MappedAdStore.
+
+Usage: python3 benchmark/benchstoreopen.py [number of ads]
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+from common import WILLHABEN_TAGS, willhaben_like_tags
+from adstore import AdStore, ad_record_type
+from mappedstore import MappedAdStore
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main(n):
+    record_type = ad_record_type(WILLHABEN_TAGS, "id", "datetime", "WillhabenAd")
+    ads = [record_type(willhaben_like_tags(nr)) for nr in range(n)]
+    new_ad = record_type(willhaben_like_tags(n))
+    directory = tempfile.mkdtemp()
+    print("{:<16} {:>12} {:>18} {:>14}".format("{} ads".format(n), "open [ms]", "first add_ads [ms]", "size [MB]"))
+    for label, cls, filename in (("AdStore", AdStore, "store.db"), ("MappedAdStore", MappedAdStore, "store.mdb")):
+        path = os.path.join(directory, filename)
+        store = cls(path, autosave=False)
+        store.add_ads(ads)
+        store.save()
+        store, open_time = timed(lambda: cls(path, autosave=False))
+        _, add_time = timed(lambda: store.add_ads([new_ad]))
+        size = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory)
+                   if f.startswith(filename))
+        print("{:<16} {:>12.1f} {:>18.3f} {:>14.1f}".format(label, open_time * 1000, add_time * 1000, size / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+Synthetic data and measurement helpers shared by the benchmarks.
+"""
+
+import os
+import sys
+import time
+import datetime
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+WILLHABEN_TAGS = ["id", "url", "title", "price", "description", "image", "zip", "city", "datetime",
+                  "milage", "year", "horsepower", "fuel"]
+
+
+def willhaben_like_tags(nr):
+    """
+    The tags of a Willhaben market place ad as returned by the profile.
+    """
+    return {"id": 100000000 + nr,
+            "url": "http://www.willhaben.at/iad/kaufen-und-verkaufen/d/ad-{}/".format(nr),
+            "title": "Kinderwagen Reboarder Nummer {}".format(nr),
+            "price": float(nr % 500),
+            "description": "Gut erhaltener Reboarder, abzuholen in Wien. Nichtraucherhaushalt.",
+            "image": "http://cache.willhaben.at/mmo/{}.jpg".format(nr),
+            "zip": "1100",
+            "city": "Wien",
+            "datetime": datetime.datetime(2014, 7, 7) + datetime.timedelta(minutes=nr),
+            "milage": 0,
+            "year": 0,
+            "horsepower": 0,
+            "fuel": 0}
+
+
+def measure(build):
+    """
+    Returns the built object, the memory it occupies and the build time. The
+    time is taken in a separate run since tracemalloc slows things down a lot.
+    """
+    start = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, after - before, elapsed
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+A local stand-in for willhaben.at that serves synthetic market place result
+pages, parsable by the Willhaben profile. Every path is a category of its own
+in which ads are published at random with a mean rate of `rate` ads per
+second. Ads carry their publish time (seconds since the epoch) at the end of
+their description, so the time from publishing to notification can be
+measured. Their datetime tag counts one minute per ad, since the profile only
+parses minutes and ads must not share a minute.
+
+Usage: python3 benchmark/fakewillhaben.py [--port 8800] [--rate 0.2] [--page-size 50]
+"""
+
+import time
+import random
+import argparse
+import datetime
+import itertools
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PAGE = """<html><head><meta name="description" content="Marktplatz - synthetic result list"></head>
+<body><ul id="resultlist">
+{}
+</ul></body></html>"""
+
+AD = """<li class="media">
+<a href="/iad/kaufen-und-verkaufen/d/ad-{id}/"><img src="http://cache.willhaben.at/mmo/{id}.jpg"/></a>
+<div><a id="{id}" href="/iad/kaufen-und-verkaufen/d/ad-{id}/"></a>
+<a href="/iad/kaufen-und-verkaufen/d/ad-{id}/"><span>{title}</span></a></div>
+<p class="bot-1"><span>1100 Wien<br/>{datetime}</span></p>
+<p class="info-2">&euro; {price},-</p>
+<p class="info-3">Gut erhalten, abzuholen in Wien. published {published:.6f}</p>
+</li>"""
+
+
+class Feed(object):
+    """
+    The ads of all categories. A category starts publishing when it is first
+    requested and keeps the newest `pages` pages of ads.
+    """
+
+    def __init__(self, rate, page_size, pages=10, seed=1):
+        self._rate = rate
+        self._page_size = page_size
+        self._kept = page_size * pages
+        self._lock = threading.Lock()
+        self._rnd = random.Random(seed)
+        self._ids = itertools.count(100000000)
+        self._start = datetime.datetime.now().replace(second=0, microsecond=0)
+        self._categories = dict()   # path -> [ads, time of the next ad]
+
+    def page(self, path, page):
+        now = time.time()
+        with self._lock:
+            ads, next_time = self._categories.get(path, ([], now + self._rnd.expovariate(self._rate)))
+            while next_time <= now:
+                nr = next(self._ids)
+                ads.append(dict(id=nr, title="Kinderwagen Reboarder Nummer {}".format(nr), price=nr % 500,
+                                datetime=(self._start + datetime.timedelta(minutes=nr - 100000000)).strftime(
+                                    "%d.%m.%Y %H:%M"),
+                                published=next_time))
+                next_time += self._rnd.expovariate(self._rate)
+            del ads[:-self._kept]
+            self._categories[path] = (ads, next_time)
+            newest = len(ads) - page * self._page_size
+            selected = ads[max(0, newest - self._page_size):max(0, newest)]
+        return PAGE.format("\n".join(AD.format(**ad) for ad in reversed(selected)))
+
+
+def handler(feed):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            query = dict(urllib.parse.parse_qsl(url.query))
+            # the profile pages with page=1, page=1&p=1, page=2&p=1, ...
+            page = int(query.get("page", 1)) - 1 + ("p" in query)
+            body = feed.page(url.path, page).encode("ISO-8859-1")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=ISO-8859-1")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port=0, rate=0.2, page_size=50, connection=None):
+    """
+    Serves the feed until the process ends. The port is sent to `connection`
+    once the server listens, which is how benchload.py runs it in a process of
+    its own.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler(Feed(rate, page_size)))
+    server.daemon_threads = True
+    if connection is not None:
+        connection.send(server.server_address[1])
+    else:
+        print("Serving synthetic Willhaben pages at http://127.0.0.1:{}/".format(server.server_address[1]))
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--rate", type=float, default=0.2, help="ads per second and category")
+    parser.add_argument("--page-size", type=int, default=50)
+    args = parser.parse_args()
+    serve(args.port, args.rate, args.page_size)
@@ -26,9 +26,13 @@ SOFTWARE.
 
 import profiles
 from adstore import AdStore
-from adassessor import AdAssessor, AdCriterion
+from mappedstore import MappedAdStore
+from seenfilter import SeenFilter, SeenKeyStore, SeenFilterError
+from adassessor import AdAssessor, AdCriterion, CriterionError
 from notificationserver import NotificationServer
-from observer import Observer
+from observer import Observer, SearchGroup, SavedSearch, AdaptiveInterval
+from connector import ads_from_corpus
+from evaluation import evaluate_criteria
 from threading import Condition
 from config import FixedTreeError
 
@@ -140,7 +144,130 @@ class GetConfig(Command):
             raise CommandError("Config path {} does not exist".format(path))
         return {path_fragments[-1]: node}
 
-class CreateObserverCommand(Command):
+def _create_assessor(criteria, histograms=False):
+    assessor = AdAssessor(histograms)
+    try:
+        for json in criteria:
+            assessor.add_criterion(AdCriterion.from_json(json))
+    except (CriterionError, TypeError) as error:    # invalid data or unknown criterion type
+        raise CommandError(error.args[0])
+    return assessor
+
+
+def _histograms(server, cmd_info):
+    """
+    Timing histograms are recorded if the command or the configuration asks for them.
+    """
+    return cmd_info.get("histograms", server.config.statistics.histograms)
+
+
+def _adaptive_interval(cmd_info):
+    """
+    The `adaptive` key turns on adaptive polling. It holds the options of an
+    AdaptiveInterval, e.g. {"target": 5, "min_interval": 30, "max_interval": 900}.
+    """
+    options = cmd_info.get("adaptive")
+    if not options:
+        return None
+    if options is True:
+        options = dict()
+    try:
+        return AdaptiveInterval(cmd_info["interval"], **options)
+    except (ValueError, TypeError) as error:
+        raise CommandError("Invalid adaptive interval options: {}".format(error))
+
+
+def _time_mark_path(persistent, name):
+    """
+    Observers with a persistent store also keep their time mark, so they
+    only catch up on what they missed after a restart.
+    """
+    if not persistent:
+        return None
+    if not os.path.exists("./store/"): os.mkdir("store")
+    return "store/timemark.{}.txt".format(name)
+
+
+def _fetch_order(cmd_info):
+    """
+    The optional `priority` and `max_staleness` (seconds) of an observer.
+    """
+    try:
+        priority = int(cmd_info.get("priority", 0))
+        max_staleness = cmd_info.get("max_staleness")
+        if max_staleness is not None:
+            max_staleness = float(max_staleness)
+    except (ValueError, TypeError) as error:
+        raise CommandError("Invalid priority or max_staleness: {}".format(error))
+    return dict(priority=priority, max_staleness=max_staleness)
+
+
+def _remove_replaced(server, name):
+    """
+    Stops an observer that is about to be replaced and closes its store. The
+    new observer may open the same store file, which must not happen before
+    the old store has saved its pending changes.
+    """
+    if name in server.observers():
+        logging.info("Replacing observer '{}' on server".format(name))
+        server.remove_observer(name)
+
+
+class _StoreSetup(object):
+    """
+    Creates the ad store of an observer or a saved search as given by the
+    `store` and `seen_filter` keys of a command.
+    """
+
+    def _setup_store(self, persistent, profile, store_name):
+        if persistent == "shared":  # one store for all observers, ads are stored only once
+            return self._server.shared_store.view(store_name, profile.name)
+        save_file = None    # Ads that have already been processed are registered in this file
+        if persistent:
+            if not os.path.exists("./store/"): os.mkdir("store")
+            save_file = "store/adstore.{}.db".format(store_name)
+        if "seen_filter" not in self._cmd_info:
+            return self._create_ad_store(save_file)
+        return self._setup_seen_filter(self._cmd_info["seen_filter"], persistent, save_file, store_name)
+
+    def _create_ad_store(self, save_file):
+        store_format = self._server.config.store.format
+        if store_format == "pickle":
+            return AdStore(path=save_file, **self._write_behind_options())
+        elif store_format == "mapped":
+            # Opens instantly. An existing pickle store is imported in the background.
+            mapped_file = save_file and os.path.splitext(save_file)[0] + ".mdb"
+            return MappedAdStore(path=mapped_file, import_path=save_file, **self._write_behind_options())
+        raise CommandError("Unknown store format: {}".format(store_format))
+
+    def _write_behind_options(self):
+        config = self._server.config.store
+        return dict(write_behind=config.write_behind,
+                    flush_interval=config.flush_interval,
+                    flush_threshold=config.flush_threshold)
+
+    def _setup_seen_filter(self, options, persistent, save_file, store_name):
+        """
+        A seen filter either replaces the ad store (`keep_ads` is false) or sits in front of it.
+        """
+        filter_file = None
+        if persistent:
+            filter_file = "store/seen.{}.bloom".format(store_name)
+        try:
+            seen_filter = SeenFilter(path=filter_file,
+                                     capacity=options.get("capacity", 100000),
+                                     error_rate=options.get("error_rate", 0.001))
+        except (ValueError, TypeError, AttributeError) as error:
+            raise CommandError("Invalid seen filter options: {}".format(error))
+        except SeenFilterError as error:
+            raise CommandError("Cannot open the seen filter: {}".format(error))
+        store = None
+        if options.get("keep_ads", True):
+            store = self._create_ad_store(save_file)
+        return SeenKeyStore(seen_filter, store, **self._write_behind_options())
+
+
+class CreateObserverCommand(_StoreSetup, Command):
     """
     Create and setup a new observer. If an older observer is running with the 
     same name, it will be replaced by the new observer.
@@ -150,30 +277,101 @@ class CreateObserverCommand(Command):
     def execute(self):
         logging.info("Setting up observer '{}'".format(self._cmd_info["name"]))
         profile = profiles.get_profile_by_name(self._cmd_info["profile"])
-        store = self._setup_store(self._cmd_info["store"])
-        assessor = AdAssessor()
-        for json in self._cmd_info["criteria"]:
-            assessor.add_criterion(AdCriterion.from_json(json))
+        adaptive = _adaptive_interval(self._cmd_info)
+        fetch_order = _fetch_order(self._cmd_info)
+        assessor = _create_assessor(self._cmd_info["criteria"], _histograms(self._server, self._cmd_info))
+        url, interval = self._cmd_info["url"], self._cmd_info["interval"]
+        time_mark_path = _time_mark_path(self._cmd_info["store"], self._cmd_info["name"])
+        _remove_replaced(self._server, self._cmd_info["name"])
+        # The store is opened last, nothing fails after it and leaves it open
+        store = self._setup_store(self._cmd_info["store"], profile, self._cmd_info["name"])
         notification_server = NotificationServer()  # Add an empty notification server
-        observer = Observer(url=self._cmd_info["url"], profile=profile, # Setup the actual observer
+        observer = Observer(url=url, profile=profile, # Setup the actual observer
                             store=store, assessor=assessor,
                             notifications=notification_server,
-                            update_interval=self._cmd_info["interval"],
-                            name=self._cmd_info["name"])
+                            update_interval=interval,
+                            name=self._cmd_info["name"],
+                            adaptive=adaptive,
+                            time_mark_path=time_mark_path,
+                            **fetch_order)
         
         self._server.add_observer(observer)
 
-    def _setup_store(self, persistent):
-        save_file = None    # Ads that have already been processed are registered in this file
-        if persistent:
-            if not os.path.exists("./store/"): os.mkdir("store")
-            save_file = "store/adstore.{}.db".format(self._cmd_info["name"])
-        return AdStore(path=save_file)
+
+class CreateSearchGroupCommand(Command):
+    """
+    Create a search group: an observer that fetches ads once for many saved
+    searches. Searches are added with the add_search command. If an older
+    observer is running with the same name, it will be replaced. With `store`
+    set, the time mark of the group is kept across restarts.
+    """
+    name = "create_search_group"
+
+    def execute(self):
+        logging.info("Setting up search group '{}'".format(self._cmd_info["name"]))
+        profile = profiles.get_profile_by_name(self._cmd_info["profile"])
+        adaptive, fetch_order = _adaptive_interval(self._cmd_info), _fetch_order(self._cmd_info)
+        _remove_replaced(self._server, self._cmd_info["name"])    # its time mark is loaded again
+        group = SearchGroup(url=self._cmd_info["url"], profile=profile,
+                            update_interval=self._cmd_info["interval"],
+                            name=self._cmd_info["name"],
+                            adaptive=adaptive,
+                            time_mark_path=_time_mark_path(self._cmd_info.get("store", False),
+                                                           self._cmd_info["name"]),
+                            **fetch_order)
+        self._server.add_observer(group)
+
+
+class AddSearchCommand(_StoreSetup, Command):
+    """
+    Add a saved search to a search group. A search with the same name is
+    replaced.
+    """
+    name = "add_search"
+
+    def execute(self):
+        group = self._search_group(self._server, self._cmd_info)
+        search_name = self._cmd_info["name"]
+        logging.info("Adding search '{}' to search group '{}'".format(search_name, group.name))
+        assessor = _create_assessor(self._cmd_info["criteria"], _histograms(self._server, self._cmd_info))
+        if search_name in (search.name for search in group.searches):
+            group.remove_search(search_name)    # its store is closed before the file is opened again
+        store = self._setup_store(self._cmd_info.get("store", False), group.profile,
+                                  "{}.{}".format(group.name, search_name))
+        group.add_search(SavedSearch(search_name, assessor, store, NotificationServer()))
+
+    @staticmethod
+    def _search_group(server, cmd_info):
+        if "group" not in cmd_info:
+            raise CommandError("The command must specify a search group.")
+        try:
+            group = server[cmd_info["group"]]
+        except KeyError as error:
+            raise CommandError(error.args[0])
+        if not isinstance(group, SearchGroup):
+            raise CommandError("Observer '{}' is not a search group.".format(cmd_info["group"]))
+        return group
+
+
+class RemoveSearchCommand(Command):
+    """
+    Remove a saved search from a search group.
+    """
+    name = "remove_search"
+
+    def execute(self):
+        group = AddSearchCommand._search_group(self._server, self._cmd_info)
+        try:
+            group.remove_search(self._cmd_info["name"])
+        except KeyError:
+            raise CommandError("Search group '{}' has no search '{}'".format(group.name, self._cmd_info["name"]))
 
 
 class AddNotificationCommand(Command):
     """
-    Adds a new notification and associates it with a running observer.
+    Adds a new notification and associates it with a running observer. With
+    the optional `search` key, the notification is associated with a saved
+    search of a search group instead.
     """
     name = "add_notification"
 
@@ -181,14 +379,24 @@ class AddNotificationCommand(Command):
         notification_type = self._cmd_info["type"]
         observer_name = self._cmd_info["observer"]
         logging.info("Adding {} notification to observer '{}'".format(notification_type, observer_name))
-        notification = None
+        notification = self.create_notification()
+        target = self._server[observer_name]
+        if "search" in self._cmd_info:
+            try:
+                target = target.search(self._cmd_info["search"])
+            except (AttributeError, KeyError):
+                raise CommandError("Observer '{}' has no search '{}'".format(observer_name, self._cmd_info["search"]))
+        target.notifications.add_notification(notification)
+
+    def create_notification(self):
+        notification_type = self._cmd_info.get("type")
         if notification_type == "email":
-            notification = self._setup_email_notification()
+            return self._setup_email_notification()
         elif notification_type == "pushbullet":
-            notification = self._setup_pushbullet_notification()
+            return self._setup_pushbullet_notification()
         elif notification_type == "pushjet":
-            notification = self._setup_pushjet_notification()
-        self._server[observer_name].notifications.add_notification(notification)
+            return self._setup_pushjet_notification()
+        raise CommandError("Unknown notification type: {}".format(notification_type))
 
     def _setup_pushbullet_notification(self):
         try:
@@ -247,6 +455,51 @@ class AddNotificationCommand(Command):
         return email_notification
 
 
+class UpdateObserverCommand(Command):
+    """
+    Changes a running observer in place. Any of `criteria`, `interval`,
+    `adaptive`, `priority`, `max_staleness` and `notifications` (a list of
+    add_notification arguments, replacing all notifications) can be given.
+    A `max_staleness` of null goes back to the default.
+    Unlike create_observer, the store, the time mark and the connection are
+    kept, and criteria that did not change keep their compiled matchers and
+    statistics.
+    """
+    name = "update_observer"
+
+    def execute(self):
+        if "name" not in self._cmd_info:
+            raise CommandError("The update_observer command must specify a name.")
+        try:
+            observer = self._server[self._cmd_info["name"]]
+        except KeyError as error:
+            raise CommandError(error.args[0])
+        logging.info("Updating observer '{}'".format(observer.name))
+        changes = dict()    # everything is set up first, so an invalid part changes nothing
+        if "criteria" in self._cmd_info:
+            if observer.assessor is None:
+                raise CommandError("Observer '{}' has no criteria of its own.".format(observer.name))
+            criteria = _create_assessor(self._cmd_info["criteria"]).criteria
+            changes["assessor"] = observer.assessor.updated(criteria)
+        if "notifications" in self._cmd_info:
+            notifications = NotificationServer()
+            for notification_info in self._cmd_info["notifications"]:
+                setup = AddNotificationCommand(notification_info, self._server)
+                notifications.add_notification(setup.create_notification())
+            changes["notifications"] = notifications
+        if "interval" in self._cmd_info:
+            changes["interval"] = self._cmd_info["interval"]
+        if "adaptive" in self._cmd_info:
+            interval = self._cmd_info.get("interval", observer.interval)
+            changes["adaptive"] = _adaptive_interval(dict(self._cmd_info, interval=interval)) or False
+        fetch_order = _fetch_order(self._cmd_info)
+        if "priority" in self._cmd_info:
+            changes["priority"] = fetch_order["priority"]
+        if "max_staleness" in self._cmd_info:
+            changes["max_staleness"] = False if fetch_order["max_staleness"] is None else fetch_order["max_staleness"]
+        observer.update(**changes)
+
+
 class PauseObserverCommand(Command):
     """
     Pauses an observer
@@ -291,7 +544,9 @@ class RemoveObserverCommand(Command):
 
 class ListObserversCommand(Command):
     """
-    Returns a list of all observers that are currently running.
+    Returns a list of all observers that are currently running. With
+    `statistics` set, the statistics and poll lateness of each observer are
+    included.
     """
     name = "list_observers"
     
@@ -299,6 +554,9 @@ class ListObserversCommand(Command):
         observers = [{"name": observer.name,
                       "state": observer.state}
                      for observer in self._server]
+        if self._cmd_info.get("statistics", False):
+            for info, observer in zip(observers, self._server):
+                info["statistics"] = observer.serialize(statistics=True)["statistics"]
         return dict(observers=observers)
 
 
@@ -319,7 +577,8 @@ class ObserverStateCommand(Command):
 
 class GetObserverCommand(Command):
     """
-    Returns a list of all observers that are currently running.
+    Returns the settings of an observer. With `statistics` set, the counters
+    and timings of its assessor and criteria are included.
     """
     name = "get_observer"
     
@@ -328,11 +587,60 @@ class GetObserverCommand(Command):
             raise CommandError("The get_observer command must specify a name.")
         try:
             observer = self._server[self._cmd_info["name"]]
+            if self._cmd_info.get("statistics", False):
+                return observer.serialize(statistics=True)
             return observer.serialize()
         except KeyError as error:
             raise CommandError(error.args[0])
 
 
+class EvaluateCriteriaCommand(Command):
+    """
+    Dry-runs a set of criteria over the ads stored by an observer (`observer`,
+    plus `search` for a search of a search group) or over archived result
+    pages (`corpus` and `profile`). Returns the hit count, sample hits and the
+    passes and time of each criterion. Nothing is stored or notified. A corpus
+    is a page or a directory of pages within the configured corpus directory.
+    """
+    name = "evaluate_criteria"
+
+    def execute(self):
+        if "criteria" not in self._cmd_info:
+            raise CommandError("The evaluate_criteria command must specify criteria.")
+        criteria = _create_assessor(self._cmd_info["criteria"]).criteria
+        if "observer" in self._cmd_info:
+            ads = self._stored_ads()
+        elif "corpus" in self._cmd_info:
+            ads = self._corpus_ads()
+        else:
+            raise CommandError("The evaluate_criteria command must specify an observer or a corpus.")
+        try:
+            return evaluate_criteria(criteria, ads, self._cmd_info.get("samples", 10))
+        except (KeyError, TypeError, AttributeError) as error:     # e.g. a tag the ads do not have
+            raise CommandError("Cannot evaluate criteria: {}".format(error))
+
+    def _corpus_ads(self):
+        root = os.path.realpath(self._server.config.evaluation.corpus)
+        path = os.path.realpath(os.path.join(root, str(self._cmd_info["corpus"])))
+        if os.path.commonpath([root, path]) != root:
+            raise CommandError("The corpus must be within {}".format(root))
+        try:
+            return ads_from_corpus(path, self._cmd_info.get("profile", "Willhaben"))
+        except Exception as error:  # unreadable files, or pages the profile cannot parse
+            raise CommandError("Cannot read corpus: {}".format(error))
+
+    def _stored_ads(self):
+        try:
+            observer = self._server[self._cmd_info["observer"]]
+            store = observer.search(self._cmd_info["search"]).store if "search" in self._cmd_info else observer.store
+        except (KeyError, AttributeError) as error:
+            raise CommandError("No such observer or search: {}".format(error.args[0]))
+        try:
+            return list(store)
+        except TypeError:
+            raise CommandError("Observer '{}' has no ads of its own.".format(self._cmd_info["observer"]))
+
+
 class ListCommandsCommand(Command):
     """
     Returns a list of all available commands.
@@ -24,16 +24,22 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-from adstore import Ad
+from adstore import ad_record_type
 import urllib.request, urllib.error, urllib.parse
 import re
 import datetime
 import profiles
 import logging
+import os
+import socket
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 class ConnectionError(Exception): pass
 
 class Connector():
+
+    timeout = 30    # seconds a page fetch may take
     
     @property
     def profile_name(self):
@@ -52,6 +58,8 @@ class Connector():
             self._profile = profile
         elif isinstance(profile, str):
             self._profile = profiles.get_profile_by_name(profile)
+        self._record_type = ad_record_type(self._profile.tags, self._profile.key_tag,
+                                           self._profile.datetime_tag, self._profile.name + "Ad")
 
     def _get_page(self, page):
         data = None
@@ -64,13 +72,17 @@ class Connector():
             url = next_url
         try:
             logging.debug("Connnector fetching page {} from URL: {}".format(page, url))
-            f = urllib.request.urlopen(url, data)
+            f = urllib.request.urlopen(url, data, self.timeout)
+            try:
+                content = f.read()
+            finally:
+                f.close()
+        except socket.timeout:
+            raise ConnectionError("Fetching {} timed out after {} s".format(url, self.timeout))
         except (urllib.error.URLError, ValueError):
             raise ConnectionError("Could not connect to {}".format(url))
         
-        html = str(f.read(), self._profile.encoding)
-        f.close()
-        return html
+        return str(content, self._profile.encoding)
 
     def frontpage_ads(self):
         try:
@@ -98,12 +110,91 @@ class Connector():
                 html = self._get_page(page)
             except IndexError:
                 break
-            new_ads = [Ad(tags, self._profile.key_tag, self._profile.datetime_tag)
-                       for tags in self._profile.parse(html)
-                       if tags[self._profile.datetime_tag] > timelimit]
+            new_ads = self._parse_page(html, timelimit)
+
+            if len(new_ads) == 0:
+                break
+            ads.extend(new_ads)
+
+        return ads
+
+    async def ads_after_async(self, timelimit, maxpages = 100, executor = None):
+        """
+        Coroutine version of ads_after(). Fetching and parsing a page block, so
+        both run in `executor` (the default executor of the loop if None) and
+        the event loop is free to serve other observers meanwhile.
+        """
+        if not isinstance(timelimit, datetime.datetime):
+            raise ConnectionError("timelimit needs to be a datetime instance")
+        loop = asyncio.get_running_loop()
+        ads = []
+        for page in range(0, maxpages):
+            try:
+                html = await loop.run_in_executor(executor, self._get_page, page)
+            except IndexError:
+                break
+            new_ads = await loop.run_in_executor(executor, self._parse_page, html, timelimit)
 
             if len(new_ads) == 0:
                 break
             ads.extend(new_ads)
 
         return ads
+
+    def ads_after_parallel(self, timelimit, maxpages = 100, parallel = 4):
+        """
+        Like ads_after(), but fetches `parallel` pages at a time. Used to catch
+        up on a long window of missed ads. Returns the ads and the number of
+        pages fetched.
+        """
+        if not isinstance(timelimit, datetime.datetime):
+            raise ConnectionError("timelimit needs to be a datetime instance")
+        ads = []
+        pages = 0
+        with ThreadPoolExecutor(parallel, thread_name_prefix="PageFetcher") as pool:
+            for first in range(0, maxpages, parallel):
+                wave = [pool.submit(self._fetch_page, page, timelimit)
+                        for page in range(first, min(first + parallel, maxpages))]
+                results = [future.result() for future in wave]
+                pages += sum(1 for new_ads in results if new_ads is not None)
+                for new_ads in results:
+                    if not new_ads:     # no such page or nothing new on it
+                        return ads, pages
+                    ads.extend(new_ads)
+        return ads, pages
+
+    def _fetch_page(self, page, timelimit):
+        try:
+            html = self._get_page(page)
+        except IndexError:
+            return None
+        return self._parse_page(html, timelimit)
+
+    def _parse_page(self, html, timelimit):
+        return [self._record_type(tags)
+                for tags in self._profile.parse(html)
+                if tags[self._profile.datetime_tag] > timelimit]
+
+
+def ads_from_corpus(path, profile):
+    """
+    Parses archived result pages instead of fetching them. `path` is a saved
+    page or a directory of saved pages (*.html) of the given profile. Ads that
+    occur on several pages are returned once.
+    """
+    if isinstance(profile, str):
+        name, profile = profile, profiles.get_profile_by_name(profile)
+        if profile is None:
+            raise ValueError("Unknown profile: {}".format(name))
+    if os.path.isdir(path):
+        files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".html"))
+    else:
+        files = [path]
+    record_type = ad_record_type(profile.tags, profile.key_tag, profile.datetime_tag, profile.name + "Ad")
+    ads = dict()
+    for page in files:
+        with open(page, "r", encoding=profile.encoding) as f:
+            for tags in profile.parse(f.read()):
+                ad = record_type(tags)
+                ads.setdefault(ad.key, ad)
+    return list(ads.values())
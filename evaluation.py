@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import heapq
+import datetime
+
+from adbatch import AdBatch
+
+
+def _sample(ad):
+    return dict((tag, value.isoformat() if isinstance(value, (datetime.date, datetime.time)) else value)
+                for tag, value in ad.items())
+
+
+def evaluate_criteria(criteria, ads, samples=10):
+    """
+    Dry-runs a candidate set of criteria over `ads` (e.g. the history of an
+    observer's store) without affecting any observer. All ads are checked as
+    one AdBatch. Returns the number of ads and hits, the newest `samples` hits
+    and, for each criterion on its own, its passes, rejections and the time it
+    took. Columns are built by the first criterion that needs them, so their
+    cost is part of that criterion's time.
+    """
+    start = time.perf_counter()
+    batch = AdBatch(ads)
+    mask = batch.full(True)
+    statistics = []
+    for criterion in criteria:
+        criterion_start = time.perf_counter()
+        passed = criterion.check_batch(batch)
+        elapsed = time.perf_counter() - criterion_start
+        passes = batch.count(passed)
+        statistics.append(dict(criterion=criterion.serialize(), passes=passes, rejections=len(batch) - passes,
+                               ms=elapsed * 1e3))
+        mask = batch.both(mask, passed)
+    hits = batch.indices(mask)
+    newest = heapq.nlargest(samples, hits, key=lambda i: batch.ads[i].datetime) if samples else []
+    return dict(ads=len(batch), hits=len(hits), samples=[_sample(batch.ads[i]) for i in newest],
+                criteria=statistics, ms=(time.perf_counter() - start) * 1e3)
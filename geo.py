@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import csv
+import math
+from threading import Lock
+
+BUNDLED_ZIP_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "zip_centroids_at.csv")
+EARTH_RADIUS_KM = 6371.0
+
+
+def distance_km(a, b):
+    """
+    Great circle distance between two (lat, lon) points.
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+class ZipCentroids(object):
+    """
+    An offline table of postal code centroids. Codes missing in the table are
+    placed at the mean of the listed codes with the same 3-digit prefix, or at
+    the centroid of their 2-digit postal region.
+    """
+
+    _bundled = None
+    _bundled_lock = Lock()
+
+    def __init__(self, path):
+        self._exact = dict()
+        self._regions = dict()
+        with open(path, encoding="utf-8") as f:
+            rows = csv.DictReader(line for line in f if not line.startswith("#"))
+            for row in rows:
+                location = (float(row["lat"]), float(row["lon"]))
+                if len(row["zip"]) == 4:
+                    self._exact[row["zip"]] = location
+                else:
+                    self._regions[row["zip"]] = location
+        groups = dict()
+        for code, location in self._exact.items():
+            groups.setdefault(code[:3], []).append(location)
+        self._prefixes = dict((prefix, (sum(lat for lat, _ in locations) / len(locations),
+                                        sum(lon for _, lon in locations) / len(locations)))
+                              for prefix, locations in groups.items())
+
+    @classmethod
+    def bundled(cls):
+        """
+        The table shipped in data/zip_centroids_at.csv. Loaded once.
+        """
+        with cls._bundled_lock:
+            if cls._bundled is None:
+                cls._bundled = cls(BUNDLED_ZIP_TABLE)
+            return cls._bundled
+
+    def locate(self, code):
+        """
+        The (lat, lon) of a 4-digit postal code, or None if it is unknown.
+        """
+        code = str(code).strip()
+        if len(code) != 4 or not code.isdigit():
+            return None
+        return self._exact.get(code) or self._prefixes.get(code[:3]) or self._regions.get(code[:2])
+
+    def within(self, center, radius_km):
+        """
+        All 4-digit postal codes within `radius_km` of the (lat, lon) `center`.
+        """
+        found = set()
+        for number in range(1000, 10000):
+            code = str(number)
+            location = self.locate(code)
+            if location is not None and distance_km(center, location) <= radius_km:
+                found.add(code)
+        return frozenset(found)
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import mmap
+import heapq
+import pickle
+import struct
+import hashlib
+import logging
+import threading
+from bisect import bisect_left
+from adstore import AdStore, AdKeyError
+
+
+class MappedStoreError(Exception):
+    pass
+
+
+def _key_hash(key):
+    return struct.unpack("<Q", hashlib.blake2b(repr(key).encode("utf-8"), digest_size=8).digest())[0]
+
+
+def _timestamp(ad):
+    try:
+        dtime = ad.datetime
+    except (KeyError, AdKeyError):
+        return 0.0
+    try:
+        return dtime.timestamp()
+    except AttributeError:
+        pass
+    try:
+        return float(dtime)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class _Column(object):
+    """
+    Read-only sequence view of one field of the fixed size entries in the
+    index file. Allows binary searching the index without reading it.
+    """
+
+    def __init__(self, buffer, start, count, entry, field):
+        self._buffer = buffer
+        self._start = start
+        self._count = count
+        self._entry = entry
+        self._field = field
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return self._entry.unpack_from(self._buffer, self._start + i * self._entry.size)[self._field]
+
+
+class MappedAdStore(AdStore):
+    """
+    An ad store that opens instantly, no matter how large the history is.
+
+    Ads are appended as pickled records to the data file at `path`. A sorted
+    index of key hashes and record offsets is kept in `path`.idx. Both files
+    are memory-mapped on load and records are only decoded when they are
+    needed: to verify a key hash match or when an ad is accessed by position.
+    Changes are kept in memory until the next save().
+
+    A save appends the entries of the new records to an unsorted tail of the
+    index, which is also held in memory. Once the tail grows beyond half of
+    the sorted part, it is merged and the index is rewritten.
+
+    If `import_path` points to an existing pickle of a regular AdStore and the
+    mapped store is empty, its ads are imported in a background thread. Calls
+    that depend on the history (e.g. add_ads) wait until the import finished,
+    everything else (e.g. setting up and starting an observer) does not.
+    """
+
+    _data_magic = b"UJMD\x01"
+    _index_header = struct.Struct("<4sBQQQ")    # magic, version, sorted entries, tail entries, covered data size
+    _index_magic = b"UJMI"
+    _index_version = 2
+    _merge_min = 1024                           # tail entries that are never worth a merge
+    _entry = struct.Struct("<QQd")              # key hash, offset, timestamp; sorted by hash
+    _order_entry = struct.Struct("<dQ")         # timestamp, offset; sorted by timestamp
+    _record_header = struct.Struct("<I")
+
+    def __init__(self, path=None, autosave=True, write_behind=False, flush_interval=5.0, flush_threshold=100,
+                 import_path=None):
+        self._data = None
+        self._index = None
+        self._count = 0
+        self._tail = []     # index entries appended after the sorted ones
+        self._tail_offsets = {}     # key hash -> offsets of the tail entries
+        self._unsaved = {}  # key -> ad, in insertion order
+        self._view = None
+        self._ready = threading.Event()
+        super(MappedAdStore, self).__init__(path, autosave, True, write_behind, flush_interval, flush_threshold)
+        if import_path and self._count == 0 and os.path.exists(import_path):
+            threading.Thread(target=self._import, args=(import_path,), name="MappedAdStoreImport",
+                             daemon=True).start()
+        else:
+            self._ready.set()
+
+    @property
+    def index_path(self):
+        return self._path + ".idx"
+
+    def _import(self, import_path):
+        try:
+            ads = AdStore(import_path, autosave=False)[:]
+            logging.info("Importing {} ads from {} into {}".format(len(ads), import_path, self._path))
+            with self._lock:
+                self._add(ads)
+            self.save()
+        except Exception as error:
+            logging.error("Failed to import ad store {}: {}".format(import_path, error))
+        finally:
+            self._ready.set()
+
+    def wait_ready(self, timeout=None):
+        """
+        Blocks until a background import is finished.
+        """
+        return self._ready.wait(timeout)
+
+    # -- reading the mapped files ---------------------------------------------
+
+    def _close_maps(self):
+        for m in (self._data, self._index):
+            if m is not None:
+                m.close()
+        self._data = self._index = None
+        self._count = 0
+        self._set_tail([])
+
+    def _set_tail(self, tail):
+        self._tail = tail
+        self._tail_offsets = {}
+        for entry_hash, offset, _ in tail:
+            self._tail_offsets.setdefault(entry_hash, []).append(offset)
+
+    def _map(self, path):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def load(self):
+        with self._lock:
+            self._close_maps()
+            self._unsaved = {}
+            self._view = None
+            if not self._path or not os.path.exists(self._path):
+                return
+            self._data = self._map(self._path)
+            if self._data is None:
+                return  # an empty file, nothing was saved yet
+            if self._data[:len(self._data_magic)] != self._data_magic:
+                raise MappedStoreError("{} is not a mapped ad store".format(self._path))
+            try:
+                self._index = self._map(self.index_path)
+                magic, version, self._count, tail, covered = self._index_header.unpack_from(self._index)
+                if magic != self._index_magic or version != self._index_version:
+                    raise MappedStoreError("{} is not an ad store index".format(self.index_path))
+                start = self._tail_start()
+                self._set_tail([self._entry.unpack_from(self._index, start + i * self._entry.size)
+                                for i in range(tail)])
+            except (IOError, TypeError, struct.error, MappedStoreError):
+                logging.warning("Index of {} is missing or broken. Rebuilding it.".format(self._path))
+                self._rebuild_index()
+                return
+            if covered < len(self._data):
+                self._recover_tail(covered)
+
+    def _records(self, start):
+        """
+        Yields (offset, raw record) for all records from `start` on.
+        """
+        pos = start
+        size = len(self._data)
+        while pos + self._record_header.size <= size:
+            length, = self._record_header.unpack_from(self._data, pos)
+            end = pos + self._record_header.size + length
+            if end > size:
+                break   # a partially written record
+            yield pos, self._data[pos + self._record_header.size:end]
+            pos = end
+
+    def _recover_tail(self, covered):
+        """
+        Records behind the indexed part were written, but the index was not
+        updated (e.g. a crash during save). Take them over as unsaved ads.
+        """
+        tail = [pickle.loads(raw) for _, raw in self._records(covered)]
+        logging.warning("Recovering {} unindexed ads in {}".format(len(tail), self._path))
+        self._data.close()
+        with open(self._path, "r+b") as f:
+            f.truncate(covered)
+        self._data = self._map(self._path)
+        for ad in tail:
+            self._unsaved[ad.key] = ad
+
+    def _rebuild_index(self):
+        ads = [pickle.loads(raw) for _, raw in self._records(len(self._data_magic))]
+        self._close_maps()
+        os.remove(self._path)
+        for ad in ads:
+            self._unsaved[ad.key] = ad
+        with self._save_lock:
+            self._save()
+
+    def _hashes(self):
+        return _Column(self._index, self._index_header.size, self._count, self._entry, 0)
+
+    def _entry_at(self, i):
+        return self._entry.unpack_from(self._index, self._index_header.size + i * self._entry.size)
+
+    def _order_at(self, i):
+        start = self._index_header.size + self._count * self._entry.size
+        return self._order_entry.unpack_from(self._index, start + i * self._order_entry.size)
+
+    def _tail_start(self):
+        return self._index_header.size + self._count * (self._entry.size + self._order_entry.size)
+
+    def _decode(self, offset):
+        length, = self._record_header.unpack_from(self._data, offset)
+        start = offset + self._record_header.size
+        return pickle.loads(self._data[start:start + length])
+
+    def _stored_offset(self, key):
+        """
+        Offset of the record with `key` in the data file or `None`.
+        """
+        if self._count == 0 and not self._tail:
+            return None
+        h = _key_hash(key)
+        i = bisect_left(self._hashes(), h)
+        while i < self._count:
+            entry_hash, offset, _ = self._entry_at(i)
+            if entry_hash != h:
+                break
+            if self._decode(offset).key == key:   # guard against hash collisions
+                return offset
+            i += 1
+        for offset in self._tail_offsets.get(h, ()):
+            if self._decode(offset).key == key:
+                return offset
+        return None
+
+    def __contains__(self, key):
+        self._ready.wait()
+        with self._lock:
+            return key in self._unsaved or self._stored_offset(key) is not None
+
+    # -- the AdStore interface ------------------------------------------------
+
+    def _sort_by_date(self):
+        pass    # the index keeps the ads sorted
+
+    def length(self):
+        self._ready.wait()
+        with self._lock:
+            return self._count + len(self._tail) + len(self._unsaved)
+
+    def _add(self, ads):
+        added_ads = []
+        for ad in ads:
+            key = ad.key
+            if key in self._unsaved or self._stored_offset(key) is not None:
+                continue
+            self._unsaved[key] = ad
+            added_ads.append(ad)
+        if added_ads:
+            self._view = None
+        return added_ads
+
+    def add_ads(self, ads):
+        """
+        'ads' is a list of new ads
+        """
+        self._ready.wait()
+        with self._lock:
+            added_ads = self._add(ads)
+        self._changed(len(added_ads))   # may save, which takes the save lock before the lock
+        return added_ads
+
+    def remove_ads(self, ads):
+        """
+        Removing ads rewrites the store. This is done synchronously.
+        """
+        self._ready.wait()
+        with self._save_lock, self._lock:
+            removed_ads = []
+            removed_offsets = set()
+            for ad in ads:
+                if ad.key in self._unsaved:
+                    del self._unsaved[ad.key]
+                    removed_ads.append(ad)
+                    continue
+                offset = self._stored_offset(ad.key)
+                if offset is not None and offset not in removed_offsets:
+                    removed_offsets.add(offset)
+                    removed_ads.append(ad)
+            if removed_offsets:
+                self._compact(removed_offsets)
+            self._view = None
+        return removed_ads
+
+    def save(self):
+        if not self._path: return
+        with self._save_lock:
+            self._save()
+        return True
+
+    def _save(self):
+        with self._lock:
+            batch = list(self._unsaved.values())
+        if batch or self._data is None:
+            self._append(batch)
+
+    def __iter__(self):
+        for i in range(self.length()):
+            try:
+                yield self[i]
+            except IndexError:
+                return
+
+    def __getitem__(self, index):
+        self._ready.wait()
+        with self._lock:
+            if self._view is None:
+                self._view = self._build_view()
+            refs = self._view[index]
+            if isinstance(index, slice):
+                return [self._resolve(ref) for ref in refs]
+            return self._resolve(refs)
+
+    def _resolve(self, ref):
+        return self._decode(ref) if isinstance(ref, int) else ref
+
+    def _build_view(self):
+        """
+        The positions of all ads sorted by date: record offsets for stored
+        ads, the ads themselves for unsaved ones.
+        """
+        stored = heapq.merge((self._order_at(i) for i in range(self._count)),
+                             sorted((ts, offset) for _, offset, ts in self._tail), key=lambda item: item[0])
+        unsaved = sorted(((_timestamp(ad), ad) for ad in self._unsaved.values()), key=lambda item: item[0])
+        return [ref for _, ref in heapq.merge(stored, unsaved, key=lambda item: item[0])]
+
+    # -- writing --------------------------------------------------------------
+
+    def _append(self, ads):
+        """
+        Appends `ads` to the data file and their entries to the index. Must be
+        called with the save lock held.
+        """
+        entries = []
+        with open(self._path, "ab") as f:
+            covered = f.seek(0, os.SEEK_END)    # not the mapped size, the file may have grown meanwhile
+            if covered == 0:
+                f.write(self._data_magic)
+                covered = len(self._data_magic)
+            for ad in ads:
+                raw = pickle.dumps(ad)
+                f.write(self._record_header.pack(len(raw)))
+                f.write(raw)
+                entries.append((_key_hash(ad.key), covered, _timestamp(ad)))
+                covered += self._record_header.size + len(raw)
+        tail = self._tail + entries
+        if self._index is None or len(tail) > max(self._merge_min, self._count // 2):
+            entries = [self._entry_at(i) for i in range(self._count)] + tail
+            self._write_index(entries, covered, ads)
+        else:
+            self._append_index(tail, entries, covered, ads)
+
+    def _append_index(self, tail, entries, covered, saved_ads):
+        """
+        Writes `entries` behind the tail of the index. The header is updated
+        last, so after a crash in between the new records are recovered from
+        the data file.
+        """
+        with open(self.index_path, "r+b") as f:
+            f.seek(self._tail_start() + len(self._tail) * self._entry.size)
+            for entry in entries:
+                f.write(self._entry.pack(*entry))
+            f.truncate()
+            f.flush()
+            f.seek(0)
+            f.write(self._index_header.pack(self._index_magic, self._index_version, self._count, len(tail), covered))
+        with self._lock:
+            self._data.close()
+            self._data = self._map(self._path)
+            self._set_tail(tail)
+            for ad in saved_ads:
+                self._unsaved.pop(ad.key, None)
+            self._view = None
+
+    def _compact(self, removed_offsets):
+        """
+        Rewrites data file and index without the records at `removed_offsets`.
+        Must be called with both locks held.
+        """
+        self._save()
+        entries = []
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self._data_magic)
+            covered = len(self._data_magic)
+            for offset, raw in self._records(len(self._data_magic)):
+                if offset in removed_offsets:
+                    continue
+                ad = pickle.loads(raw)
+                f.write(self._record_header.pack(len(raw)))
+                f.write(raw)
+                entries.append((_key_hash(ad.key), covered, _timestamp(ad)))
+                covered += self._record_header.size + len(raw)
+        self._close_maps()
+        os.replace(tmp_path, self._path)
+        self._write_index(entries, covered)
+
+    def _write_index(self, entries, covered, saved_ads=()):
+        entries.sort(key=lambda entry: entry[0])
+        order = sorted(((ts, offset) for _, offset, ts in entries), key=lambda item: item[0])
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self._index_header.pack(self._index_magic, self._index_version, len(entries), 0, covered))
+            for entry in entries:
+                f.write(self._entry.pack(*entry))
+            for item in order:
+                f.write(self._order_entry.pack(*item))
+        with self._lock:
+            self._close_maps()
+            os.replace(tmp_path, self.index_path)
+            self._data = self._map(self._path)
+            self._index = self._map(self.index_path)
+            self._count = len(entries)
+            for ad in saved_ads:
+                self._unsaved.pop(ad.key, None)
+            self._view = None
@@ -96,12 +96,8 @@ class PushjetNotification(Notification):
             if "url" in ad:
                 link = ad["url"]
 
-            if not "pushed" in ad:
-                ad["pushed"] = True
-                self._push_note(title, body, link)
-                logging.debug("Notification to Pushjet sent")
-            else:
-                logging.debug("Notification to Pushjet has already been sent")
+            self._push_note(title, body, link)
+            logging.debug("Notification to Pushjet sent")
         except Exception as error:
             logging.error("Failed to send notification: {}".format(error.args))
 
@@ -24,99 +24,603 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import time
 import datetime
 import threading
 import logging
-
+import random
+import time
+import asyncio
+import os
 from itertools import compress
+
+from collections import OrderedDict
 from connector import Connector, ConnectionError
+from percolator import Percolator
+from scheduler import Lateness
+
 
+class AdaptiveInterval(object):
+    """
+    Chooses the polling interval of an observer from the arrival rate of new
+    ads. The rate is a moving average (EWMA) over the recent polls and the
+    interval is picked so that `target` new ads are expected per poll. It is
+    kept within `min_interval` and `max_interval` and varied randomly by the
+    `jitter` fraction, so observers started together drift apart.
+    """
 
-class Observer(threading.Thread):
+    def __init__(self, interval, target=5, min_interval=30, max_interval=900, smoothing=0.3, jitter=0.1):
+        if not 0 < min_interval <= max_interval:
+            raise ValueError("Invalid interval bounds: {} to {}".format(min_interval, max_interval))
+        if target <= 0:
+            raise ValueError("The target must be a positive number of ads per poll")
+        if not 0 < smoothing <= 1 or not 0 <= jitter < 1:
+            raise ValueError("Smoothing must be within (0, 1] and jitter within [0, 1)")
+        self.target = target
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.smoothing = smoothing
+        self.jitter = jitter
+        self._interval = self._bounded(interval)
+        self._rate = None   # new ads per second, unknown until the second poll
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def update(self, new_ads, elapsed):
+        """
+        Adds a poll that found `new_ads` ads `elapsed` seconds after the previous one.
+        """
+        if elapsed > 0:
+            sample = new_ads / elapsed
+            if self._rate is None:
+                self._rate = sample
+            else:
+                self._rate += self.smoothing * (sample - self._rate)
+            if self._rate > 0:
+                self._interval = self._bounded(self.target / self._rate)
+            else:
+                self._interval = self.max_interval
+
+    def with_interval(self, interval):
+        """
+        A new AdaptiveInterval with the same options that starts from `interval`.
+        """
+        return AdaptiveInterval(interval, self.target, self.min_interval, self.max_interval, self.smoothing,
+                                self.jitter)
+
+    def next_delay(self):
+        delay = self._interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        return self._bounded(delay)
+
+    def serialize(self):
+        return dict(target=self.target, min_interval=self.min_interval, max_interval=self.max_interval,
+                    jitter=self.jitter, interval=self._interval, rate=self._rate)
+
+    def _bounded(self, interval):
+        return min(max(interval, self.min_interval), self.max_interval)
+
+
+class Observer(object):
+    """
+    Polls a result list for new ads, checks them and passes the hits on to the
+    store and the notifications. An observer does not run a thread of its own:
+    start() hands it to a Scheduler, which calls poll() whenever it is due.
+    With an AdaptiveInterval the delay between polls follows the arrival rate
+    of new ads, otherwise it is fixed to `update_interval`.
+
+    When more polls are due than can be run, observers of higher `priority`
+    are polled first. A poll that starts more than `max_staleness` seconds
+    (by default the interval) after it was due misses its target, see
+    `lateness`.
+
+    The first poll catches up on the ads missed since the time mark with
+    `parallel_pages` page fetches at a time and checks them in one batch.
+    With a `time_mark_path` the time mark is saved after every poll, so the
+    observer continues where it stopped after a restart instead of looking
+    back one day.
+    """
 
     # observer states
     RUNNING = "RUNNING"
     PAUSED = "PAUSED"
     
-    def __init__(self, url, profile, store, assessor, notifications, update_interval = 180, name = "Unnamed Observer"):
-        super(Observer, self).__init__()
+    def __init__(self, url, profile, store, assessor, notifications, update_interval = 180, name = "Unnamed Observer",
+                 adaptive = None, priority = 0, max_staleness = None, time_mark_path = None, parallel_pages = 4):
         self._interval = update_interval
+        self._adaptive = adaptive
+        self.priority = priority
+        self._max_staleness = max_staleness
+        self.lateness = Lateness()
+        self._last_poll = None  # time.monotonic() of the last successful fetch
         self._connector = Connector(url, profile)
         self._store = store
         self._assessor = assessor
         self._notifications = notifications
         self._name = name
         self._quit = False
-        self._time_mark = datetime.datetime.now() - datetime.timedelta(days = 1)
+        self._time_mark_path = time_mark_path
+        self._time_mark = self._load_time_mark()
+        self._parallel_pages = parallel_pages
+        self._catch_up = None   # report of the catch-up, set when it is done
         self._state = Observer.RUNNING
-        self.name = name
+        self._scheduler = None
+        self._idle = threading.Event()  # set while no poll is running
+        self._idle.set()
+        self._executor = None   # set during an async poll, see _notify()
     
-    def serialize(self):
+    def serialize(self, statistics=False):
         d = dict()
         d["name"] = self._name
         d["url"] = self._connector.url
         d["interval"] = self._interval
         d["profile"] = self._connector.profile_name
         d["store"] = self._store.path is not None
+        if self._adaptive is not None:
+            d["adaptive"] = self._adaptive.serialize()
+        if self.priority:
+            d["priority"] = self.priority
+        if self._max_staleness is not None:
+            d["max_staleness"] = self._max_staleness
 
         if self._assessor is not None:
             d["criteria"] = [criterion.serialize() for criterion in self._assessor.criteria]
+        if statistics:
+            d["statistics"] = dict(lateness=self.lateness.serialize(), catch_up=self._catch_up)
+            if self._assessor is not None:
+                d["statistics"].update(assessor=self._assessor.totals(), criteria=self._assessor.statistics())
         # if self._notifications is not None:
         #     d["notifications"] = [notification.serialize() for notification in self._notifications]
         return d
 
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def max_staleness(self):
+        if self._max_staleness is not None:
+            return self._max_staleness
+        if self._adaptive is not None:
+            return self._adaptive.interval
+        return self._interval
+
     @property
     def state(self):
         return self._state
 
     @state.setter
     def state(self, value):
+        """
+        A paused observer is taken off the schedule. Resuming it polls right away.
+        """
         self._state = value
+        if self._scheduler is None or self._quit:
+            return
+        if value == Observer.RUNNING:
+            self._scheduler.schedule(self)
+        else:
+            self._scheduler.cancel(self)
+            self._last_poll = None  # the pause says nothing about the arrival rate
 
     @property
     def notifications(self):
         return self._notifications
 
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def assessor(self):
+        return self._assessor
+
+    @property
+    def interval(self):
+        return self._interval
+
+    def update(self, assessor=None, notifications=None, interval=None, adaptive=None,
+               priority=None, max_staleness=None):
+        """
+        Changes the settings of a running observer in place. Arguments that are
+        None are left as they are, `adaptive=False` turns adaptive polling off
+        and `max_staleness=False` goes back to the default. A new interval
+        restarts adaptive polling from there, unless `adaptive` is given too.
+        The store, the time mark and the connection are kept. A poll that is
+        running finishes with the old settings. If the new interval is shorter,
+        the next poll is moved forward.
+        """
+        if assessor is not None:
+            self._assessor = assessor
+        if notifications is not None:
+            self._notifications = notifications
+        if interval is not None:
+            self._interval = interval
+            if adaptive is None and self._adaptive is not None:
+                adaptive = self._adaptive.with_interval(interval)
+        if adaptive is not None:
+            self._adaptive = adaptive or None
+            self._last_poll = None
+        if priority is not None:
+            self.priority = priority
+        if max_staleness is False:
+            self._max_staleness = None
+        elif max_staleness is not None:
+            self._max_staleness = max_staleness
+        if self._scheduler is not None and self._state == Observer.RUNNING and not self._quit:
+            self._scheduler.schedule(self, self._next_delay(), keep_earlier=True)
+
+    def start(self, scheduler):
+        """
+        Starts polling. The first poll is due right away.
+        """
+        self._scheduler = scheduler
+        scheduler.schedule(self)
+
     def quit(self):
         """
-        Make the Thread quit
+        Stops polling. A poll that is running is finished, use join() to wait for it.
         """
         self._quit = True
+        if self._scheduler is not None:
+            self._scheduler.cancel(self)
+
+    def join(self, timeout=None):
+        """
+        Waits until a running poll is finished.
+        """
+        self._idle.wait(timeout)
 
-    def _process_ads(self, ads):
+    def is_alive(self):
+        return self._scheduler is not None and not (self._quit and self._idle.is_set())
+
+    def _process_ads(self, ads, batch=False):
+        """
+        Checks the fetched ads in a single pass. Ads that occur on several
+        pages are checked once, the time mark is the newest ad fetched. The
+        ads are passed on as they are, notifications get the fetched objects.
+        With `batch` all ads are checked at once by AdAssessor.check_batch().
+        Ads that cannot be checked (e.g. a tag is missing) are skipped; if the
+        batch fails, the ads are checked one by one.
+        """
         if len(ads) == 0: return
-        hits = map(self._assessor.check, ads)
-        hit_ads = [ad for ad in compress(ads, hits)]
-        new_ads = self._store.add_ads(hit_ads)
-        new_ads = [dict(y) for y in set([frozenset(x.items()) for x in new_ads])] # Clear duplicates!
-        for ad in new_ads:
+        assessor, notifications = self._assessor, self._notifications  # may be replaced by update() meanwhile
+        time_mark = self._time_mark
+        hits = dict()
+        if batch:
+            for ad in ads:
+                if ad.datetime > time_mark:
+                    time_mark = ad.datetime
+                hits.setdefault(ad.key, ad)     # Clear duplicates!
+            candidates = list(hits.values())
+            try:
+                hits = compress(candidates, assessor.check_batch(candidates))
+            except self._CHECK_ERRORS as error:
+                logging.warning("Observer '{}' checks the ads one by one, the batch failed: {!r}".format(
+                    self._name, error))
+                hits = [ad for ad in candidates if self._check(assessor, ad)]
+        else:
+            for ad in ads:
+                if ad.datetime > time_mark:
+                    time_mark = ad.datetime
+                if ad.key not in hits and self._check(assessor, ad):
+                    hits[ad.key] = ad   # Clear duplicates!
+            hits = hits.values()
+        for ad in self._store.add_ads(list(hits)):
             try:
                 logging.info("Observer '{}' Found Ad: {}".format(self._name, ad["title"]))
             except KeyError:
                 logging.info("Observer '{}' Found Ad: {}".format(self._name, ad.key))
-            if self._notifications:
-                self._notifications.notify_all(ad)
-        self._time_mark = sorted(ads, key = lambda ad: ad.datetime)[-1].datetime
+            if notifications:
+                self._notify(notifications, ad)
+        if time_mark != self._time_mark:
+            self._time_mark = time_mark
+            self._save_time_mark()
 
-    def run(self):
-        self._state = Observer.RUNNING
-        while True:
+    # errors of criteria that do not fit an ad, e.g. a missing tag
+    _CHECK_ERRORS = (KeyError, TypeError, ValueError, AttributeError)
+
+    def _check(self, assessor, ad):
+        try:
+            return assessor.check(ad)
+        except self._CHECK_ERRORS as error:
+            logging.warning("Observer '{}' skips ad {} that cannot be checked: {!r}".format(self._name, ad.key, error))
+            return False
+
+    def poll(self):
+        """
+        Fetches and processes new ads once. Called by the Scheduler. Returns
+        the delay until the next poll, or None after quit().
+        """
+        self._idle.clear()
+        try:
+            if self._quit:
+                return None
+            if self._state == Observer.RUNNING:
+                logging.info("Observer '{}' polling for new ads since {}".format(self._name, self._time_mark))
+                try:
+                    start = time.monotonic()
+                    catching_up = self._catch_up is None
+                    if catching_up:
+                        ads, pages = self._connector.ads_after_parallel(self._time_mark, parallel=self._parallel_pages)
+                    else:
+                        ads = self._connector.ads_after(self._time_mark)
+                    if self._quit:
+                        return None     # Quit now if quit() was called while fetching ads
+
+                    self._process_ads(ads, batch=catching_up)
+                    self._update_rate(ads)
+                    if catching_up:
+                        self._caught_up(ads, pages, start)
+
+                except ConnectionError as ex:
+                    logging.info("Observer '{}' connection failed with message: {}".format(self._name, ex.args[0]))
+        finally:
+            self._idle.set()
+        return self._next_delay()
+
+    async def poll_async(self, executor=None):
+        """
+        Coroutine version of poll(), awaited by the AsyncScheduler. Pages are
+        fetched and parsed in `executor`, and the ads are checked and stored
+        there too, so neither the store nor the time mark blocks the loop.
+        Notifications are sent from the executor without waiting for them.
+        """
+        self._idle.clear()
+        try:
+            if self._quit:
+                return None
             if self._state == Observer.RUNNING:
                 logging.info("Observer '{}' polling for new ads since {}".format(self._name, self._time_mark))
                 try:
-                    ads = self._connector.ads_after(self._time_mark)
+                    start = time.monotonic()
+                    catching_up = self._catch_up is None
+                    if catching_up:
+                        ads, pages = await asyncio.get_running_loop().run_in_executor(
+                            executor, lambda: self._connector.ads_after_parallel(self._time_mark,
+                                                                                 parallel=self._parallel_pages))
+                    else:
+                        ads = await self._connector.ads_after_async(self._time_mark, executor=executor)
                     if self._quit:
-                        return   # Quit now if quit() was called while fetching ads
+                        return None     # Quit now if quit() was called while fetching ads
 
-                    self._process_ads(ads)
+                    await asyncio.get_running_loop().run_in_executor(executor, self._process_ads_async,
+                                                                     ads, catching_up, executor)
+                    self._update_rate(ads)
+                    if catching_up:
+                        self._caught_up(ads, pages, start)
 
                 except ConnectionError as ex:
                     logging.info("Observer '{}' connection failed with message: {}".format(self._name, ex.args[0]))
+        finally:
+            self._idle.set()
+        return self._next_delay()
+
+    def _process_ads_async(self, ads, batch, executor):
+        self._executor = executor
+        try:
+            self._process_ads(ads, batch=batch)
+        finally:
+            self._executor = None
+
+    def _caught_up(self, ads, pages, start):
+        self._catch_up = dict(pages=pages, ads=len(ads), seconds=time.monotonic() - start)
+        logging.info("Observer '{}' caught up on {} ads from {} pages in {:.1f} s".format(
+            self._name, len(ads), pages, self._catch_up["seconds"]))
+
+    def _load_time_mark(self):
+        if self._time_mark_path is not None and os.path.exists(self._time_mark_path):
+            try:
+                with open(self._time_mark_path, "r") as f:
+                    return datetime.datetime.fromisoformat(f.read().strip())
+            except ValueError:
+                logging.warning("Observer '{}' ignores an invalid time mark in {}".format(
+                    self._name, self._time_mark_path))
+        return datetime.datetime.now() - datetime.timedelta(days = 1)
+
+    def _save_time_mark(self):
+        if self._time_mark_path is None:
+            return
+        temp_path = self._time_mark_path + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write(self._time_mark.isoformat())
+        os.replace(temp_path, self._time_mark_path)
+
+    def _next_delay(self):
+        if self._quit or self._state != Observer.RUNNING:
+            return None     # paused observers are scheduled again on resume
+        if self._adaptive is not None:
+            return self._adaptive.next_delay()
+        return self._interval
+
+    def _notify(self, notifications, ad):
+        """
+        Passes a found ad on to the notifications. In an async poll they are
+        sent from the executor, so a slow mail server does not stall the poll.
+        """
+        if self._executor is None:
+            notifications.notify_all(ad)
+            return
+        future = self._executor.submit(notifications.notify_all, ad)
+        future.add_done_callback(self._notified)
+
+    def _notified(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.error("Observer '{}' failed to send a notification: {}".format(self._name, future.exception()))
+
+    def _update_rate(self, ads):
+        """
+        Feeds the number of new ads into the adaptive interval. The first poll
+        catches up on a whole day and says nothing about the current rate.
+        """
+        now = time.monotonic()
+        if self._adaptive is not None and self._last_poll is not None:
+            self._adaptive.update(len(set(ad.key for ad in ads)), now - self._last_poll)
+        self._last_poll = now
+
+    def __repr__(self):
+        return "<{} '{}'>".format(type(self).__name__, self._name)
+
+
+class SavedSearch(object):
+    """
+    A search within a SearchGroup. Each search has its own criteria, store and
+    notifications, just like an Observer.
+    """
+
+    def __init__(self, name, assessor, store, notifications):
+        self._name = name
+        self._assessor = assessor
+        self._store = store
+        self._notifications = notifications
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def assessor(self):
+        return self._assessor
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def notifications(self):
+        return self._notifications
+
+    def serialize(self, statistics=False):
+        d = dict()
+        d["name"] = self._name
+        d["store"] = self._store.path is not None
+        d["criteria"] = [criterion.serialize() for criterion in self._assessor.criteria]
+        if statistics:
+            d["statistics"] = dict(assessor=self._assessor.totals(), criteria=self._assessor.statistics())
+        return d
+
+
+class _SearchGroupStores(object):
+    """
+    The stores of all searches of a group, closed and flushed together.
+    """
+
+    def __init__(self, searches):
+        self._searches = searches
+
+    @property
+    def path(self):
+        return None
+
+    def flush(self):
+        for search in list(self._searches.values()):
+            search.store.flush()
+
+    def close(self):
+        for search in list(self._searches.values()):
+            search.store.close()
+
+
+class SearchGroup(Observer):
+    """
+    An observer that serves many saved searches from one stream of fetched
+    ads. Every page is fetched only once and each ad is matched against all
+    searches by a Percolator. Hits are added to the store of the matching
+    search and passed on to its notifications.
+    """
+
+    def __init__(self, url, profile, update_interval = 180, name = "Unnamed Search Group", adaptive = None,
+                 priority = 0, max_staleness = None, time_mark_path = None, parallel_pages = 4):
+        super(SearchGroup, self).__init__(url, profile, store=None, assessor=None, notifications=None,
+                                          update_interval=update_interval, name=name, adaptive=adaptive,
+                                          priority=priority, max_staleness=max_staleness,
+                                          time_mark_path=time_mark_path, parallel_pages=parallel_pages)
+        self._profile = profile
+        self._lock = threading.Lock()
+        self._searches = OrderedDict()
+        self._percolator = Percolator()
+        self._store = _SearchGroupStores(self._searches)
+
+    def serialize(self, statistics=False):
+        d = super(SearchGroup, self).serialize(statistics)
+        with self._lock:
+            d["searches"] = [search.serialize(statistics) for search in self._searches.values()]
+        return d
+
+    def add_search(self, search):
+        """
+        Adds a search to the group. A search with the same name is replaced.
+        """
+        with self._lock:
+            replaced = self._searches.pop(search.name, None)
+            self._searches[search.name] = search
+            self._percolator.add(search.name, search.assessor)
+        if replaced is not None:
+            replaced.store.close()
+
+    def remove_search(self, name, timeout=60):
+        """
+        Removes a search and closes its store once a running poll, which may
+        still add ads to it, is finished or `timeout` seconds have passed.
+        """
+        with self._lock:
+            search = self._searches.pop(name)
+            self._percolator.remove(name)
+        self.join(timeout)
+        search.store.close()
+
+    def search(self, name):
+        return self._searches[name]
+
+    @property
+    def profile(self):
+        return self._profile
+
+    @property
+    def searches(self):
+        return list(self._searches.values())
+
+    def _process_ads(self, ads, batch=False):
+        """
+        The percolator checks each ad against all searches, so there is no
+        batch mode here.
+        """
+        if len(ads) == 0: return
+        time_mark = self._time_mark
+        seen = set()
+        hits = OrderedDict()
+        for ad in ads:
+            if ad.datetime > time_mark:
+                time_mark = ad.datetime
+            if ad.key in seen:
+                continue    # Clear duplicates!
+            seen.add(ad.key)
+            for name in self._match(ad):
+                hits.setdefault(name, []).append(ad)
+        for name, hit_ads in hits.items():
+            with self._lock:
+                search = self._searches.get(name)
+            if search is None:
+                continue    # removed in the meantime
+            for ad in search.store.add_ads(hit_ads):
+                try:
+                    logging.info("Search '{}/{}' Found Ad: {}".format(self._name, name, ad["title"]))
+                except KeyError:
+                    logging.info("Search '{}/{}' Found Ad: {}".format(self._name, name, ad.key))
+                if search.notifications:
+                    self._notify(search.notifications, ad)
+        if time_mark != self._time_mark:
+            self._time_mark = time_mark
+            self._save_time_mark()
 
-            # going to sleep
-            next_time = datetime.datetime.now() + datetime.timedelta(seconds=self._interval)
-            while datetime.datetime.now() < next_time:
-                time.sleep(1)
-                if self._quit:
-                    return   # Quit now if quit() was called while sleeping
+    def _match(self, ad):
+        try:
+            return self._percolator.match(ad)
+        except self._CHECK_ERRORS as error:
+            logging.warning("Search group '{}' skips ad {} that cannot be checked: {!r}".format(
+                self._name, ad.key, error))
+            return []
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, deque
+from threading import RLock
+from adassessor import (_lowered, AdCriterionAnd, AdCriterionKeywordsAll, AdCriterionKeywordsAny, AdCriterionLessThan,
+                        AdCriterionGreaterThan, AdCriterionBetween)
+
+
+class AhoCorasick(object):
+    """
+    Finds all occurrences of many keywords in a text in a single pass. The
+    time needed does not depend on the number of keywords.
+    """
+
+    def __init__(self, keywords):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [frozenset()]
+        outputs = [set()]
+        for kwd in keywords:
+            state = 0
+            for ch in kwd:
+                if ch not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    outputs.append(set())
+                    self._goto[state][ch] = len(self._goto) - 1
+                state = self._goto[state][ch]
+            outputs[state].add(kwd)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(ch, 0)
+                outputs[next_state] |= outputs[self._fail[next_state]]
+        self._out = [frozenset(out) for out in outputs]
+
+    def findall(self, text):
+        """
+        The set of keywords found in `text`.
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found |= out[state]
+        return found
+
+
+class Percolator(object):
+    """
+    Matches ads against many saved searches at once. Instead of running every
+    search's assessor on every ad, each search is indexed by one condition
+    that every matching ad must fulfil (its anchor):
+
+    * a keyword of a keywords_all criterion (the longest one),
+    * the keywords of a keywords_any criterion or
+    * the limit of a less_than or greater_than criterion or the lower limit
+      of a between criterion.
+
+    An ad is looked up in a keyword automaton per tag and in sorted limit lists
+    per tag; only the searches found this way (plus the few searches without an
+    anchor) are checked with their full assessor. Anchors are taken from the
+    top-level criteria and from nested `and` groups.
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self._assessors = dict()
+        self._index = None
+
+    def add(self, name, assessor):
+        with self._lock:
+            self._assessors[name] = assessor
+            self._index = None
+
+    def remove(self, name):
+        with self._lock:
+            del self._assessors[name]
+            self._index = None
+
+    def __len__(self):
+        return len(self._assessors)
+
+    @staticmethod
+    def _anchors(criteria):
+        for criterion in criteria:
+            if isinstance(criterion, AdCriterionAnd):
+                for anchor in Percolator._anchors(criterion.criteria):
+                    yield anchor
+            elif isinstance(criterion, AdCriterionKeywordsAll):
+                keywords = [kwd.lower() for kwd in criterion.serialize()["keywords"] if kwd]
+                if keywords:
+                    yield (0, "keywords", criterion.tagname, [max(keywords, key=len)])
+            elif isinstance(criterion, AdCriterionKeywordsAny):
+                keywords = [kwd.lower() for kwd in criterion.serialize()["keywords"]]
+                if keywords and "" not in keywords:
+                    yield (len(keywords), "keywords", criterion.tagname, keywords)
+            elif isinstance(criterion, AdCriterionLessThan):
+                yield (float("inf"), "less_than", criterion.tagname, criterion.serialize()["limit"])
+            elif isinstance(criterion, AdCriterionGreaterThan):
+                yield (float("inf"), "greater_than", criterion.tagname, criterion.serialize()["limit"])
+            elif isinstance(criterion, AdCriterionBetween):
+                yield (float("inf"), "greater_than", criterion.tagname, criterion.serialize()["lower"])
+
+    def _build_index(self):
+        keywords = defaultdict(lambda: defaultdict(set))    # tag -> keyword -> names
+        limits = defaultdict(list)                          # (kind, tag) -> [(limit, name)]
+        unanchored = set()
+        for name, assessor in self._assessors.items():
+            anchors = sorted(self._anchors(assessor.criteria), key=lambda anchor: anchor[0])
+            if not anchors:
+                unanchored.add(name)
+                continue
+            _, kind, tag, value = anchors[0]
+            if kind == "keywords":
+                for kwd in value:
+                    keywords[tag][kwd].add(name)
+            else:
+                limits[(kind, tag)].append((value, name))
+        automata = dict((tag, (AhoCorasick(names.keys()), dict(names))) for tag, names in keywords.items())
+        ranges = dict()
+        for key, entries in limits.items():
+            entries.sort(key=lambda entry: entry[0])
+            ranges[key] = ([limit for limit, _ in entries], [name for _, name in entries])
+        return automata, ranges, unanchored
+
+    def candidates(self, ad, cache=None):
+        """
+        Names of all searches that might match `ad`.
+        """
+        cache = dict() if cache is None else cache
+        with self._lock:
+            if self._index is None:
+                self._index = self._build_index()
+            automata, ranges, unanchored = self._index
+        found = set(unanchored)
+        for tag, (automaton, names) in automata.items():
+            for kwd in automaton.findall(_lowered(ad, tag, cache)):
+                found |= names[kwd]
+        for (kind, tag), (limit_values, names) in ranges.items():
+            value = ad[tag]
+            if kind == "less_than":     # value <= limit
+                found.update(names[bisect_left(limit_values, value):])
+            else:                       # value >= limit
+                found.update(names[:bisect_right(limit_values, value)])
+        return found
+
+    def match(self, ad):
+        """
+        Names of all searches that match `ad`.
+        """
+        cache = dict()
+        with self._lock:
+            assessors = dict(self._assessors)
+        return [name for name in self.candidates(ad, cache)
+                if name in assessors and assessors[name].check(ad, cache)]
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import math
+import heapq
+import logging
+from itertools import count
+from queue import PriorityQueue
+from threading import Thread, Condition
+
+
+class Lateness(object):
+    """
+    How late the polls of a job started compared to when they were due, and
+    how many of them missed the job's `max_staleness`.
+    """
+
+    __slots__ = ("polls", "missed", "total", "max", "last")
+
+    def __init__(self):
+        self.polls = 0
+        self.missed = 0
+        self.total = 0.0    # seconds
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, lateness, max_staleness=None):
+        self.polls += 1
+        self.total += lateness
+        self.max = max(self.max, lateness)
+        self.last = lateness
+        if max_staleness is not None and lateness > max_staleness:
+            self.missed += 1
+
+    def serialize(self):
+        return dict(polls=self.polls, missed=self.missed, last=self.last, max=self.max,
+                    mean=self.total / self.polls if self.polls else 0.0)
+
+
+def ready_entry(job, due, sequence, aging=60.0):
+    """
+    The order of due jobs: higher `priority` first, then the earliest deadline,
+    which is `max_staleness` seconds after a job was due. Jobs without these
+    attributes have priority 0 and no deadline. A job gains one priority level
+    for every `aging` seconds it was due earlier than another, so under
+    sustained overload the jobs of low priority are delayed but not starved.
+    """
+    max_staleness = getattr(job, "max_staleness", None)
+    deadline = due + max_staleness if max_staleness is not None else float("inf")
+    return (math.floor(due / aging) - getattr(job, "priority", 0), deadline, sequence, due, job)
+
+
+def record_lateness(job, due):
+    lateness = getattr(job, "lateness", None)
+    if lateness is not None:
+        lateness.add(max(0.0, time.monotonic() - due), getattr(job, "max_staleness", None))
+
+
+class Scheduler(object):
+    """
+    Runs the polls of all observers with a constant number of threads. A
+    timer thread keeps a heap of jobs ordered by the time they are due and
+    hands due jobs to a bounded pool of worker threads. A job is any object
+    with a `poll()` method that returns the delay in seconds until its next
+    poll, or None if it should not be polled again. A job is never queued or
+    polled twice at the same time, so a slow poll delays only its own next
+    poll. A job that becomes due while it is queued or polled is polled once
+    more right after.
+
+    Due jobs wait in a queue ordered by priority and deadline (see
+    ready_entry()), so under overload the jobs of low priority fall behind
+    while the others stay on time. Waiting jobs gain a priority level every
+    `aging` seconds. The lateness of each poll is recorded in
+    the `lateness` attribute of the job, if it has one.
+    """
+
+    def __init__(self, workers=8, aging=60.0):
+        self._workers = workers
+        self._aging = aging
+        self._cv = Condition()
+        self._heap = []
+        self._entries = dict()  # job -> heap entry
+        self._running = dict()  # job -> True if it should be polled again right away, includes queued jobs
+        self._sequence = count()
+        self._ready = PriorityQueue()
+        self._threads = []
+        self._quit = False
+
+    def _start(self):
+        if self._threads:
+            return
+        timer = Thread(target=self._run_timer, name="SchedulerTimer", daemon=True)
+        self._threads.append(timer)
+        for i in range(self._workers):
+            self._threads.append(Thread(target=self._run_worker, name="SchedulerWorker-{}".format(i), daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def schedule(self, job, delay=0, keep_earlier=False):
+        """
+        Polls `job` after `delay` seconds. A job that is already scheduled is
+        moved to the new time, unless `keep_earlier` is set and it is due
+        earlier than that.
+        """
+        with self._cv:
+            if self._quit:
+                return
+            self._start()
+            due = time.monotonic() + delay
+            if keep_earlier and job in self._entries and self._entries[job][0] <= due:
+                return
+            self._cancel(job)
+            entry = [due, next(self._sequence), job]
+            self._entries[job] = entry
+            heapq.heappush(self._heap, entry)
+            self._cv.notify()
+
+    def cancel(self, job):
+        """
+        Removes `job` from the schedule. A poll that is running already is
+        not interrupted.
+        """
+        with self._cv:
+            self._cancel(job)
+
+    def _cancel(self, job):
+        entry = self._entries.pop(job, None)
+        if entry is not None:
+            entry[2] = None     # removed from the heap when it is due
+        if job in self._running:
+            self._running[job] = False
+
+    def __len__(self):
+        """
+        The number of scheduled jobs.
+        """
+        return len(self._entries)
+
+    def _run_timer(self):
+        with self._cv:
+            while not self._quit:
+                now = time.monotonic()
+                while self._heap and self._heap[0][0] <= now:
+                    due, _, job = heapq.heappop(self._heap)
+                    if job is None:
+                        continue
+                    del self._entries[job]
+                    if job in self._running:
+                        self._running[job] = True   # polled again as soon as the running poll is done
+                    else:
+                        self._running[job] = False
+                        self._ready.put(ready_entry(job, due, next(self._sequence), self._aging))
+                timeout = self._heap[0][0] - now if self._heap else None
+                self._cv.wait(timeout)
+
+    def _run_worker(self):
+        while True:
+            *_, due, job = self._ready.get()
+            if job is None:
+                return
+            record_lateness(job, due)
+            try:
+                delay = job.poll()
+            except Exception:
+                logging.exception("Scheduled job {} failed and is not polled again".format(job))
+                delay = None
+            with self._cv:
+                if self._running.pop(job) and delay is not None:
+                    delay = 0   # it was due again during the poll
+            if delay is not None:
+                self.schedule(job, delay, keep_earlier=True)    # e.g. an immediate poll requested meanwhile
+
+    def quit(self):
+        """
+        Stops all threads. Running polls are finished first.
+        """
+        with self._cv:
+            self._quit = True
+            for job in list(self._entries):
+                self._cancel(job)
+            self._cv.notify()
+        for _ in range(self._workers):
+            self._ready.put((float("-inf"), 0, next(self._sequence), 0, None))  # ahead of all jobs
+
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
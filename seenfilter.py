@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import math
+import struct
+import hashlib
+from threading import RLock, Lock
+from storewriter import StoreWriter
+
+
+class SeenFilterError(Exception):
+    pass
+
+
+class _BloomSlice(object):
+    """
+    A plain Bloom filter with a fixed capacity. Positions are derived from a
+    single 128 bit digest using double hashing (Kirsch/Mitzenmacher).
+    """
+
+    def __init__(self, capacity, error_rate, bits=None, count=0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.nbits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.nhashes = max(1, int(round(self.nbits / capacity * math.log(2))))
+        self.count = count
+        if bits is None:
+            bits = bytearray((self.nbits + 7) // 8)
+        self.bits = bits
+
+    def _positions(self, digest):
+        h1, h2 = struct.unpack("<QQ", digest)
+        for i in range(self.nhashes):
+            yield (h1 + i * h2) % self.nbits
+
+    def add(self, digest):
+        """
+        Sets all bits of `digest`. Returns `False` if they were already set.
+        """
+        bits = self.bits
+        new = False
+        for pos in self._positions(digest):
+            mask = 1 << (pos & 7)
+            if not bits[pos >> 3] & mask:
+                bits[pos >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __contains__(self, digest):
+        bits = self.bits
+        for pos in self._positions(digest):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+
+class SeenFilter(object):
+    """
+    A compact, probabilistic set of ad keys. Membership tests may return false
+    positives with a probability of about `error_rate`, but never false
+    negatives. The filter grows by chaining additional slices once `capacity`
+    keys have been added, each with twice the capacity and half the error rate
+    of its predecessor, so the overall false positive rate stays bounded by
+    roughly 2 * `error_rate` no matter how many keys are added.
+    """
+
+    _magic = b"UJSF"
+    _version = 1
+    _header = struct.Struct("<4sBI")
+    _slice_header = struct.Struct("<QdQ")
+
+    def __init__(self, path=None, capacity=100000, error_rate=0.001):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        self._path = path
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._lock = RLock()
+        self._save_lock = Lock()
+        self.load()
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.blake2b(repr(key).encode("utf-8"), digest_size=16).digest()
+
+    def _new_slice(self):
+        n = len(self._slices)
+        return _BloomSlice(self._capacity * 2 ** n, self._error_rate / 2 ** (n + 1))
+
+    def add(self, key):
+        """
+        Adds `key` to the filter. Returns `True` if the key was (most likely)
+        not seen before and `False` if it was already present.
+        """
+        digest = self._digest(key)
+        with self._lock:
+            if self._slices[-1].full:
+                self._slices.append(self._new_slice())
+            if any(digest in s for s in self._slices[:-1]):
+                return False
+            return self._slices[-1].add(digest)
+
+    def __contains__(self, key):
+        digest = self._digest(key)
+        with self._lock:
+            return any(digest in s for s in self._slices)
+
+    def __len__(self):
+        return sum(s.count for s in self._slices)
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def size_in_bytes(self):
+        """
+        Memory occupied by the bit arrays of all slices.
+        """
+        return sum(len(s.bits) for s in self._slices)
+
+    def save(self):
+        if not self._path: return
+        with self._lock:
+            slices = [(s.capacity, s.error_rate, s.count, bytes(s.bits)) for s in self._slices]
+        with self._save_lock:
+            tmp_path = self._path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(self._header.pack(self._magic, self._version, len(slices)))
+                for capacity, error_rate, count, bits in slices:
+                    f.write(self._slice_header.pack(capacity, error_rate, count))
+                    f.write(bits)
+            os.replace(tmp_path, self._path)
+        return True
+
+    def load(self):
+        with self._lock:
+            self._slices = []
+            try:
+                with open(self._path, "rb") as f:
+                    magic, version, nslices = self._header.unpack(f.read(self._header.size))
+                    if magic != self._magic or version != self._version:
+                        raise SeenFilterError("{} is not a seen filter file".format(self._path))
+                    for _ in range(nslices):
+                        capacity, error_rate, count = self._slice_header.unpack(f.read(self._slice_header.size))
+                        s = _BloomSlice(capacity, error_rate, count=count)
+                        s.bits = bytearray(f.read(len(s.bits)))
+                        self._slices.append(s)
+            except (TypeError, IOError, struct.error):
+                self._slices = []   # no path, no file or a truncated file
+            if not self._slices:
+                self._slices.append(self._new_slice())
+
+
+class SeenKeyStore(object):
+    """
+    Duplicate suppression for observers based on a SeenFilter. Used on its own
+    it replaces the AdStore: only the keys of processed ads are remembered and
+    no ad history is kept. If `store` is given, the filter sits in front of it:
+    ads whose keys were already seen are dropped right away and only the
+    remaining ads are passed on to the (more expensive) store.
+
+    Note that a false positive of the filter means a new ad is silently
+    dropped. Choose `error_rate` accordingly.
+    """
+
+    def __init__(self, seen_filter, store=None, write_behind=False, flush_interval=5.0, flush_threshold=100):
+        self._filter = seen_filter
+        self._store = store
+        self._writer = None
+        if write_behind and seen_filter.path:
+            self._writer = StoreWriter(seen_filter, flush_interval, flush_threshold)
+        if store is not None and len(seen_filter) == 0:
+            for ad in store:    # warm up the filter from an existing history
+                seen_filter.add(ad.key)
+
+    def add_ads(self, ads):
+        """
+        'ads' is a list of new ads
+        """
+        new_ads = [ad for ad in ads if self._filter.add(ad.key)]
+        if new_ads:
+            writer = self._writer
+            if writer is not None:
+                writer.notify(len(new_ads))
+            else:
+                self._filter.save()
+        if self._store is not None:
+            new_ads = self._store.add_ads(new_ads)
+        return new_ads
+
+    def remove_ads(self, ads):
+        """
+        Removes the ads from the store behind the filter and returns the
+        removed ads. Keys can not be removed from a Bloom filter, so without a
+        store nothing is removed and an empty list is returned.
+        """
+        if self._store is None:
+            return []
+        return self._store.remove_ads(ads)
+
+    def length(self):
+        if self._store is not None:
+            return self._store.length()
+        return len(self._filter)
+
+    def save(self):
+        self._filter.save()
+        if self._store is not None:
+            return self._store.save()
+        return True
+
+    def flush(self):
+        writer = self._writer
+        result = writer.flush() if writer is not None else self._filter.save()
+        if self._store is not None:
+            return self._store.flush() and result
+        return result
+
+    def close(self):
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+        if self._store is not None:
+            self._store.close()
+
+    @property
+    def seen_filter(self):
+        return self._filter
+
+    @property
+    def path(self):
+        if self._store is not None:
+            return self._store.path
+        return self._filter.path
+
+    def __getitem__(self, key):
+        if self._store is None:
+            raise IndexError("A seen filter does not keep any ads")
+        return self._store[key]
+
+    def __iter__(self):
+        if self._store is None:
+            raise TypeError("A seen filter does not keep any ads")
+        return iter(self._store)
@@ -24,13 +24,17 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-from queue import Queue, Empty
-from command import CommandError
+from queue import Queue
+from command import Command, CommandError
 from api.webapi import WebApi
 from config import Config
+from sharedstore import SharedAdStore
+from scheduler import Scheduler
+from asyncscheduler import AsyncScheduler
+from sharding import Supervisor
 from threading import Thread
 import logging
-import time
+import os
 
 class ServerError(Exception):pass
 
@@ -44,6 +48,9 @@ class Server(Thread):
         self._command_queue = Queue()
         self._quit = False
         self._web_api = None
+        self._shared_store = None
+        self._scheduler = None
+        self._supervisor = None
         self.name = "Server"
 
     def _create_config(self):
@@ -61,6 +68,26 @@ class Server(Thread):
             'web': {
                 'host': 'localhost',
                 'port': 8118
+            },
+            'store': {
+                'format': 'mapped',     # 'mapped' (opens instantly) or 'pickle'
+                'write_behind': True,   # save stores in a background thread
+                'flush_interval': 5.0,  # seconds
+                'flush_threshold': 100  # changes
+            },
+            'scheduler': {
+                'workers': 8,           # threads that poll observers, taken when the first observer is added
+                'runtime': 'threads',   # 'threads' or 'asyncio' (one event loop, workers only for blocking calls)
+                'aging': 60             # seconds of waiting after which a due poll gains one priority level
+            },
+            'sharding': {
+                'workers': 0            # worker processes for observers (no shared store then), 0 runs them here
+            },
+            'statistics': {
+                'histograms': False     # record timing histograms of all assessors and criteria
+            },
+            'evaluation': {
+                'corpus': 'corpus'      # the directory evaluate_criteria reads archived result pages from
             }
         }, fixed=True)
 
@@ -72,12 +99,21 @@ class Server(Thread):
             logging.info("Adding observer '{}' to server".format(observer.name))
             
         self._observers.append(observer)
-        observer.start()
+        observer.start(self.scheduler)
     
-    def remove_observer(self, name):
+    def remove_observer(self, name, timeout=60):
+        """
+        Stops an observer and closes its store. A running poll may still add
+        ads to the store, so it is waited for up to `timeout` seconds.
+        """
         try:
             observer = next(observer for observer in self._observers if observer.name == name)
             observer.quit()
+            observer.join(timeout)
+            if observer.is_alive():
+                logging.warning("Observer '{}' is still polling after {} s, closing its store anyway".format(
+                    name, timeout))
+            observer.store.close()  # the same store file may be opened again right away
             self._observers.remove(observer)
         except StopIteration:
             raise ServerError("No observer with the name of '{}'".format(name))
@@ -114,17 +150,10 @@ class Server(Thread):
         by CommandApis like the WebApi or a JsonScript.
         """
         while True:
-
-            # spin the queue. checking for a quit signal every second
-            while True:
-                if self._quit:
-                    self._shutdown()
-                    return
-                try:
-                    command = self._command_queue.get(block=True, timeout=1)
-                    break   # received command!
-                except Empty:
-                    pass
+            command = self._command_queue.get()
+            if command is None:     # put by quit()
+                self._shutdown()
+                return
 
             # process the command
             command.server = self
@@ -137,6 +166,7 @@ class Server(Thread):
 
     def quit(self):
         self._quit = True
+        self._command_queue.put_nowait(None)    # wakes up run() right away
     
     def __getitem__(self, key):
         if type(key) is not str:
@@ -153,7 +183,19 @@ class Server(Thread):
         try:
             logging.info("Processing command '{}'".format(command.name))
             logging.debug("Command info: {}".format(command._cmd_info))
+            if self._config.sharding.workers > 0 and self.supervisor.routes(command._cmd_info):
+                name = self.supervisor.observer_name(command._cmd_info)
+                if name is None:
+                    return self._list_all_observers(command)
+                if not any(observer.name == name for observer in self._observers):
+                    return self.supervisor.execute(command._cmd_info)
+                # created before sharding was turned on, so it stays here
             response = command.execute()
+            if command.name == "set_config" and self._supervisor is not None:
+                if self._config.sharding.workers > 0:
+                    self._supervisor.configure(self._config)
+                else:
+                    self._unshard()
             response_message = {"status": "OK"}
             response_message["response"] = response
             return response_message
@@ -161,6 +203,31 @@ class Server(Thread):
             args_text = "; ".join(["{}".format(arg) for arg in ex.args])
             return {"status": "ERROR", "message": args_text}
 
+    def _list_all_observers(self, command):
+        """
+        The observers of the worker processes and those that run in the server.
+        """
+        response = self.supervisor.execute(command._cmd_info)
+        response["response"]["observers"][:0] = command.execute()["observers"]
+        return response
+
+    def _unshard(self):
+        """
+        Moves the observers of the worker processes back into the server after
+        sharding was turned off.
+        """
+        history = self._supervisor.release()
+        self._supervisor = None
+        for name, commands in history.items():
+            logging.info("Moving observer '{}' back into the server".format(name))
+            for cmd_info in commands:
+                replayed = Command.from_command_info(cmd_info)
+                replayed.server = self
+                try:
+                    replayed.execute()
+                except (ServerError, CommandError) as ex:
+                    logging.error("Failed to move observer '{}' back into the server: {}".format(name, ex.args[0]))
+
     def _shutdown(self):
         logging.info("Shutting down all services")
         if self._web_api:
@@ -179,10 +246,59 @@ class Server(Thread):
                 logging.warning("Timeout while waiting for observer '{}' to shut down".format(observer.name))
             else:
                 logging.info("Observer '{}' successfully shut down".format(observer.name))
+        if self._scheduler is not None:
+            self._scheduler.quit()
+        if self._supervisor is not None:
+            self._supervisor.quit()
+            logging.info("All worker processes shut down")
+        unsaved = [observer.name for observer in self._observers if observer.store.close() is False]
+        if self._shared_store is not None:
+            self._shared_store.close()
+        if unsaved:
+            logging.error("The stores of {} could not be saved".format(", ".join(unsaved)))
+        else:
+            logging.info("All stores saved")
 
     @property
     def config(self):
         return self._config
+
+    @property
+    def scheduler(self):
+        """
+        The scheduler that polls all observers. Created on first use.
+        """
+        if self._scheduler is None:
+            config = self._config.scheduler
+            if config.runtime == "asyncio":
+                self._scheduler = AsyncScheduler(config.workers, config.aging)
+            elif config.runtime == "threads":
+                self._scheduler = Scheduler(config.workers, config.aging)
+            else:
+                raise ServerError("Unknown scheduler runtime: {}".format(config.runtime))
+        return self._scheduler
+
+    @property
+    def supervisor(self):
+        """
+        The supervisor of the worker processes if observers are sharded. Created on first use.
+        """
+        if self._supervisor is None:
+            self._supervisor = Supervisor(self._config.sharding.workers, self._config)
+        return self._supervisor
+
+    @property
+    def shared_store(self):
+        """
+        The store shared by all observers with `"store": "shared"`. Created on first use.
+        """
+        if self._shared_store is None:
+            if not os.path.exists("./store/"): os.mkdir("store")
+            config = self._config.store
+            self._shared_store = SharedAdStore("store/shared.db", write_behind=config.write_behind,
+                                               flush_interval=config.flush_interval,
+                                               flush_threshold=config.flush_threshold)
+        return self._shared_store
     
     @property
     def command_queue(self):
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import bisect
+import hashlib
+import json
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+from threading import Thread, RLock
+
+
+class HashRing(object):
+    """
+    Consistent hashing of observer names onto nodes. Every node is placed on
+    the ring `replicas` times, so adding or removing a node moves only the
+    names next to its points, about 1/N of all names.
+    """
+
+    def __init__(self, nodes=(), replicas=64):
+        self._replicas = replicas
+        self._points = []   # sorted hashes
+        self._nodes = []    # node at the same index as its point
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+    def add(self, node):
+        for replica in range(self._replicas):
+            point = self._hash("{}#{}".format(node, replica))
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._nodes.insert(index, node)
+
+    def remove(self, node):
+        kept = [(point, other) for point, other in zip(self._points, self._nodes) if other != node]
+        self._points = [point for point, _ in kept]
+        self._nodes = [other for _, other in kept]
+
+    def node(self, key):
+        """
+        The node that owns `key`.
+        """
+        if not self._points:
+            raise LookupError("The hash ring has no nodes")
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._nodes[index]
+
+    @property
+    def nodes(self):
+        return sorted(set(self._nodes))
+
+    def __len__(self):
+        return len(set(self._nodes))
+
+
+def _run_worker(connection, config):
+    """
+    Entry point of a worker process: a Server without web API that executes
+    the commands it receives through `connection`.
+    """
+    from server import Server
+    from api.commandapi import CommandApi
+    from command import CommandError
+
+    class PipeApi(CommandApi):
+        def run(self):
+            while True:
+                try:
+                    cmd_info = connection.recv()
+                except EOFError:
+                    break   # the supervisor is gone
+                if cmd_info is None:
+                    break
+                try:
+                    response = self._process_command_info(cmd_info)
+                except CommandError as error:
+                    response = {"status": "ERROR", "message": error.args[0]}
+                connection.send(response)
+
+    server = Server()
+    server.config.update(config)
+    server.start()
+    api = PipeApi(server)
+    api.run()
+    server.quit()
+    server.join()
+
+
+class WorkerError(Exception): pass
+
+
+class _Worker(object):
+    """
+    A worker process and the pipe to it.
+    """
+
+    def __init__(self, index, config, context):
+        self.index = index
+        self.restarts = 0
+        self._config = config
+        self._context = context
+        self._process = None
+        self._connection = None
+
+    def start(self):
+        self._connection, child = self._context.Pipe()
+        self._process = self._context.Process(target=_run_worker, args=(child, self._config),
+                                              name="ShardWorker-{}".format(self.index), daemon=True)
+        self._process.start()
+        child.close()
+
+    def restart(self):
+        self.stop(timeout=0)
+        self.restarts += 1
+        self.start()
+
+    @property
+    def sentinel(self):
+        return self._process.sentinel
+
+    def is_alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    def call(self, cmd_info):
+        """
+        Executes a command in the worker and returns its response message.
+        Raises WorkerError if the worker dies meanwhile.
+        """
+        try:
+            self._connection.send(cmd_info)
+            while not self._connection.poll(0.1):
+                if not self._process.is_alive():
+                    raise WorkerError("Worker {} died".format(self.index))
+            return self._connection.recv()
+        except (EOFError, OSError) as error:
+            raise WorkerError("Worker {} died: {}".format(self.index, error))
+
+    def stop(self, timeout=5):
+        if self._process is None:
+            return
+        try:
+            self._connection.send(None)
+        except OSError:
+            pass    # dead already
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self._connection.close()
+
+    def serialize(self):
+        return dict(worker=self.index, pid=self._process.pid, alive=self.is_alive(), restarts=self.restarts)
+
+
+class Supervisor(object):
+    """
+    Shards observers across worker processes by consistent hashing of their
+    names. Commands about an observer are routed to the worker that owns it,
+    `set_config` goes to all workers and `list_observers` collects the
+    observers of all workers. The commands that set up each observer are kept,
+    so a crashed worker is restarted with its observers, and changing the
+    number of workers moves the observers whose owner changed.
+
+    The shared store (`"store": "shared"`) is not available, since every
+    worker would open a store of its own on the same file.
+    """
+
+    # command -> key of the observer name
+    ROUTES = {
+        "create_observer": "name",
+        "create_search_group": "name",
+        "remove_observer": "name",
+        "update_observer": "name",
+        "pause_observer": "name",
+        "resume_observer": "name",
+        "observer_state": "name",
+        "get_observer": "name",
+        "add_notification": "observer",
+        "add_search": "group",
+        "remove_search": "group",
+        "evaluate_criteria": "observer",
+    }
+    # commands that change an observer and are replayed when it is moved
+    REPLAYED = ("update_observer", "add_notification", "add_search", "remove_search", "pause_observer",
+                "resume_observer")
+
+    def __init__(self, workers, config):
+        self._config = self._worker_config(config)
+        self._context = multiprocessing.get_context("spawn")    # no threads are forked along
+        self._lock = RLock()
+        self._workers = []
+        self._ring = HashRing()
+        self._history = dict()  # observer name -> commands that set it up
+        self._quit = False
+        self._wakeup, self._waker = self._context.Pipe(duplex=False)
+        self.resize(workers)
+        self._monitor = Thread(target=self._run_monitor, name="ShardMonitor", daemon=True)
+        self._monitor.start()
+
+    @staticmethod
+    def _worker_config(config):
+        config = json.loads(json.dumps(config))     # plain dicts, without the fixed tree
+        config["sharding"]["workers"] = 0
+        config.pop("web", None)
+        return config
+
+    def routes(self, cmd_info):
+        """
+        True if the command is executed by the supervisor instead of the server.
+        """
+        command = cmd_info.get("command")
+        if command == "list_observers":
+            return True
+        return command in self.ROUTES and self.ROUTES[command] in cmd_info
+
+    def observer_name(self, cmd_info):
+        """
+        The name of the observer a routed command is about, None for `list_observers`.
+        """
+        key = self.ROUTES.get(cmd_info.get("command"))
+        return None if key is None else cmd_info[key]
+
+    def execute(self, cmd_info):
+        """
+        Executes a command in the owning worker and returns the response message.
+        """
+        with self._lock:
+            if cmd_info["command"] == "list_observers":
+                return self._list_observers(cmd_info)
+            if cmd_info.get("store") == "shared":
+                return {"status": "ERROR", "message": "The shared store can not be used while observers are sharded"}
+            name = cmd_info[self.ROUTES[cmd_info["command"]]]
+            worker = self._owner(name)
+            try:
+                response = worker.call(cmd_info)
+            except WorkerError as error:
+                logging.error("{}. Restarting it.".format(error.args[0]))
+                self._restart(worker)
+                return {"status": "ERROR", "message": error.args[0]}
+            if response.get("status") == "OK":
+                self._record(name, cmd_info)
+            return response
+
+    def configure(self, config):
+        """
+        Passes a changed configuration on to all workers and adjusts their number.
+        """
+        with self._lock:
+            self._config = self._worker_config(config)
+            for worker in self._workers:
+                worker._config = self._config
+                self._call(worker, dict(command="set_config", config=self._config))
+            self.resize(config.sharding.workers)
+
+    def resize(self, workers):
+        """
+        Starts or stops workers and moves the observers whose owner changed.
+        """
+        if workers < 1:
+            logging.warning("A sharded server needs at least one worker")
+            return
+        with self._lock:
+            if workers == len(self._workers):
+                return
+            owners = {name: self._ring.node(name) for name in self._history}
+            while len(self._workers) < workers:
+                worker = _Worker(len(self._workers), self._config, self._context)
+                worker.start()
+                self._workers.append(worker)
+                self._ring.add(worker.index)
+            removed = self._workers[workers:]
+            del self._workers[workers:]
+            for worker in removed:
+                self._ring.remove(worker.index)
+            for name, owner in owners.items():
+                if self._ring.node(name) != owner:
+                    logging.info("Moving observer '{}' from worker {} to {}".format(name, owner, self._ring.node(name)))
+                    old = next((worker for worker in self._workers + removed if worker.index == owner))
+                    self._call(old, dict(command="remove_observer", name=name))
+                    self._replay(self._owner(name), name)
+            for worker in removed:
+                worker.stop()
+            self._waker.send_bytes(b"")   # the monitor watches other processes now
+
+    def workers(self):
+        with self._lock:
+            return [worker.serialize() for worker in self._workers]
+
+    def _owner(self, name):
+        worker = self._workers[self._ring.node(name)]
+        if not worker.is_alive():
+            self._restart(worker)
+        return worker
+
+    def _record(self, name, cmd_info):
+        command = cmd_info["command"]
+        if command in ("create_observer", "create_search_group"):
+            self._history[name] = [cmd_info]
+        elif command == "remove_observer":
+            self._history.pop(name, None)
+        elif command in self.REPLAYED and name in self._history:
+            history = self._history[name]
+            if command in ("pause_observer", "resume_observer"):    # only the last one counts
+                history[:] = [cmd for cmd in history if cmd["command"] not in ("pause_observer", "resume_observer")]
+            history.append(cmd_info)
+
+    def _call(self, worker, cmd_info, restart=True):
+        try:
+            response = worker.call(cmd_info)
+        except WorkerError as error:
+            logging.error(error.args[0])
+            if restart:
+                self._restart(worker)
+            return
+        if response.get("status") != "OK":
+            logging.error("Worker {} failed to execute `{}`: {}".format(worker.index, cmd_info["command"],
+                                                                       response.get("message")))
+
+    def _replay(self, worker, name, restart=True):
+        for cmd_info in self._history[name]:
+            self._call(worker, cmd_info, restart)
+
+    def _restart(self, worker):
+        """
+        Restarts a worker and sets up all its observers again.
+        """
+        worker.restart()
+        self._call(worker, dict(command="set_config", config=self._config), restart=False)
+        for name in list(self._history):
+            if self._ring.node(name) == worker.index:
+                self._replay(worker, name, restart=False)  # if it dies again, the monitor restarts it
+        self._waker.send_bytes(b"")
+
+    def _list_observers(self, cmd_info):
+        observers = []
+        for worker in self._workers:
+            if not worker.is_alive():
+                self._restart(worker)
+            try:
+                response = worker.call(cmd_info)
+            except WorkerError as error:
+                logging.error("{}. Restarting it.".format(error.args[0]))
+                self._restart(worker)
+                continue
+            for observer in response.get("response", dict()).get("observers", []):
+                observer["worker"] = worker.index
+                observers.append(observer)
+        workers = [worker.serialize() for worker in self._workers]
+        return {"status": "OK", "response": dict(observers=observers, workers=workers)}
+
+    def _run_monitor(self):
+        """
+        Restarts workers as soon as their process ends.
+        """
+        while True:
+            with self._lock:
+                if self._quit:
+                    return
+                sentinels = {worker.sentinel: worker for worker in self._workers}
+            ready = wait(list(sentinels) + [self._wakeup])
+            with self._lock:
+                if self._quit:
+                    return
+                while self._wakeup.poll():
+                    self._wakeup.recv_bytes()
+                for sentinel in ready:
+                    worker = sentinels.get(sentinel)
+                    if worker is not None and worker in self._workers and not worker.is_alive():
+                        logging.error("Worker {} died. Restarting it.".format(worker.index))
+                        self._restart(worker)
+
+    def release(self):
+        """
+        Stops all workers and returns the commands that set up their observers
+        (observer name -> commands), so they can be set up somewhere else.
+        """
+        with self._lock:
+            history, self._history = self._history, dict()
+        self.quit()
+        return history
+
+    def quit(self):
+        with self._lock:
+            self._quit = True
+            self._waker.send_bytes(b"")
+            for worker in self._workers:
+                worker.stop()
+        self._monitor.join(timeout=3)
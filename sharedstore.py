@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import pickle
+from threading import RLock, Lock
+from storewriter import StoreWriter
+
+
+class SharedAdStore(object):
+    """
+    A single ad store for many observers. Each ad is stored once per
+    (profile, key), no matter how many observers matched it. Observer
+    membership is kept as a bitset per ad, one bit per observer name. Memory
+    and disk usage therefore scale with the number of unique ads instead of
+    the number of observers.
+
+    Observers don't use the shared store directly but through a view (see
+    view()), which provides the regular AdStore interface.
+    """
+
+    def __init__(self, path=None, write_behind=False, flush_interval=5.0, flush_threshold=100):
+        self._path = path
+        self._lock = RLock()
+        self._save_lock = Lock()
+        self._writer = None
+        self.load()
+        if write_behind and path:
+            self._writer = StoreWriter(self, flush_interval, flush_threshold)
+
+    def view(self, observer, profile):
+        """
+        Returns the store of `observer` for ads of `profile`.
+        """
+        return SharedAdStoreView(self, observer, profile)
+
+    def _bit(self, observer):
+        try:
+            return self._bits[observer]
+        except KeyError:
+            self._bits[observer] = 1 << len(self._bits)
+            return self._bits[observer]
+
+    def add_ads(self, observer, profile, ads):
+        """
+        Adds `ads` for `observer`. Returns the ads that are new to the
+        observer, even if other observers already stored them.
+        """
+        with self._lock:
+            bit = self._bit(observer)
+            added_ads = []
+            for ad in ads:
+                ident = (profile, ad.key)
+                members = self._members.get(ident, 0)
+                if members & bit:
+                    continue
+                if not members:
+                    self._ads[ident] = ad
+                self._members[ident] = members | bit
+                added_ads.append(ad)
+            self._changed(len(added_ads))
+            return added_ads
+
+    def remove_ads(self, observer, profile, ads):
+        with self._lock:
+            bit = self._bits.get(observer, 0)
+            removed_ads = []
+            for ad in ads:
+                ident = (profile, ad.key)
+                members = self._members.get(ident, 0)
+                if not members & bit:
+                    continue
+                members &= ~bit
+                if members:
+                    self._members[ident] = members
+                else:
+                    del self._members[ident]
+                    del self._ads[ident]
+                removed_ads.append(ad)
+            self._changed(len(removed_ads))
+            return removed_ads
+
+    def ads(self, observer, profile):
+        """
+        All ads of `observer` for `profile`, sorted by date.
+        """
+        with self._lock:
+            bit = self._bits.get(observer, 0)
+            ads = [ad for ident, ad in self._ads.items()
+                   if ident[0] == profile and self._members[ident] & bit]
+        return sorted(ads, key=lambda ad: ad.datetime)
+
+    def observers_of(self, profile, key):
+        """
+        The names of all observers that matched the ad.
+        """
+        with self._lock:
+            members = self._members.get((profile, key), 0)
+            return [name for name, bit in self._bits.items() if members & bit]
+
+    def __len__(self):
+        return len(self._ads)
+
+    @property
+    def path(self):
+        return self._path
+
+    def _changed(self, mutations):
+        if mutations == 0: return
+        writer = self._writer
+        if writer is not None:
+            writer.notify(mutations)
+        else:
+            self.save()
+
+    def save(self):
+        if not self._path: return
+        with self._lock:
+            state = {"bits": dict(self._bits), "ads": dict(self._ads), "members": dict(self._members)}
+        with self._save_lock:
+            tmp_path = self._path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f)
+            os.replace(tmp_path, self._path)
+        return True
+
+    def load(self):
+        with self._lock:
+            self._bits = {}     # observer name -> bit
+            self._ads = {}      # (profile, key) -> ad
+            self._members = {}  # (profile, key) -> bitset of observers
+            try:
+                with open(self._path, "rb") as f:
+                    state = pickle.load(f)
+                self._bits, self._ads, self._members = state["bits"], state["ads"], state["members"]
+            except (TypeError, IOError, EOFError):
+                pass
+
+    def flush(self):
+        writer = self._writer
+        if writer is not None:
+            return writer.flush()
+        return self.save()
+
+    def close(self):
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+
+
+class SharedAdStoreView(object):
+    """
+    The AdStore interface of one observer to a SharedAdStore.
+    """
+
+    def __init__(self, shared_store, observer, profile):
+        self._shared = shared_store
+        self._observer = observer
+        self._profile = profile
+
+    def add_ads(self, ads):
+        return self._shared.add_ads(self._observer, self._profile, ads)
+
+    def remove_ads(self, ads):
+        return self._shared.remove_ads(self._observer, self._profile, ads)
+
+    def length(self):
+        return len(self._shared.ads(self._observer, self._profile))
+
+    def save(self):
+        return self._shared.save()
+
+    def flush(self):
+        return self._shared.flush()
+
+    def close(self):
+        """
+        Only flushes. The shared store stays open for the other observers.
+        """
+        self._shared.flush()
+
+    @property
+    def shared_store(self):
+        return self._shared
+
+    @property
+    def path(self):
+        return self._shared.path
+
+    def __getitem__(self, key):
+        return self._shared.ads(self._observer, self._profile)[key]
+
+    def __iter__(self):
+        return iter(self._shared.ads(self._observer, self._profile))
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import logging
+from threading import Thread, Condition, Lock
+
+
+class StoreWriter(object):
+    """
+    Persists a store in the background (write-behind). Mutations are only
+    announced with notify(); the writer coalesces them and calls the store's
+    save() method once `interval` seconds have passed since the first unsaved
+    mutation, or as soon as `threshold` mutations are pending, whatever comes
+    first. The store's save() must be safe to call from another thread. If a
+    save fails, the mutations stay pending and the save is retried after
+    `interval` seconds, and once more on close().
+
+    The writers of all stores share one background thread, so the number of
+    threads does not grow with the number of stores.
+    """
+
+    def __init__(self, store, interval=5.0, threshold=100):
+        self._store = store
+        self._interval = interval
+        self._threshold = threshold
+        self._thread = _writer_thread()
+        self._cv = self._thread.cv
+        self._pending = 0           # mutations since the last save
+        self._since = None          # time of the first unsaved mutation
+        self._generation = 0        # counts all mutations ever announced
+        self._written = 0           # generation covered by the last save
+        self._attempted = 0         # generation covered by the last attempt to save
+        self._retry_at = None       # time.monotonic() after which a failed save is retried
+        self._flush_requested = 0   # generation a flush() is waiting for
+        self._quit = False
+        self._closed = False
+        self._error = None
+        self._thread.add(self)
+
+    def notify(self, mutations=1):
+        """
+        Announces `mutations` new changes to the store.
+        """
+        with self._cv:
+            if self._pending == 0:
+                self._since = time.monotonic()
+            self._pending += mutations
+            self._generation += 1
+            if self._pending >= self._threshold:
+                self._cv.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Blocks until all mutations announced so far are saved. Returns `False`
+        if the save failed or the timeout expired.
+        """
+        with self._cv:
+            target = self._generation
+            if self._written >= target:
+                return True
+            self._flush_requested = max(self._flush_requested, target)
+            self._cv.notify_all()
+            if not self._cv.wait_for(lambda: self._attempted >= target or self._closed, timeout):
+                return False
+            return self._written >= target
+
+    def close(self, timeout=None):
+        """
+        Saves everything that is pending and detaches the store from the
+        writer thread. Returns `False` if changes could not be saved.
+        """
+        with self._cv:
+            self._quit = True
+            self._cv.notify_all()
+            self._cv.wait_for(lambda: self._closed, timeout)
+            saved = self._closed and self._written >= self._generation
+        if not saved:
+            logging.error("Store {} was closed with unsaved changes".format(getattr(self._store, "path", None)))
+        return saved
+
+    def _due(self):
+        if self._quit:
+            return True
+        if self._retry_at is not None:
+            return self._pending > 0 and time.monotonic() >= self._retry_at
+        if self._flush_requested > self._attempted or self._pending >= self._threshold:
+            return True
+        return self._pending > 0 and time.monotonic() - self._since >= self._interval
+
+    def _timeout(self):
+        if self._pending == 0:
+            return None
+        if self._retry_at is not None:
+            return max(0, self._retry_at - time.monotonic())
+        return max(0, self._interval - (time.monotonic() - self._since))
+
+    def _take(self):
+        """
+        Called with the lock held when the writer is due. Returns the
+        generation the save will cover and the number of mutations it saves.
+        """
+        target = self._generation
+        pending = self._pending
+        self._pending = 0
+        return target, pending
+
+    def _save(self):
+        try:
+            self._store.save()
+            self._error = None
+            return True
+        except Exception as error:
+            self._error = error
+            logging.error("Failed to save store {}: {}".format(getattr(self._store, "path", None), error))
+            return False
+
+    def _saved(self, target, pending, saved):
+        """
+        Called with the lock held after a save. A failed save keeps its
+        mutations pending, so they are saved again later.
+        """
+        self._attempted = target
+        if saved:
+            self._written = target
+            self._retry_at = None
+        else:
+            self._pending += pending
+            self._since = time.monotonic()
+            self._retry_at = self._since + self._interval
+
+
+class _WriterThread(Thread):
+    """
+    Saves the stores of all StoreWriters that are due, one after the other.
+    """
+
+    def __init__(self):
+        super(_WriterThread, self).__init__()
+        self.name = "StoreWriter"
+        self.daemon = True
+        self.cv = Condition()
+        self._writers = set()
+
+    def add(self, writer):
+        with self.cv:
+            self._writers.add(writer)
+            self.cv.notify_all()
+
+    def _wait_for_due(self):
+        while True:
+            due = [writer for writer in self._writers if writer._due()]
+            if due:
+                return due
+            timeouts = [timeout for timeout in (writer._timeout() for writer in self._writers)
+                        if timeout is not None]
+            self.cv.wait(min(timeouts) if timeouts else None)
+
+    def run(self):
+        while True:
+            with self.cv:
+                due = [(writer, writer._take(), writer._quit) for writer in self._wait_for_due()]
+            for writer, (target, pending), quit in due:
+                saved = writer._save() if pending else True
+                with self.cv:
+                    writer._saved(target, pending, saved)
+                    if quit:
+                        self._writers.discard(writer)
+                        writer._closed = True
+                    self.cv.notify_all()
+
+
+_thread = None
+_thread_lock = Lock()
+
+
+def _writer_thread():
+    global _thread
+    with _thread_lock:
+        if _thread is None:
+            _thread = _WriterThread()
+            _thread.start()
+        return _thread
@@ -26,6 +26,7 @@ SOFTWARE.
 
 import unittest
 from adassessor import *
+from adstore import Ad
 from connector import *
 
 
@@ -88,4 +89,406 @@ class TestAdAssessor(unittest.TestCase):
 
     def test_adassessor_returns_true_if_empty(self):
         self._base_ad["title"] = "Expensive Blablabla"
-        self.assertTrue (self._assessor.check(self._base_ad))
\ No newline at end of file
+        self.assertTrue (self._assessor.check(self._base_ad))
+
+    def test_tag_is_lowercased_once_per_ad(self):
+        class CountingStr(str):
+            calls = 0
+            def lower(self):
+                CountingStr.calls += 1
+                return str.lower(self)
+        self._assessor.add_criteria(AdCriterionKeywordsAny({"tag": "title", "keywords": ["schöner"]}),
+                                    AdCriterionKeywordsAll({"tag": "title", "keywords": ["das", "tag"]}),
+                                    AdCriterionKeywordsNot({"tag": "title", "keywords": ["wagen"]}))
+        self._base_ad["title"] = CountingStr("Das ist ein schöner Tag")
+        self.assertTrue(self._assessor.check(self._base_ad))
+        self.assertEqual(CountingStr.calls, 1)
+
+    def test_evaluation_stops_at_first_failure(self):
+        self._assessor.add_criteria(AdCriterionLessThan({"tag": "price", "limit": 50}),
+                                    AdCriterionKeywordsAny({"tag": "title", "keywords": ["schöner"]}))
+        self._base_ad["price"] = 70     # no title tag, the keyword criterion would raise a KeyError
+        self.assertFalse(self._assessor.check(self._base_ad))
+
+    def test_selective_cheap_criteria_are_evaluated_first(self):
+        slow = AdCriterionKeywordsNot({"tag": "title", "keywords": ["kw{}".format(i) for i in range(300)]})
+        selective = AdCriterionLessThan({"tag": "price", "limit": 50})
+        self._assessor.add_criteria(slow, selective)
+        self._base_ad["title"] = "Das ist ein schöner Tag " * 20
+        for price in range(AdAssessor.reorder_interval):
+            self._base_ad["price"] = 40 + price
+            self._assessor.check(self._base_ad)
+        self.assertListEqual(self._assessor.order, [selective, slow])
+        self.assertListEqual(self._assessor.criteria, [slow, selective])
+        stats = self._assessor.statistics()
+        self.assertEqual(stats[0]["position"], 1)
+        self.assertEqual(stats[1]["evaluations"], AdAssessor.reorder_interval)
+        self.assertEqual(stats[1]["rejections"], AdAssessor.reorder_interval - 11)
+
+    def test_statistics_while_reordering(self):
+        assessor = self._assessor
+        assessor.add_criteria(AdCriterionLessThan({"tag": "price", "limit": 50}),
+                              AdCriterionLessThan({"tag": "price", "limit": 60}))
+        seen = []
+
+        class PeekingStats(CriterionStats):
+            @property
+            def rank(self):     # runs while the order is being sorted
+                seen.append(assessor.statistics())
+                return 0
+
+        assessor._stats[0] = PeekingStats()
+        assessor._reorder()
+        self.assertTrue(seen)
+        self.assertListEqual([stats["position"] for stats in seen[0]], [0, 1])
+
+
+class CountingCriterion(AdCriterion):
+    criterion_type = "counting"
+    evaluations = 0
+
+    def __init__(self, data):
+        self._tagname = data["tag"]
+
+    def check(self, ad):
+        CountingCriterion.evaluations += 1
+        return bool(ad[self._tagname])
+
+    def serialize(self):
+        return {"type": self.criterion_type, "tag": self._tagname}
+
+
+class TestAdCriterionGroups(unittest.TestCase):
+
+    def setUp(self):
+        self._assessor = AdAssessor()
+        self._ad = Ad({"id":1, "dt":"2014-07-07", "title": "Schöner Kinderwagen", "price": 80}, "id", "dt")
+        self._data = {"type": "and", "criteria": [
+                         {"type": "or", "criteria": [
+                             {"type": "keywords_any", "tag": "title", "keywords": ["kinderwagen"]},
+                             {"type": "keywords_any", "tag": "title", "keywords": ["buggy"]}]},
+                         {"type": "not", "criterion": {"type": "greater_than", "tag": "price", "limit": 100}}]}
+
+    def test_nested_groups(self):
+        criterion = AdCriterion.from_json(self._data)
+        self.assertIsInstance(criterion, AdCriterionAnd)
+        self.assertTrue(criterion.check(self._ad))
+        self._ad["price"] = 150
+        self.assertFalse(criterion.check(self._ad))
+        self._ad["price"] = 80
+        self._ad["title"] = "Schöner Buggy"
+        self.assertTrue(criterion.check(self._ad))
+        self._ad["title"] = "Schönes Fahrrad"
+        self.assertFalse(criterion.check(self._ad))
+
+    def test_serialize_round_trip(self):
+        criterion = AdCriterion.from_json(self._data)
+        self.assertDictEqual(criterion.serialize(), self._data)
+        self.assertDictEqual(AdCriterion.from_json(criterion.serialize()).serialize(), self._data)
+
+    def test_constant_folding(self):
+        self.assertIs(AdCriterion.from_json({"type": "and", "criteria": []}).compile(), True)
+        self.assertIs(AdCriterion.from_json({"type": "or", "criteria": []}).compile(), False)
+        self.assertIs(AdCriterion.from_json({"type": "not", "criterion": {"type": "or", "criteria": []}}).compile(),
+                      True)
+        leaf = {"type": "counting", "tag": "price"}
+        contradiction = AdCriterion.from_json({"type": "and", "criteria": [leaf, {"type": "not", "criterion": leaf}]})
+        self.assertIs(contradiction.compile(), False)
+        double_negation = AdCriterion.from_json({"type": "not", "criterion": {"type": "not", "criterion": leaf}})
+        self.assertEqual(double_negation.compile().__self__.key, AdCriterion.from_json(leaf).key)
+
+    def test_common_subexpressions_are_evaluated_once(self):
+        leaf = {"type": "counting", "tag": "price"}
+        self._assessor.add_criteria(AdCriterion.from_json(leaf),
+                                    AdCriterion.from_json({"type": "or", "criteria": [
+                                        {"type": "keywords_any", "tag": "title", "keywords": ["buggy"]}, leaf]}),
+                                    AdCriterion.from_json({"type": "and", "criteria": [leaf, leaf]}))
+        CountingCriterion.evaluations = 0
+        self.assertTrue(self._assessor.check(self._ad))
+        self.assertEqual(CountingCriterion.evaluations, 1)
+
+
+class TestKeywordMatcher(unittest.TestCase):
+
+    def _naive_all(self, keywords, text):
+        return all(text.lower().find(kwd.lower()) >= 0 for kwd in keywords)
+
+    def _naive_any(self, keywords, text):
+        return any(text.lower().find(kwd.lower()) >= 0 for kwd in keywords)
+
+    def test_overlapping_keywords(self):
+        matcher = KeywordMatcher(["Schöner", "schön", "höne", "ner tag"])
+        self.assertTrue(matcher.all("das ist ein schöner tag"))
+        self.assertFalse(matcher.all("das ist ein schöner wagen"))
+        self.assertTrue(matcher.any("schön"))
+        self.assertFalse(matcher.any("schoen"))
+
+    def test_empty_keywords(self):
+        self.assertTrue(KeywordMatcher([]).all("text"))
+        self.assertFalse(KeywordMatcher([]).any("text"))
+        self.assertTrue(KeywordMatcher([""]).any("text"))
+        self.assertTrue(KeywordMatcher(["", "te"]).all("text"))
+
+    def test_same_result_as_naive_search(self):
+        import random
+        rnd = random.Random(42)
+        alphabet = "abc .-"
+        for _ in range(500):
+            keywords = ["".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 3)))
+                        for _ in range(rnd.randint(1, 5))]
+            text = "".join(rnd.choice(alphabet + "ABC") for _ in range(rnd.randint(0, 20)))
+            matcher = KeywordMatcher(keywords)
+            self.assertEqual(matcher.all(text.lower()), self._naive_all(keywords, text), (keywords, text))
+            self.assertEqual(matcher.any(text.lower()), self._naive_any(keywords, text), (keywords, text))
+
+
+class TestCheckBatch(unittest.TestCase):
+
+    def setUp(self):
+        import random
+        rnd = random.Random(3)
+        words = ["kinderwagen", "buggy", "rad", "sofa", "rot", "blau"]
+        self._ads = [Ad({"id": nr, "dt": nr, "title": " ".join(rnd.sample(words, 3)).title(),
+                         "price": float(rnd.randint(0, 200))}, "id", "dt") for nr in range(300)]
+
+    def _assert_same_as_check(self, *criteria):
+        assessor = AdAssessor()
+        assessor.reorder_interval = len(self._ads) + 1     # both see the criteria in the same order
+        for criterion in criteria:
+            assessor.add_criterion(AdCriterion.from_json(criterion))
+        expected = [assessor.check(ad) for ad in self._ads]
+        self.assertListEqual([bool(hit) for hit in assessor.check_batch(self._ads)], expected)
+
+    def test_numeric_criteria(self):
+        self._assert_same_as_check({"type": "less_than", "tag": "price", "limit": 150},
+                                   {"type": "greater_than", "tag": "price", "limit": 20})
+
+    def test_keyword_criteria(self):
+        self._assert_same_as_check({"type": "keywords_all", "tag": "title", "keywords": ["Rad", "rot"]})
+        self._assert_same_as_check({"type": "keywords_any", "tag": "title", "keywords": ["buggy", "sofa"]})
+        self._assert_same_as_check({"type": "keywords_not", "tag": "title", "keywords": ["blau"]})
+        self._assert_same_as_check({"type": "keywords_any", "tag": "title", "keywords": ["nothing"]})
+
+    def test_groups_and_fallback(self):
+        self._assert_same_as_check(
+            {"type": "or", "criteria": [
+                {"type": "keywords_any", "tag": "title", "keywords": ["kinderwagen"]},
+                {"type": "not", "criterion": {"type": "greater_than", "tag": "price", "limit": 100}}]},
+            {"type": "counting", "tag": "price"})
+
+    def test_missing_tags_are_not_evaluated(self):
+        for nr, ad in enumerate(self._ads):
+            if nr % 3 == 0 and ad["price"] > 100:
+                del ad["title"]     # check() never reads it, since the price criterion rejects first
+        criteria = [{"type": "less_than", "tag": "price", "limit": 100},
+                    {"type": "keywords_any", "tag": "title", "keywords": ["buggy", "sofa"]}]
+        self._assert_same_as_check(*criteria)
+        self._assert_same_as_check({"type": "and", "criteria": criteria})
+        self._assert_same_as_check({"type": "or", "criteria": [
+            {"type": "greater_than", "tag": "price", "limit": 100},
+            {"type": "keywords_any", "tag": "title", "keywords": ["buggy"]}]})
+
+    def test_only_remaining_ads_are_counted(self):
+        assessor = AdAssessor()
+        assessor.add_criteria(AdCriterion.from_json({"type": "less_than", "tag": "price", "limit": 99}),
+                              AdCriterion.from_json({"type": "keywords_any", "tag": "title", "keywords": ["rad"]}))
+        assessor.check_batch(self._ads)
+        price, title = assessor.statistics()
+        self.assertEqual(price["evaluations"], len(self._ads))
+        self.assertEqual(title["evaluations"], price["passes"])
+
+    def test_empty_batch(self):
+        assessor = AdAssessor()
+        assessor.add_criterion(AdCriterion.from_json({"type": "keywords_any", "tag": "title", "keywords": ["rad"]}))
+        self.assertEqual(len(assessor.check_batch([])), 0)
+
+    def test_statistics_are_updated(self):
+        assessor = AdAssessor()
+        assessor.add_criterion(AdCriterion.from_json({"type": "less_than", "tag": "price", "limit": 99}))
+        mask = assessor.check_batch(self._ads)
+        stats = assessor.statistics()[0]
+        self.assertEqual(stats["evaluations"], len(self._ads))
+        self.assertEqual(stats["rejections"], len(self._ads) - sum(bool(hit) for hit in mask))
+
+
+class TestMoreCriterionTypes(unittest.TestCase):
+
+    def setUp(self):
+        self._ad = Ad({"id": 1, "dt": 1, "title": "Rennrad Größe 56cm", "price": 450.0, "zip": "1100"}, "id", "dt")
+
+    def test_regex(self):
+        criterion = AdCriterion.from_json({"type": "regex", "tag": "title", "pattern": r"gr(ö|oe)(ß|ss)e 5[4-8]"})
+        self.assertTrue(criterion.check(self._ad))
+        self.assertFalse(AdCriterion.from_json({"type": "regex", "tag": "title", "pattern": r"^größe",
+                                                "ignore_case": False}).check(self._ad))
+        self.assertDictEqual(criterion.serialize(), {"type": "regex", "tag": "title",
+                                                     "pattern": r"gr(ö|oe)(ß|ss)e 5[4-8]", "ignore_case": True})
+
+    def test_invalid_regex(self):
+        with self.assertRaises(CriterionError):
+            AdCriterion.from_json({"type": "regex", "tag": "title", "pattern": "(unbalanced"})
+
+    def test_between(self):
+        criterion = AdCriterion.from_json({"type": "between", "tag": "price", "lower": "400", "upper": 450})
+        self.assertTrue(criterion.check(self._ad))
+        self._ad["price"] = 450.5
+        self.assertFalse(criterion.check(self._ad))
+        with self.assertRaises(CriterionError):
+            AdCriterion.from_json({"type": "between", "tag": "price", "lower": 500, "upper": 400})
+        with self.assertRaises(CriterionError):
+            AdCriterion.from_json({"type": "between", "tag": "price", "lower": "cheap", "upper": 400})
+
+    def test_in_set(self):
+        self.assertTrue(AdCriterion.from_json({"type": "in_set", "tag": "zip", "values": ["1020", "1100"]}).check(self._ad))
+        self.assertFalse(AdCriterion.from_json({"type": "in_set", "tag": "zip", "values": ["1020"]}).check(self._ad))
+        self.assertTrue(AdCriterion.from_json({"type": "in_set", "tag": "price", "values": [450]}).check(self._ad))
+        self.assertTrue(AdCriterion.from_json({"type": "in_set", "tag": "zip", "values": [1100]}).check(self._ad))
+        self._ad["zip"] = 1100
+        self.assertTrue(AdCriterion.from_json({"type": "in_set", "tag": "zip", "values": ["1100"]}).check(self._ad))
+        self.assertTrue(AdCriterion.from_json({"type": "in_set", "tag": "title",
+                                               "values": ["RENNRAD GRÖSSE 56CM", "rennrad größe 56cm"]}).check(self._ad))
+        with self.assertRaises(CriterionError):
+            AdCriterion.from_json({"type": "in_set", "tag": "zip", "values": "1100"})
+
+    def test_registry(self):
+        self.assertIsInstance(AdCriterion.from_json({"type": "counting", "tag": "price"}), CountingCriterion)
+        self.assertIsInstance(AdCriterion.from_json({"type": "not", "criterion": {"type": "counting", "tag": "price"}}),
+                              AdCriterionNot)
+        self.assertIsNone(AdCriterion.from_json({"type": "unknown"}))
+
+    def test_batch(self):
+        ads = [Ad({"id": nr, "dt": nr, "title": "Rad {}".format(nr), "price": float(nr), "zip": str(1000 + nr)},
+                  "id", "dt") for nr in range(50)]
+        for data in ({"type": "regex", "tag": "title", "pattern": r"rad [1-3]\b"},
+                     {"type": "regex", "tag": "title", "pattern": r"Rad 4", "ignore_case": False},
+                     {"type": "between", "tag": "price", "lower": 10, "upper": 20},
+                     {"type": "in_set", "tag": "zip", "values": ["1001", "1049"]}):
+            criterion = AdCriterion.from_json(data)
+            expected = [criterion.check(ad) for ad in ads]
+            self.assertListEqual([bool(hit) for hit in criterion.check_batch(AdBatch(ads))], expected)
+
+
+class TestWithinRadius(unittest.TestCase):
+
+    def _ad(self, zip):
+        return Ad({"id": 1, "dt": 1, "zip": zip}, "id", "dt")
+
+    def test_codes_near_vienna(self):
+        criterion = AdCriterion.from_json({"type": "within_radius", "tag": "zip", "center": "1010", "radius_km": 30})
+        self.assertTrue(criterion.check(self._ad("1100")))
+        self.assertTrue(criterion.check(self._ad(2340)))      # Mödling, the immo profile stores ints
+        self.assertFalse(criterion.check(self._ad("5020")))   # Salzburg
+        self.assertFalse(criterion.check(self._ad(0)))        # no zip code in the ad
+
+    def test_center_as_coordinates(self):
+        criterion = AdCriterion.from_json({"type": "within_radius", "tag": "zip", "center": [47.07, 15.44],
+                                           "radius_km": 10})
+        self.assertTrue(criterion.check(self._ad("8010")))
+        self.assertFalse(criterion.check(self._ad("1010")))
+
+    def test_unknown_center(self):
+        with self.assertRaises(CriterionError):
+            AdCriterion.from_json({"type": "within_radius", "tag": "zip", "center": "0000", "radius_km": 10})
+
+
+class TestZipCentroids(unittest.TestCase):
+
+    def test_distances(self):
+        from geo import ZipCentroids, distance_km
+        table = ZipCentroids.bundled()
+        self.assertAlmostEqual(distance_km(table.locate("1010"), table.locate("5020")), 250, delta=10)
+        self.assertEqual(table.locate("4021"), table.locate("4020"))   # same 3-digit prefix
+        self.assertIsNotNone(table.locate("6534"))                     # postal region only
+        self.assertIsNone(table.locate("abc"))
+
+
+class TestFuzzyKeywords(unittest.TestCase):
+
+    def test_typos(self):
+        criterion = AdCriterion.from_json({"type": "keywords_fuzzy", "tag": "title",
+                                           "keywords": ["Reboarder", "Kinderwagen", "Rad"]})
+        for title in ("Toller Rebaorder", "re-boarder neu", "Rebord", "Kindrwagen", "Fahrrad"):
+            self.assertTrue(criterion.check(Ad({"id": 1, "dt": 1, "title": title}, "id", "dt")), title)
+        for title in ("Kinderbett", "Rebound", "Rat", "Sofa"):
+            self.assertFalse(criterion.check(Ad({"id": 1, "dt": 1, "title": title}, "id", "dt")), title)
+
+    def test_max_distance(self):
+        ad = Ad({"id": 1, "dt": 1, "title": "Rebord"}, "id", "dt")
+        self.assertFalse(AdCriterion.from_json({"type": "keywords_fuzzy", "tag": "title", "keywords": ["reboarder"],
+                                                "max_distance": 2}).check(ad))
+        with self.assertRaises(CriterionError):
+            AdCriterion.from_json({"type": "keywords_fuzzy", "tag": "title", "keywords": ["x"], "max_distance": -1})
+
+    def test_prefilter_finds_all_matches(self):
+        import random
+        rnd = random.Random(5)
+
+        def distance(a, b):
+            previous = list(range(len(b) + 1))
+            for i, ca in enumerate(a, 1):
+                current = [i]
+                for j, cb in enumerate(b, 1):
+                    current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+                previous = current
+            return previous[-1]
+
+        alphabet = "abcde"
+        for _ in range(300):
+            keywords = ["".join(rnd.choice(alphabet) for _ in range(rnd.randint(4, 9))) for _ in range(3)]
+            word = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(2, 10)))
+            bound = rnd.randint(1, 3)
+            matcher = FuzzyKeywordMatcher(keywords, bound)
+            expected = any(kwd in word or distance(word, kwd) <= bound for kwd in keywords)
+            self.assertEqual(matcher.any(word), expected, (keywords, word, bound))
+
+
+class TestAssessorStatistics(unittest.TestCase):
+
+    def _assessor(self, histograms):
+        assessor = AdAssessor(histograms)
+        assessor.add_criteria(AdCriterion.from_json({"type": "less_than", "tag": "price", "limit": 50}),
+                              AdCriterion.from_json({"type": "keywords_any", "tag": "title", "keywords": ["rad"]}))
+        for nr in range(10):
+            assessor.check(Ad({"id": nr, "dt": nr, "title": "Rad" if nr % 2 else "Sofa", "price": nr * 10}, "id", "dt"))
+        return assessor
+
+    def test_counters(self):
+        assessor = self._assessor(histograms=False)
+        totals = assessor.totals()
+        self.assertEqual(totals["evaluations"], 10)
+        self.assertEqual(totals["passes"], 3)      # 10, 30 and 50
+        self.assertEqual(totals["rejections"], 7)
+        self.assertGreater(totals["ns"], 0)
+        self.assertNotIn("histogram", totals)
+        for stats in assessor.statistics():
+            self.assertEqual(stats["passes"] + stats["rejections"], stats["evaluations"])
+
+    def test_histograms(self):
+        assessor = self._assessor(histograms=True)
+        self.assertEqual(sum(count for _, count in assessor.totals()["histogram"]), 10)
+        for stats in assessor.statistics():
+            self.assertEqual(sum(count for _, count in stats["histogram"]), stats["evaluations"])
+            self.assertTrue(all(bound & (bound - 1) == 0 for bound, _ in stats["histogram"]))
+
+    def test_batch_counters(self):
+        assessor = self._assessor(histograms=False)
+        assessor.check_batch([Ad({"id": nr, "dt": nr, "title": "Rad", "price": nr}, "id", "dt") for nr in range(100)])
+        totals = assessor.totals()
+        self.assertEqual(totals["evaluations"], 110)
+        self.assertEqual(totals["passes"], 3 + 51)
+
+    def test_updated_keeps_unchanged_criteria(self):
+        assessor = self._assessor(histograms=True)
+        price, title = assessor.criteria
+        evaluations = assessor.statistics()[0]["evaluations"]
+        updated = assessor.updated([AdCriterion.from_json({"type": "less_than", "tag": "price", "limit": 50}),
+                                    AdCriterion.from_json({"type": "keywords_any", "tag": "title", "keywords": ["sofa"]})])
+        self.assertIs(updated.criteria[0], price)
+        self.assertIsNot(updated.criteria[1], title)
+        self.assertEqual(updated.statistics()[0]["evaluations"], evaluations)
+        self.assertEqual(updated.statistics()[1]["evaluations"], 0)
+        self.assertIn("histogram", updated.totals())
+        self.assertEqual(assessor.criteria, [price, title])     # unchanged
+        ad = Ad({"id": 1, "dt": 1, "title": "Sofa", "price": 10}, "id", "dt")
+        self.assertTrue(updated.check(ad))
+        self.assertFalse(assessor.check(ad))
@@ -26,6 +26,8 @@ SOFTWARE.
 
 import unittest
 import os
+import time
+import threading
 import random
 from adstore import *
 
@@ -67,3 +69,113 @@ class TestAdStore(unittest.TestCase):
         self.store.add_ads(self.some_ads)
         for i in range(1,self.store.length()):
             self.assertGreaterEqual(self.store[i].datetime, self.store[i-1].datetime)
+
+
+class TestAdStoreWriteBehind(unittest.TestCase):
+
+    path = "./testWriteBehindStore.save"
+
+    def setUp(self):
+        self.some_ads = [Ad({"id":nr, "dt": nr, "title":"Ad number {}".format(nr)}, "id", "dt")
+                         for nr in range(10)]
+
+    def tearDown(self):
+        self.store.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_flush(self):
+        self.store = AdStore(self.path, write_behind=True, flush_interval=60)
+        self.store.add_ads(self.some_ads)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(self.store.flush())
+        self.assertEqual(AdStore(self.path).length(), 10)
+
+    def test_close_drains_pending_changes(self):
+        self.store = AdStore(self.path, write_behind=True, flush_interval=60)
+        self.store.add_ads(self.some_ads[:5])
+        self.store.add_ads(self.some_ads[5:])
+        self.store.close()
+        self.assertEqual(AdStore(self.path).length(), 10)
+        self.store.add_ads([Ad({"id": 10, "dt": 10}, "id", "dt")])   # saved synchronously after close()
+        self.assertEqual(AdStore(self.path).length(), 11)
+
+    def test_failed_save_stays_pending(self):
+        self.store = AdStore(self.path, write_behind=True, flush_interval=60)
+        save = self.store.save
+        def failing_save():
+            raise OSError("No space left on device")
+        self.store.save = failing_save
+        self.store.add_ads(self.some_ads)
+        self.assertFalse(self.store.flush())
+        self.assertFalse(os.path.exists(self.path))
+        self.store.save = save  # the disk is back
+        self.assertTrue(self.store.close())
+        self.assertEqual(AdStore(self.path).length(), 10)
+
+    def test_stores_share_one_writer_thread(self):
+        self.store = AdStore(self.path, write_behind=True, flush_interval=60)
+        threads = threading.active_count()
+        paths = ["{}.{}".format(self.path, nr) for nr in range(20)]
+        stores = [AdStore(path, write_behind=True, flush_interval=60) for path in paths]
+        try:
+            self.assertEqual(threading.active_count(), threads)
+            for store in stores:
+                store.add_ads(self.some_ads)
+            self.assertTrue(all(store.flush() for store in stores))
+            self.assertTrue(all(AdStore(path).length() == 10 for path in paths))
+        finally:
+            for store, path in zip(stores, paths):
+                store.close()
+                os.remove(path)
+
+    def test_flush_threshold(self):
+        self.store = AdStore(self.path, write_behind=True, flush_interval=60, flush_threshold=10)
+        self.store.add_ads(self.some_ads)
+        deadline = time.monotonic() + 5
+        while not os.path.exists(self.path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(AdStore(self.path).length(), 10)
+
+
+class TestAdRecord(unittest.TestCase):
+
+    path = "./testRecordStore.save"
+
+    def setUp(self):
+        self.record_type = ad_record_type(["id", "dt", "title", "price"], "id", "dt")
+        self.some_ads = [self.record_type({"id":nr, "dt": nr, "title":"Ad number {}".format(nr), "price": 1.5})
+                         for nr in range(10)]
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_record_types_are_shared(self):
+        self.assertIs(self.record_type, ad_record_type(["title", "price", "dt", "id"], "id", "dt"))
+        self.assertFalse(hasattr(self.some_ads[0], "__dict__"))
+
+    def test_mapping_access(self):
+        ad = self.some_ads[3]
+        self.assertEqual(ad.key, 3)
+        self.assertEqual(ad["title"], "Ad number 3")
+        self.assertEqual("{title} for {price}".format(**ad), "Ad number 3 for 1.5")
+        self.assertDictEqual(dict(ad), {"id": 3, "dt": 3, "title": "Ad number 3", "price": 1.5})
+        ad["price"] = 30
+        self.assertEqual(ad["price"], 30)
+        self.assertRaises(KeyError, ad.__setitem__, "color", "red")
+        self.assertRaises(KeyError, ad.__getitem__, "color")
+
+    def test_missing_tags(self):
+        ad = self.record_type({"id": 1, "dt": 1})
+        self.assertListEqual(sorted(ad.keys()), ["dt", "id"])
+        self.assertRaises(KeyError, ad.__getitem__, "title")
+        self.assertRaises(AttributeError, self.record_type, {"id": 1, "dt": 1, "color": "red"})
+        self.assertRaises(AttributeError, self.record_type, {"dt": 1})
+
+    def test_save_and_load_records(self):
+        store = AdStore(self.path)
+        store.add_ads(self.some_ads)
+        another_store = AdStore(self.path)
+        self.assertListEqual([dict(ad) for ad in self.some_ads], [dict(ad) for ad in another_store])
+        self.assertIs(type(another_store[0]), self.record_type)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import unittest
+import datetime
+from adstore import Ad
+from adassessor import AdCriterion
+from evaluation import *
+
+
+class TestEvaluateCriteria(unittest.TestCase):
+
+    def setUp(self):
+        start = datetime.datetime(2014, 7, 7)
+        self.ads = [Ad({"id": nr, "dt": start + datetime.timedelta(minutes=nr),
+                        "title": "Kinderwagen" if nr % 3 == 0 else "Sofa", "price": float(nr)}, "id", "dt")
+                    for nr in range(100)]
+        self.criteria = [AdCriterion.from_json({"type": "keywords_any", "tag": "title", "keywords": ["kinderwagen"]}),
+                         AdCriterion.from_json({"type": "less_than", "tag": "price", "limit": 49})]
+
+    def test_counts(self):
+        result = evaluate_criteria(self.criteria, self.ads)
+        self.assertEqual(result["ads"], 100)
+        self.assertEqual(result["hits"], 17)    # 0, 3, ..., 48
+        self.assertListEqual([c["passes"] for c in result["criteria"]], [34, 50])
+        self.assertListEqual([c["rejections"] for c in result["criteria"]], [66, 50])
+        self.assertDictEqual(result["criteria"][1]["criterion"], {"type": "less_than", "tag": "price", "limit": 49})
+        self.assertTrue(all(c["ms"] >= 0 for c in result["criteria"]))
+
+    def test_samples_are_the_newest_hits(self):
+        result = evaluate_criteria(self.criteria, self.ads, samples=3)
+        self.assertListEqual([sample["id"] for sample in result["samples"]], [48, 45, 42])
+        self.assertEqual(result["samples"][0]["dt"], "2014-07-07T00:48:00")     # ready for JSON
+
+    def test_no_ads(self):
+        result = evaluate_criteria(self.criteria, [])
+        self.assertEqual(result["hits"], 0)
+        self.assertListEqual(result["samples"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import unittest
+import os
+import random
+import threading
+from adstore import AdStore, ad_record_type
+from mappedstore import *
+
+
+class TestMappedAdStore(unittest.TestCase):
+
+    path = "./testMappedStore.mdb"
+    pickle_path = "./testMappedStore.save"
+
+    def setUp(self):
+        self.record_type = ad_record_type(["id", "dt", "title"], "id", "dt")
+        self.some_ads = [self.record_type({"id":nr, "dt": nr, "title":"Ad number {}".format(nr)})
+                         for nr in range(10)]
+        random.shuffle(self.some_ads)
+
+    def tearDown(self):
+        for path in (self.path, self.path + ".idx", self.pickle_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _keys(self, store):
+        return [ad.key for ad in store]
+
+    def test_add_ads_sorted_by_date(self):
+        store = MappedAdStore(self.path)
+        self.assertListEqual(self.some_ads, store.add_ads(self.some_ads + self.some_ads[:3]))
+        self.assertEqual(store.length(), 10)
+        self.assertListEqual(self._keys(store), list(range(10)))
+        self.assertListEqual([], store.add_ads(self.some_ads))
+
+    def test_save_and_load_ads(self):
+        store = MappedAdStore(self.path, autosave=False)
+        store.add_ads(self.some_ads[:5])
+        store.save()
+        store.add_ads(self.some_ads[5:])
+        store.save()
+        another_store = MappedAdStore(self.path)
+        self.assertEqual(another_store.length(), 10)
+        for ad in self.some_ads:
+            self.assertIn(ad.key, another_store)
+        self.assertNotIn(10, another_store)
+        self.assertListEqual(self._keys(another_store), list(range(10)))
+        self.assertDictEqual(dict(another_store[3]), {"id": 3, "dt": 3, "title": "Ad number 3"})
+
+    def test_remove_ads(self):
+        store = MappedAdStore(self.path)
+        store.add_ads(self.some_ads)
+        new_ad = self.record_type({"id": 10, "dt": 10, "title": "unsaved"})
+        store._autosave = False
+        store.add_ads([new_ad])
+        ads_to_remove = [ad for ad in self.some_ads if ad.key in (2, 3, 5)] + [new_ad]
+        self.assertListEqual(ads_to_remove, store.remove_ads(ads_to_remove))
+        self.assertListEqual(self._keys(store), [0, 1, 4, 6, 7, 8, 9])
+        self.assertListEqual(self._keys(MappedAdStore(self.path)), [0, 1, 4, 6, 7, 8, 9])
+
+    def test_import_from_pickle_store(self):
+        old_store = AdStore(self.pickle_path)
+        old_store.add_ads(self.some_ads)
+        store = MappedAdStore(self.path, import_path=self.pickle_path)
+        self.assertTrue(store.wait_ready(5))
+        self.assertListEqual(self._keys(store), list(range(10)))
+        self.assertListEqual([], store.add_ads(self.some_ads))
+        self.assertEqual(MappedAdStore(self.path).length(), 10)
+
+    def test_recover_unindexed_records(self):
+        store = MappedAdStore(self.path)
+        store.add_ads(self.some_ads[:5])
+        with open(self.path + ".idx", "rb") as f:
+            old_index = f.read()
+        store.add_ads(self.some_ads[5:])
+        with open(self.path + ".idx", "wb") as f:     # as if the index update never happened
+            f.write(old_index)
+        recovered = MappedAdStore(self.path)
+        self.assertEqual(recovered.length(), 10)
+        recovered.save()
+        self.assertListEqual(self._keys(MappedAdStore(self.path)), list(range(10)))
+
+    def test_append_behind_records_of_another_store(self):
+        old = MappedAdStore(self.path, autosave=False)
+        old.add_ads(self.some_ads[:5])
+        new = MappedAdStore(self.path, autosave=False)
+        old.save()  # the file grows behind the map of the new store
+        new.add_ads(self.some_ads[5:])
+        new.save()
+        reopened = MappedAdStore(self.path)
+        self.assertTrue(all(ad.key in reopened for ad in self.some_ads[5:]))
+        self.assertLessEqual({ad.key for ad in self.some_ads[5:]}, set(self._keys(reopened)))  # all decode
+
+    def test_save_appends_to_index(self):
+        store = MappedAdStore(self.path)
+        store.add_ads(self.some_ads[:5])
+        index_size = os.path.getsize(self.path + ".idx")
+        store.add_ads(self.some_ads[5:])
+        self.assertEqual(os.path.getsize(self.path + ".idx"), index_size + 5 * MappedAdStore._entry.size)
+        another_store = MappedAdStore(self.path)
+        self.assertEqual(len(another_store._tail), 5)
+        self.assertListEqual(self._keys(another_store), list(range(10)))
+        self.assertTrue(all(ad.key in another_store for ad in self.some_ads))
+
+    def test_tail_is_merged_into_index(self):
+        store = MappedAdStore(self.path)
+        store._merge_min = 2
+        for ad in self.some_ads:
+            store.add_ads([ad])
+        self.assertLessEqual(len(store._tail), max(2, store._count // 2))
+        self.assertListEqual(self._keys(MappedAdStore(self.path)), list(range(10)))
+
+    def test_remove_while_adding(self):
+        store = MappedAdStore(self.path)
+        ads = [self.record_type({"id": nr, "dt": nr, "title": "Ad"}) for nr in range(200)]
+
+        def add():
+            for ad in ads:
+                store.add_ads([ad])
+
+        def remove():
+            while adding.is_alive():
+                store.remove_ads(ads[:5])
+
+        adding = threading.Thread(target=add, daemon=True)
+        removing = threading.Thread(target=remove, daemon=True)
+        adding.start()
+        removing.start()
+        adding.join(10)
+        removing.join(10)
+        self.assertFalse(adding.is_alive() or removing.is_alive())
+
+    def test_write_behind(self):
+        store = MappedAdStore(self.path, write_behind=True, flush_interval=60)
+        store.add_ads(self.some_ads)
+        self.assertFalse(os.path.exists(self.path))
+        store.close()
+        self.assertEqual(MappedAdStore(self.path).length(), 10)
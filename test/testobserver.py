@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import unittest
+import threading
+import datetime
+import time
+import os
+import tempfile
+from connector import Connector
+from adstore import Ad, AdStore
+from adassessor import AdAssessor, AdCriterion
+from scheduler import Scheduler
+from asyncscheduler import AsyncScheduler
+from observer import *
+
+
+class FakeConnector(object):
+    """
+    Returns one new ad per poll instead of fetching pages.
+    """
+
+    url = "http://localhost/"
+    profile_name = "Willhaben"
+
+    def __init__(self):
+        self.polls = 0
+        self.polled = threading.Event()
+
+    def ads_after(self, time_mark):
+        self.polls += 1
+        self.polled.set()
+        return [Ad({"id": self.polls, "dt": datetime.datetime.now(), "title": "Ad"}, "id", "dt")]
+
+    async def ads_after_async(self, time_mark, executor=None):
+        return self.ads_after(time_mark)
+
+    def ads_after_parallel(self, time_mark, maxpages=100, parallel=4):
+        return self.ads_after(time_mark), 1
+
+
+def fake_observer(name, interval, adaptive=None):
+    observer = Observer("http://localhost/", "Willhaben", AdStore(), AdAssessor(), None,
+                        update_interval=interval, name=name, adaptive=adaptive)
+    observer._connector = FakeConnector()
+    return observer
+
+
+class TestObserver(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler(workers=4)
+
+    def tearDown(self):
+        self.scheduler.quit()
+        self.scheduler.join(timeout=3)
+
+    def test_polls_until_quit(self):
+        observer = fake_observer("Polling", interval=0.01)
+        observer.start(self.scheduler)
+        time.sleep(0.2)
+        observer.quit()
+        observer.join(1)
+        self.assertFalse(observer.is_alive())
+        polls = observer._connector.polls
+        self.assertGreater(polls, 3)
+        self.assertEqual(observer.store.length(), polls)
+        self.assertGreaterEqual(observer.serialize(statistics=True)["statistics"]["lateness"]["polls"], polls)
+        self.assertEqual(observer.max_staleness, 0.01)
+        time.sleep(0.05)
+        self.assertEqual(observer._connector.polls, polls)
+
+    def test_resume_polls_right_away(self):
+        observer = fake_observer("Paused", interval=3600)
+        observer.start(self.scheduler)
+        self.assertTrue(observer._connector.polled.wait(1))
+        observer.state = Observer.PAUSED
+        self.assertEqual(len(self.scheduler), 0)    # no wakeups while paused
+        observer._connector.polled.clear()
+        start = time.monotonic()
+        observer.state = Observer.RUNNING
+        self.assertTrue(observer._connector.polled.wait(1))
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(observer._connector.polls, 2)
+
+    def test_update_in_place(self):
+        observer = fake_observer("Updated", interval=3600)
+        store = observer.store
+        observer.start(self.scheduler)
+        self.assertTrue(observer._connector.polled.wait(1))
+        time_mark = observer._time_mark
+        observer._connector.polled.clear()
+        assessor = observer.assessor.updated([])
+        observer.update(assessor=assessor, interval=0.01, priority=3)
+        self.assertTrue(observer._connector.polled.wait(1))    # moved forward from an hour
+        observer.quit()
+        observer.join(1)
+        self.assertIs(observer.store, store)
+        self.assertIs(observer.assessor, assessor)
+        self.assertGreater(observer._time_mark, time_mark)
+        self.assertEqual(observer.serialize()["interval"], 0.01)
+        self.assertEqual(observer.serialize()["priority"], 3)
+
+    def test_update_rebuilds_adaptive_interval(self):
+        observer = fake_observer("Adaptive", interval=60, adaptive=AdaptiveInterval(60, target=2, min_interval=10,
+                                                                                   max_interval=1000, jitter=0))
+        observer._adaptive.update(100, 10)
+        observer.update(interval=300, max_staleness=5)
+        self.assertEqual(observer.serialize()["adaptive"]["interval"], 300)
+        self.assertIsNone(observer.serialize()["adaptive"]["rate"])
+        self.assertEqual(observer.serialize()["adaptive"]["target"], 2)
+        self.assertEqual(observer.max_staleness, 5)
+        observer.update(max_staleness=False)
+        self.assertNotIn("max_staleness", observer.serialize())
+        self.assertEqual(observer.max_staleness, 300)
+
+    def test_shutdown_latency_with_200_observers(self):
+        observers = [fake_observer("Observer {}".format(nr), interval=0.05) for nr in range(200)]
+        for observer in observers:
+            observer.start(self.scheduler)
+        time.sleep(0.2)
+        start = time.monotonic()
+        for observer in observers:
+            observer.quit()
+        for observer in observers:
+            observer.join(1)
+        latency = time.monotonic() - start
+        self.assertFalse(any(observer.is_alive() for observer in observers))
+        self.assertLess(latency, 0.5)
+
+
+class TestProcessAds(unittest.TestCase):
+
+    def test_duplicates_identity_and_time_mark(self):
+        notified = []
+        class Notifications(object):
+            def notify_all(self, ad):
+                notified.append(ad)
+        observer = fake_observer("Processing", interval=60)
+        observer._notifications = Notifications()
+        start = observer._time_mark
+        ads = [Ad({"id": nr % 3, "dt": start + datetime.timedelta(minutes=nr), "images": ["a.jpg"]}, "id", "dt")
+               for nr in (2, 0, 1, 2, 0)]   # lists can not be hashed
+        observer._process_ads(ads)
+        self.assertEqual([ad.key for ad in notified], [2, 0, 1])
+        self.assertTrue(all(any(ad is fetched for fetched in ads[:3]) for ad in notified))
+        self.assertEqual(observer._time_mark, start + datetime.timedelta(minutes=2))
+        self.assertEqual(observer.store.length(), 3)
+
+
+class TestSearchGroup(unittest.TestCase):
+
+    def test_statistics_of_searches(self):
+        group = SearchGroup("http://localhost/", "Willhaben", update_interval=60, name="Group")
+        assessor = AdAssessor()
+        assessor.add_criterion(AdCriterion.from_json({"type": "less_than", "tag": "price", "limit": 50}))
+        group.add_search(SavedSearch("Cheap", assessor, AdStore(), None))
+        start = group._time_mark
+        group._process_ads([Ad({"id": nr, "dt": start + datetime.timedelta(minutes=nr), "price": 20 * nr},
+                               "id", "dt") for nr in range(1, 5)])
+        search, = group.serialize(statistics=True)["searches"]
+        self.assertEqual(search["statistics"]["assessor"]["evaluations"], 2)  # the percolator drops the others
+        self.assertEqual(search["statistics"]["criteria"][0]["passes"], 2)
+        self.assertNotIn("statistics", group.serialize()["searches"][0])
+
+    def test_ads_without_tag_are_skipped(self):
+        group = SearchGroup("http://localhost/", "Willhaben", update_interval=60, name="Group")
+        assessor = AdAssessor()
+        assessor.add_criterion(AdCriterion.from_json({"type": "less_than", "tag": "price", "limit": 50}))
+        group.add_search(SavedSearch("Cheap", assessor, AdStore(), None))
+        start = group._time_mark
+        group._process_ads([Ad({"id": 1, "dt": start + datetime.timedelta(minutes=1)}, "id", "dt"),
+                            Ad({"id": 2, "dt": start + datetime.timedelta(minutes=2), "price": 20}, "id", "dt")])
+        self.assertEqual([ad.key for ad in group.search("Cheap").store], [2])
+        self.assertEqual(group._time_mark, start + datetime.timedelta(minutes=2))
+
+    def test_time_mark_path(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "timemark.txt")
+            group = SearchGroup("http://localhost/", "Willhaben", name="Group", time_mark_path=path)
+            start = group._time_mark
+            group._process_ads([Ad({"id": 1, "dt": start + datetime.timedelta(minutes=1)}, "id", "dt")])
+            self.assertTrue(os.path.exists(path))
+
+
+class TestCatchUp(unittest.TestCase):
+
+    def test_parallel_pages_stop_at_first_page_without_new_ads(self):
+        connector = Connector("http://www.willhaben.at/iad/kaufen-und-verkaufen/", "Willhaben")
+        time_mark = datetime.datetime(2014, 7, 7)
+        def get_page(page):
+            if page >= 6:
+                raise IndexError(page)
+            return page
+        def parse_page(page, timelimit):
+            if page >= 5:
+                return []   # older ads only
+            return [Ad({"id": page * 10 + nr, "dt": time_mark + datetime.timedelta(minutes=1)}, "id", "dt")
+                    for nr in range(10)]
+        connector._get_page = get_page
+        connector._parse_page = parse_page
+        ads, pages = connector.ads_after_parallel(time_mark, parallel=4)
+        self.assertEqual([ad.key for ad in ads], list(range(50)))
+        self.assertEqual(pages, 6)  # the second wave fetches pages 4 to 7, of which 6 and 7 do not exist
+        ads, pages = connector.ads_after_parallel(time_mark, maxpages=3, parallel=2)
+        self.assertEqual((len(ads), pages), (30, 3))
+
+    def test_time_mark_survives_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "timemark.txt")
+            observer = fake_observer("Restarted", interval=60)
+            observer._time_mark_path = path
+            observer.poll()
+            self.assertEqual(observer.serialize(statistics=True)["statistics"]["catch_up"]["pages"], 1)
+            observer.poll()     # steady state
+            time_mark = observer._time_mark
+            restarted = Observer("http://localhost/", "Willhaben", AdStore(), AdAssessor(), None,
+                                 update_interval=60, name="Restarted", time_mark_path=path)
+            self.assertEqual(restarted._time_mark, time_mark)
+            self.assertIsNone(restarted.serialize(statistics=True)["statistics"]["catch_up"])
+
+    def test_catch_up_checks_in_batch(self):
+        observer = fake_observer("Catching up", interval=60)
+        batches = []
+        check_batch = observer._assessor.check_batch
+        observer._assessor.check_batch = lambda ads: batches.append(len(ads)) or check_batch(ads)
+        observer.poll()
+        observer.poll()
+        self.assertEqual(batches, [1])
+        self.assertEqual(observer.store.length(), 2)
+
+
+    def test_ads_without_tag_are_skipped(self):
+        observer = fake_observer("Missing tag", interval=60)
+        observer._assessor.add_criterion(AdCriterion.from_json({"type": "keywords_any", "tag": "title",
+                                                                "keywords": ["rad"]}))
+        start = observer._time_mark
+        ads = [Ad({"id": 1, "dt": start + datetime.timedelta(minutes=1), "title": "Rad"}, "id", "dt"),
+               Ad({"id": 2, "dt": start + datetime.timedelta(minutes=2)}, "id", "dt"),
+               Ad({"id": 3, "dt": start + datetime.timedelta(minutes=3), "title": "Rennrad"}, "id", "dt")]
+        observer._connector.ads_after_parallel = lambda time_mark, maxpages=100, parallel=4: (ads, 1)
+        self.assertEqual(observer.poll(), 60)   # still polled
+        self.assertEqual(sorted(ad.key for ad in observer.store), [1, 3])
+        self.assertEqual(observer._time_mark, start + datetime.timedelta(minutes=3))
+        observer._connector.ads_after = lambda time_mark: [Ad({"id": 4, "dt": datetime.datetime.now()}, "id", "dt")]
+        self.assertEqual(observer.poll(), 60)   # steady state
+        self.assertEqual(observer.store.length(), 2)
+
+
+class TestAsyncObserver(TestObserver):
+    """
+    The same tests with all observers polled on one event loop.
+    """
+
+    def setUp(self):
+        self.scheduler = AsyncScheduler(workers=4)
+
+    def test_thousands_of_observers_share_few_threads(self):
+        before = threading.active_count()
+        observers = [fake_observer("Observer {}".format(nr), interval=1) for nr in range(2000)]
+        for observer in observers:
+            observer.start(self.scheduler)
+        for observer in observers:
+            self.assertTrue(observer._connector.polled.wait(3))
+        self.assertLessEqual(threading.active_count() - before, 5)     # loop and 4 workers
+
+    def test_notifications_are_sent_from_executor(self):
+        class SlowNotifications(object):
+            def __init__(self):
+                self.threads = set()
+                self.sent = threading.Event()
+            def notify_all(self, ad):
+                self.threads.add(threading.current_thread().name)
+                self.sent.set()
+        notifications = SlowNotifications()
+        observer = fake_observer("Notifying", interval=3600)
+        observer._notifications = notifications
+        observer.start(self.scheduler)
+        self.assertTrue(notifications.sent.wait(1))
+        self.assertTrue(all(name.startswith("AsyncSchedulerWorker") for name in notifications.threads))
+
+    def test_ads_are_stored_from_executor(self):
+        class RecordingStore(AdStore):
+            def __init__(self):
+                super(RecordingStore, self).__init__()
+                self.threads = set()
+                self.stored = threading.Event()
+            def add_ads(self, ads):
+                self.threads.add(threading.current_thread().name)
+                self.stored.set()
+                return super(RecordingStore, self).add_ads(ads)
+        with tempfile.TemporaryDirectory() as directory:
+            observer = fake_observer("Storing", interval=3600)
+            observer._store = RecordingStore()
+            observer._time_mark_path = os.path.join(directory, "time_mark")
+            observer.start(self.scheduler)
+            self.assertTrue(observer._store.stored.wait(1))
+            observer.quit()
+            observer.join(1)
+            self.assertTrue(all(name.startswith("AsyncSchedulerWorker") for name in observer._store.threads))
+            self.assertTrue(os.path.exists(observer._time_mark_path))
+
+
+class TestAdaptiveInterval(unittest.TestCase):
+
+    def test_interval_follows_arrival_rate(self):
+        adaptive = AdaptiveInterval(180, target=5, min_interval=10, max_interval=1000, jitter=0)
+        self.assertIsNone(adaptive.rate)
+        self.assertEqual(adaptive.next_delay(), 180)
+        for _ in range(20):
+            adaptive.update(10, 60)     # busy: 10 ads a minute
+        self.assertAlmostEqual(adaptive.rate, 10 / 60)
+        self.assertAlmostEqual(adaptive.interval, 30)
+        for _ in range(3):
+            adaptive.update(0, 30)      # quiet: grows gradually
+        self.assertGreater(adaptive.interval, 30)
+        self.assertLess(adaptive.interval, 1000)
+        for _ in range(100):
+            adaptive.update(0, 30)
+        self.assertEqual(adaptive.interval, 1000)
+
+    def test_bounds_and_jitter(self):
+        adaptive = AdaptiveInterval(1, target=1, min_interval=20, max_interval=40, jitter=0.5)
+        self.assertEqual(adaptive.interval, 20)
+        adaptive.update(1000, 1)
+        delays = [adaptive.next_delay() for _ in range(100)]
+        self.assertTrue(all(20 <= delay <= 40 for delay in delays))
+        adaptive = AdaptiveInterval(100, min_interval=20, max_interval=400, jitter=0.2)
+        delays = [adaptive.next_delay() for _ in range(100)]
+        self.assertTrue(all(80 <= delay <= 120 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_invalid_options(self):
+        self.assertRaises(ValueError, AdaptiveInterval, 60, min_interval=100, max_interval=10)
+        self.assertRaises(ValueError, AdaptiveInterval, 60, target=0)
+        self.assertRaises(ValueError, AdaptiveInterval, 60, jitter=1)
+
+    def test_observer_serializes_rate(self):
+        adaptive = AdaptiveInterval(60, target=1, min_interval=0.001, max_interval=60, jitter=0)
+        observer = fake_observer("Adaptive", interval=60, adaptive=adaptive)
+        observer.poll()
+        self.assertIsNone(observer.serialize()["adaptive"]["rate"])
+        time.sleep(0.01)
+        delay = observer.poll()     # one new ad per poll
+        adaptive = observer.serialize()["adaptive"]
+        self.assertGreater(adaptive["rate"], 0)
+        self.assertEqual(adaptive["interval"], delay)
+        self.assertLess(delay, 60)
+        self.assertEqual(observer.serialize()["interval"], 60)
+
+
+if __name__ == "__main__":
+    unittest.main()
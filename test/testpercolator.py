@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import unittest
+import random
+from adstore import Ad
+from adassessor import AdAssessor, AdCriterion
+from percolator import *
+
+
+def assessor(*criteria):
+    assessor = AdAssessor()
+    for criterion in criteria:
+        assessor.add_criterion(AdCriterion.from_json(criterion))
+    return assessor
+
+
+class TestAhoCorasick(unittest.TestCase):
+
+    def test_findall(self):
+        automaton = AhoCorasick(["he", "she", "his", "hers", "ushers"])
+        self.assertSetEqual(automaton.findall("ushers"), {"he", "she", "hers", "ushers"})
+        self.assertSetEqual(automaton.findall("this is it"), {"his"})
+        self.assertSetEqual(automaton.findall("nothing"), set())
+
+    def test_overlapping_keywords(self):
+        automaton = AhoCorasick(["aab", "ab", "b", "abc"])
+        self.assertSetEqual(automaton.findall("aaabc"), {"aab", "ab", "b", "abc"})
+
+
+class TestPercolator(unittest.TestCase):
+
+    def setUp(self):
+        self.percolator = Percolator()
+        self.ads = [Ad({"id": 1, "dt": 1, "title": "Rennrad Carbon", "price": 900}, "id", "dt"),
+                    Ad({"id": 2, "dt": 2, "title": "Kinderfahrrad rot", "price": 50}, "id", "dt"),
+                    Ad({"id": 3, "dt": 3, "title": "Sofa", "price": 200}, "id", "dt")]
+
+    def test_keyword_anchors(self):
+        self.percolator.add("race", assessor({"type": "keywords_all", "tag": "title", "keywords": ["rennrad", "carbon"]}))
+        self.percolator.add("bikes", assessor({"type": "keywords_any", "tag": "title", "keywords": ["Rad", "bike"]}))
+        self.assertListEqual(sorted(self.percolator.match(self.ads[0])), ["bikes", "race"])
+        self.assertListEqual(self.percolator.match(self.ads[1]), ["bikes"])
+        self.assertListEqual(self.percolator.match(self.ads[2]), [])
+        self.assertSetEqual(self.percolator.candidates(self.ads[2]), set())
+
+    def test_range_anchors(self):
+        self.percolator.add("cheap", assessor({"type": "less_than", "tag": "price", "limit": 100}))
+        self.percolator.add("expensive", assessor({"type": "greater_than", "tag": "price", "limit": 500}))
+        self.percolator.add("mid", assessor({"type": "and", "criteria": [
+            {"type": "greater_than", "tag": "price", "limit": 100},
+            {"type": "less_than", "tag": "price", "limit": 500}]}))
+        self.assertListEqual(self.percolator.match(self.ads[0]), ["expensive"])
+        self.assertListEqual(self.percolator.match(self.ads[1]), ["cheap"])
+        self.assertListEqual(self.percolator.match(self.ads[2]), ["mid"])
+
+    def test_unanchored_searches_are_always_checked(self):
+        self.percolator.add("not sofa", assessor({"type": "keywords_not", "tag": "title", "keywords": ["sofa"]}))
+        self.assertListEqual(self.percolator.match(self.ads[0]), ["not sofa"])
+        self.assertListEqual(self.percolator.match(self.ads[2]), [])
+
+    def test_remove(self):
+        self.percolator.add("sofa", assessor({"type": "keywords_any", "tag": "title", "keywords": ["sofa"]}))
+        self.assertListEqual(self.percolator.match(self.ads[2]), ["sofa"])
+        self.percolator.remove("sofa")
+        self.assertListEqual(self.percolator.match(self.ads[2]), [])
+        self.assertEqual(len(self.percolator), 0)
+
+    def test_same_result_as_single_assessors(self):
+        rnd = random.Random(7)
+        words = ["rad", "sofa", "tisch", "lampe", "carbon", "rot", "blau", "holz", "kinder", "stuhl"]
+        searches = dict()
+        for nr in range(200):
+            criteria = [{"type": rnd.choice(["keywords_all", "keywords_any", "keywords_not"]),
+                         "tag": "title", "keywords": rnd.sample(words, rnd.randint(1, 3))}]
+            if rnd.random() < 0.5:
+                criteria.append({"type": rnd.choice(["less_than", "greater_than"]), "tag": "price",
+                                 "limit": rnd.randint(0, 1000)})
+            searches["search {}".format(nr)] = criteria
+            self.percolator.add("search {}".format(nr), assessor(*criteria))
+        for nr in range(100):
+            ad = Ad({"id": nr, "dt": nr, "title": " ".join(rnd.sample(words, 4)).title(),
+                     "price": rnd.randint(0, 1000)}, "id", "dt")
+            expected = sorted(name for name, criteria in searches.items() if assessor(*criteria).check(ad))
+            self.assertListEqual(sorted(self.percolator.match(ad)), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import unittest
+import threading
+import time
+from scheduler import *
+from asyncscheduler import AsyncScheduler
+
+
+class CountingJob(object):
+
+    def __init__(self, delay, polls=None):
+        self.delay = delay
+        self.polls = 0
+        self.max_polls = polls
+        self.done = threading.Event()
+        self.threads = set()
+
+    def poll(self):
+        self.polls += 1
+        self.threads.add(threading.current_thread().name)
+        if self.max_polls is not None and self.polls >= self.max_polls:
+            self.done.set()
+            return None
+        return self.delay
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler(workers=4)
+
+    def tearDown(self):
+        self.scheduler.quit()
+        self.scheduler.join(timeout=3)
+
+    def test_jobs_are_polled_repeatedly(self):
+        job = CountingJob(delay=0.01, polls=5)
+        self.scheduler.schedule(job)
+        self.assertTrue(job.done.wait(3))
+        self.assertEqual(job.polls, 5)
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_delay(self):
+        job = CountingJob(delay=0, polls=1)
+        start = time.monotonic()
+        self.scheduler.schedule(job, 0.2)
+        self.assertTrue(job.done.wait(3))
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_cancel(self):
+        job = CountingJob(delay=0, polls=1)
+        self.scheduler.schedule(job, 0.2)
+        self.scheduler.cancel(job)
+        self.assertFalse(job.done.wait(0.4))
+        self.assertEqual(job.polls, 0)
+
+    def test_thread_count_does_not_depend_on_jobs(self):
+        before = threading.active_count()
+        jobs = [CountingJob(delay=0.01, polls=3) for _ in range(300)]
+        for job in jobs:
+            self.scheduler.schedule(job)
+        for job in jobs:
+            self.assertTrue(job.done.wait(5))
+        self.assertLessEqual(threading.active_count() - before, 5)     # timer and 4 workers
+        self.assertLessEqual(len(set.union(*(job.threads for job in jobs))), 4)
+
+    def test_priority_and_deadline_order_under_overload(self):
+        order = []
+        class OrderedJob(CountingJob):
+            def __init__(self, name, priority, max_staleness=None):
+                super(OrderedJob, self).__init__(delay=0, polls=1)
+                self.name = name
+                self.priority = priority
+                self.max_staleness = max_staleness
+                self.lateness = Lateness()
+            def poll(self):
+                order.append(self.name)
+                time.sleep(0.02)
+                return super(OrderedJob, self).poll()
+        self.scheduler.quit()
+        self.scheduler.join(3)
+        self.scheduler = type(self.scheduler)(workers=1)
+        blocker = OrderedJob("blocker", 0)
+        self.scheduler.schedule(blocker)
+        time.sleep(0.01)     # all other jobs are due while the only worker is busy
+        jobs = [OrderedJob("low", -1), OrderedJob("late", 0, max_staleness=10),
+                OrderedJob("urgent", 0, max_staleness=0.01), OrderedJob("high", 5, max_staleness=0.001)]
+        for job in jobs:
+            self.scheduler.schedule(job)
+        for job in jobs:
+            self.assertTrue(job.done.wait(3))
+        self.assertEqual(order, ["blocker", "high", "urgent", "late", "low"])
+        self.assertEqual(jobs[0].lateness.polls, 1)
+        self.assertGreater(jobs[0].lateness.max, jobs[3].lateness.max)
+        self.assertEqual(jobs[1].lateness.missed, 0)   # 10 s to spare
+        self.assertEqual(jobs[3].lateness.missed, 1)
+
+    def test_low_priority_is_not_starved(self):
+        class BusyJob(CountingJob):
+            def __init__(self, priority, polls=None):
+                super(BusyJob, self).__init__(delay=0, polls=polls)
+                self.priority = priority
+            def poll(self):
+                time.sleep(0.005)
+                return super(BusyJob, self).poll()
+        self.scheduler.quit()
+        self.scheduler.join(3)
+        self.scheduler = type(self.scheduler)(workers=1, aging=0.05)
+        busy = [BusyJob(1) for _ in range(3)]   # always due again, more than the only worker can poll
+        for job in busy:
+            self.scheduler.schedule(job)
+        time.sleep(0.02)
+        low = BusyJob(0, polls=1)
+        self.scheduler.schedule(low)
+        self.assertTrue(low.done.wait(2))
+        self.assertTrue(all(job.polls > 1 for job in busy))
+
+    def test_lateness(self):
+        lateness = Lateness()
+        lateness.add(0.5, max_staleness=1)
+        lateness.add(1.5, max_staleness=1)
+        self.assertEqual(lateness.serialize(), dict(polls=2, missed=1, last=1.5, max=1.5, mean=1.0))
+
+    def test_running_job_is_not_polled_twice(self):
+        class SlowJob(CountingJob):
+            running = 0
+            overlaps = 0
+            def poll(self):
+                self.running += 1
+                self.overlaps += self.running > 1
+                time.sleep(0.3)
+                self.running -= 1
+                return super(SlowJob, self).poll()
+        job = SlowJob(delay=3600, polls=2)
+        self.scheduler.schedule(job)
+        time.sleep(0.1)
+        self.scheduler.schedule(job)    # while the first poll is running
+        self.scheduler.schedule(job)
+        self.assertTrue(job.done.wait(3))
+        time.sleep(0.1)
+        self.assertEqual(job.polls, 2)  # polled again once, after the first poll
+        self.assertEqual(job.overlaps, 0)
+
+    def test_job_that_ends_while_due_again_is_dropped(self):
+        class LastJob(CountingJob):
+            def poll(self):
+                super(LastJob, self).poll()
+                time.sleep(0.2)
+                return None
+        job = LastJob(delay=0)
+        self.scheduler.schedule(job)
+        time.sleep(0.1)
+        self.scheduler.schedule(job)    # while the last poll is running
+        time.sleep(0.4)
+        self.assertEqual(job.polls, 1)
+
+    def test_failing_job_is_dropped(self):
+        class FailingJob(object):
+            def poll(self):
+                raise RuntimeError("boom")
+        with self.assertLogs(level="ERROR"):
+            self.scheduler.schedule(FailingJob())
+            time.sleep(0.1)
+        self.assertEqual(len(self.scheduler), 0)
+
+
+class TestAsyncScheduler(TestScheduler):
+
+    def setUp(self):
+        self.scheduler = AsyncScheduler(workers=4)
+
+    def test_coroutine_jobs_run_on_the_loop(self):
+        class AsyncJob(CountingJob):
+            async def poll_async(self, executor):
+                return self.poll()
+        job = AsyncJob(delay=0.01, polls=3)
+        self.scheduler.schedule(job)
+        self.assertTrue(job.done.wait(3))
+        self.assertEqual(job.threads, {"AsyncScheduler"})
+
+    def test_quit_stops_the_loop(self):
+        job = CountingJob(delay=0.01)
+        self.scheduler.schedule(job)
+        time.sleep(0.05)
+        self.scheduler.quit()
+        self.scheduler.join(1)
+        polls = job.polls
+        time.sleep(0.05)
+        self.assertEqual(job.polls, polls)
+        self.assertFalse(self.scheduler._thread.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
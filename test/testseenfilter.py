@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import unittest
+import os
+from adstore import Ad, AdStore
+from seenfilter import *
+
+
+class TestSeenFilter(unittest.TestCase):
+
+    path = "./testSeenFilter.bloom"
+
+    def setUp(self):
+        self.some_ads = [Ad({"id":nr, "dt": nr, "title":"Ad number {}".format(nr)}, "id", "dt")
+                         for nr in range(10)]
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_no_false_negatives(self):
+        seen = SeenFilter(capacity=1000, error_rate=0.000001)
+        for key in range(1000):
+            self.assertTrue(seen.add(key))
+        for key in range(1000):
+            self.assertIn(key, seen)
+            self.assertFalse(seen.add(key))
+        self.assertEqual(len(seen), 1000)
+
+    def test_false_positive_rate(self):
+        seen = SeenFilter(capacity=5000, error_rate=0.01)
+        for key in range(5000):
+            seen.add(key)
+        false_positives = sum(1 for key in range(5000, 25000) if key in seen)
+        self.assertLess(false_positives / 20000, 0.02)
+
+    def test_grows_beyond_capacity(self):
+        seen = SeenFilter(capacity=100, error_rate=0.01)
+        for key in range(1000):
+            seen.add(key)
+        for key in range(1000):
+            self.assertIn(key, seen)
+        false_positives = sum(1 for key in range(1000, 11000) if key in seen)
+        self.assertLess(false_positives / 10000, 0.03)
+
+    def test_save_and_load(self):
+        seen = SeenFilter(self.path, capacity=100, error_rate=0.000001)
+        for key in range(300):
+            seen.add("key{}".format(key))
+        seen.save()
+        another_seen = SeenFilter(self.path, capacity=100, error_rate=0.000001)
+        self.assertEqual(len(another_seen), 300)
+        for key in range(300):
+            self.assertIn("key{}".format(key), another_seen)
+
+    def test_seen_key_store_without_ads(self):
+        store = SeenKeyStore(SeenFilter(self.path, capacity=100))
+        self.assertListEqual(self.some_ads, store.add_ads(self.some_ads))
+        self.assertListEqual([], store.add_ads(self.some_ads))
+        self.assertEqual(store.length(), 10)
+        self.assertRaises(IndexError, store.__getitem__, 0)
+        self.assertListEqual([], store.remove_ads(self.some_ads))   # keys stay in the filter
+        self.assertEqual(store.length(), 10)
+
+    def test_seen_key_store_in_front_of_ad_store(self):
+        ad_store = AdStore()
+        ad_store.add_ads(self.some_ads[:5])
+        store = SeenKeyStore(SeenFilter(capacity=100), ad_store)
+        self.assertListEqual(self.some_ads[5:], store.add_ads(self.some_ads))
+        self.assertEqual(store.length(), 10)
+        self.assertListEqual([ad.key for ad in self.some_ads], [ad.key for ad in store])
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import unittest
+import threading
+import tempfile
+import time
+import os
+from server import Server
+from observer import Observer
+from adstore import Ad, AdStore
+from adassessor import AdAssessor
+from api.commandapi import CommandApi
+from command import CreateObserverCommand
+
+
+class SlowConnector(object):
+    """
+    Takes a while to fetch nothing.
+    """
+
+    url = "http://localhost/"
+    profile_name = "Willhaben"
+
+    def __init__(self):
+        self.fetching = threading.Event()
+
+    def ads_after(self, time_mark):
+        self.fetching.set()
+        time.sleep(0.3)
+        return []
+
+    def ads_after_parallel(self, time_mark, maxpages=100, parallel=4):
+        return self.ads_after(time_mark), 1
+
+
+class TestServer(unittest.TestCase):
+
+    def test_quit_is_prompt(self):
+        server = Server()
+        server.start()
+        start = time.monotonic()
+        server.quit()
+        server.join(3)
+        self.assertFalse(server.is_alive())
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_shutdown_latency_with_200_observers(self):
+        server = Server()
+        server.start()
+        for nr in range(200):   # nothing listens on port 9, every poll fails right away
+            server.add_observer(Observer("http://localhost:9/", "Willhaben", AdStore(), AdAssessor(), None,
+                                         update_interval=0.05, name="Observer {}".format(nr)))
+        time.sleep(0.2)
+        start = time.monotonic()
+        server.quit()
+        server.join(5)
+        latency = time.monotonic() - start
+        self.assertFalse(server.is_alive())
+        self.assertFalse(any(observer.is_alive() for observer in server))
+        self.assertLess(latency, 1.0)
+
+    def test_remove_observer_waits_for_running_poll(self):
+        server = Server()
+        server.start()
+        try:
+            observer = Observer("http://localhost/", "Willhaben", AdStore(), AdAssessor(), None,
+                                update_interval=3600, name="Slow")
+            observer._connector = SlowConnector()
+            server.add_observer(observer)
+            self.assertTrue(observer._connector.fetching.wait(3))
+            server.remove_observer("Slow")
+            self.assertFalse(observer.is_alive())   # the poll was done before the store was closed
+        finally:
+            server.quit()
+            server.join(3)
+
+    def test_invalid_seen_filter_options(self):
+        server = Server()
+        server.start()
+        api = CommandApi(server)
+        try:
+            response = api._process_command_info(dict(command="create_observer", name="Filtered",
+                                                      url="http://localhost:9/", profile="Willhaben",
+                                                      store=False, criteria=[], interval=3600,
+                                                      seen_filter={"capacity": "many"}))
+            self.assertEqual(response["status"], "ERROR")
+            self.assertTrue(server.is_alive())
+        finally:
+            server.quit()
+            server.join(3)
+
+    def test_invalid_criterion_opens_no_store(self):
+        server = Server()
+        server.start()
+        api = CommandApi(server)
+        opened = []
+        setup_store = CreateObserverCommand._setup_store
+        CreateObserverCommand._setup_store = lambda command, *args: opened.append(args) or setup_store(command, *args)
+        try:
+            response = api._process_command_info(dict(command="create_observer", name="Broken",
+                                                      url="http://localhost:9/", profile="Willhaben",
+                                                      store=False, interval=3600,
+                                                      criteria=[{"type": "between", "tag": "price",
+                                                                 "lower": 500, "upper": 400}]))
+            self.assertEqual(response["status"], "ERROR")
+            self.assertListEqual(opened, [])
+        finally:
+            CreateObserverCommand._setup_store = setup_store
+            server.quit()
+            server.join(3)
+
+    def test_replaced_observer_keeps_its_store(self):
+        cwd = os.getcwd()
+        server = Server()
+        server.start()
+        api = CommandApi(server)
+        ads = [Ad({"id": nr, "dt": nr}, "id", "dt") for nr in range(11)]
+        try:
+            with tempfile.TemporaryDirectory() as root:
+                os.chdir(root)
+                for store_format in ("pickle", "mapped"):
+                    server.config.store.format = store_format
+                    name = "Replaced {}".format(store_format)
+                    create = dict(command="create_observer", name=name, url="http://localhost:9/",
+                                  profile="Willhaben", store=True, criteria=[], interval=3600)
+                    self.assertEqual(api._process_command_info(create)["status"], "OK")
+                    server[name].store.add_ads(ads[:5])
+                    self.assertTrue(server[name].store.flush())
+                    server[name].store.add_ads(ads[5:10])   # still pending
+                    self.assertEqual(api._process_command_info(create)["status"], "OK")
+                    self.assertEqual(len(list(server)), 1)
+                    self.assertEqual(server[name].store.add_ads(ads), ads[10:])
+                    api._process_command_info(dict(command="remove_observer", name=name))
+                    reopened = api._process_command_info(create)
+                    self.assertEqual(reopened["status"], "OK")
+                    self.assertEqual(sorted(ad.key for ad in server[name].store), list(range(11)), store_format)
+                    api._process_command_info(dict(command="remove_observer", name=name))
+        finally:
+            os.chdir(cwd)
+            server.quit()
+            server.join(3)
+
+    def test_evaluate_criteria_errors(self):
+        server = Server()
+        server.start()
+        api = CommandApi(server)
+        criteria = [{"type": "less_than", "tag": "price", "limit": 100}]
+        try:
+            with tempfile.TemporaryDirectory() as root:
+                server.config.evaluation.corpus = root
+                with open(os.path.join(root, "broken.html"), "w") as f:
+                    f.write("<html></html>")
+                for corpus in ("broken.html", "../etc/passwd", "/etc/passwd"):
+                    response = api._process_command_info(dict(command="evaluate_criteria", corpus=corpus,
+                                                              criteria=criteria))
+                    self.assertEqual(response["status"], "ERROR", corpus)
+                self.assertIn("within", response["message"])
+            api._process_command_info(dict(command="create_observer", name="Filtered", url="http://localhost:9/",
+                                           profile="Willhaben", store=False, criteria=[], interval=3600,
+                                           seen_filter={"keep_ads": False}))
+            response = api._process_command_info(dict(command="evaluate_criteria", observer="Filtered",
+                                                      criteria=criteria))
+            self.assertEqual(response["status"], "ERROR")
+            self.assertTrue(server.is_alive())
+        finally:
+            server.quit()
+            server.join(3)
+
+    def test_sharded_server(self):
+        server = Server()
+        server.start()
+        api = CommandApi(server)
+        try:
+            response = api._process_command_info(dict(command="set_config", config={"sharding": {"workers": 2}}))
+            self.assertEqual(response["status"], "OK")
+            for nr in range(4):
+                response = api._process_command_info(dict(command="create_observer", name="Observer {}".format(nr),
+                                                          url="http://localhost:9/", profile="Willhaben",
+                                                          store=False, criteria=[], interval=3600))
+                self.assertEqual(response["status"], "OK")
+            self.assertEqual(list(server), [])  # all observers run in the workers
+            response = api._process_command_info(dict(command="list_observers", statistics=True))
+            observers = response["response"]["observers"]
+            self.assertEqual(sorted(observer["name"] for observer in observers),
+                             ["Observer {}".format(nr) for nr in range(4)])
+            self.assertTrue(all("statistics" in observer for observer in observers))
+            self.assertEqual(len(response["response"]["workers"]), 2)
+        finally:
+            server.quit()
+            server.join(10)
+        self.assertFalse(server.is_alive())
+        self.assertFalse(any(worker["alive"] for worker in server.supervisor.workers()))
+
+
+    def test_turning_sharding_on_and_off(self):
+        server = Server()
+        server.start()
+        api = CommandApi(server)
+        def create(name):
+            return api._process_command_info(dict(command="create_observer", name=name, url="http://localhost:9/",
+                                                  profile="Willhaben", store=False, criteria=[], interval=3600))
+        try:
+            self.assertEqual(create("Local")["status"], "OK")
+            response = api._process_command_info(dict(command="set_config", config={"sharding": {"workers": 2}}))
+            self.assertEqual(response["status"], "OK")
+            self.assertEqual(create("Sharded")["status"], "OK")
+            self.assertEqual(create("Local")["status"], "OK")   # replaced in the server, where it runs already
+            self.assertEqual(len(list(server)), 1)
+            response = api._process_command_info(dict(command="pause_observer", name="Local"))
+            self.assertEqual(response["status"], "OK")
+            self.assertEqual(server["Local"].state, "PAUSED")
+            response = api._process_command_info(dict(command="list_observers"))
+            self.assertEqual(sorted(observer["name"] for observer in response["response"]["observers"]),
+                             ["Local", "Sharded"])
+            response = api._process_command_info(dict(command="pause_observer", name="Sharded"))
+            self.assertEqual(response["status"], "OK")
+            response = api._process_command_info(dict(command="set_config", config={"sharding": {"workers": 0}}))
+            self.assertEqual(response["status"], "OK")
+            self.assertEqual(sorted(observer.name for observer in server), ["Local", "Sharded"])
+            self.assertEqual(server["Sharded"].state, "PAUSED")
+        finally:
+            server.quit()
+            server.join(10)
+        self.assertFalse(server.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
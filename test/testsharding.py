@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import unittest
+import os
+import signal
+import time
+from collections import Counter
+from sharding import HashRing, Supervisor
+from server import Server
+
+
+def create_observer(name):
+    return dict(command="create_observer", name=name, url="http://localhost:9/", profile="Willhaben",
+                store=False, criteria=[], interval=3600)
+
+
+class TestHashRing(unittest.TestCase):
+
+    def test_names_are_spread_over_nodes(self):
+        ring = HashRing(range(4))
+        owners = Counter(ring.node("Observer {}".format(nr)) for nr in range(4000))
+        self.assertEqual(set(owners), {0, 1, 2, 3})
+        self.assertTrue(all(600 < count < 1400 for count in owners.values()))
+
+    def test_adding_a_node_moves_few_names(self):
+        names = ["Observer {}".format(nr) for nr in range(4000)]
+        ring = HashRing(range(4))
+        before = {name: ring.node(name) for name in names}
+        ring.add(4)
+        moved = [name for name in names if ring.node(name) != before[name]]
+        self.assertTrue(all(ring.node(name) == 4 for name in moved))
+        self.assertLess(len(moved), 1400)
+        ring.remove(4)
+        self.assertEqual({name: ring.node(name) for name in names}, before)
+
+    def test_empty_ring(self):
+        self.assertRaises(LookupError, HashRing().node, "Observer")
+
+
+class TestSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        self.supervisor = Supervisor(2, Server().config)
+        self.names = ["Observer {}".format(nr) for nr in range(8)]
+        for name in self.names:
+            self.assertEqual(self.supervisor.execute(create_observer(name))["status"], "OK")
+
+    def tearDown(self):
+        self.supervisor.quit()
+
+    def list_observers(self):
+        response = self.supervisor.execute(dict(command="list_observers"))
+        self.assertEqual(response["status"], "OK")
+        return {observer["name"]: observer for observer in response["response"]["observers"]}
+
+    def test_commands_are_routed_to_owner(self):
+        observers = self.list_observers()
+        self.assertEqual(sorted(observers), sorted(self.names))
+        self.assertEqual({observer["worker"] for observer in observers.values()}, {0, 1})
+        self.assertEqual(self.supervisor.execute(dict(command="pause_observer", name="Observer 3"))["status"], "OK")
+        response = self.supervisor.execute(dict(command="observer_state", name="Observer 3"))
+        self.assertEqual(response["response"]["state"], "PAUSED")
+        self.assertEqual(self.supervisor.execute(dict(command="remove_observer", name="Observer 3"))["status"], "OK")
+        self.assertNotIn("Observer 3", self.list_observers())
+        response = self.supervisor.execute(dict(command="get_observer", name="Observer 3"))
+        self.assertEqual(response["status"], "ERROR")
+
+    def test_shared_store_is_rejected(self):
+        cmd_info = dict(create_observer("Shared"), store="shared")
+        self.assertEqual(self.supervisor.execute(cmd_info)["status"], "ERROR")
+        self.assertNotIn("Shared", self.list_observers())
+
+    def test_crashed_worker_is_restarted_with_its_observers(self):
+        self.supervisor.execute(dict(command="pause_observer", name="Observer 1"))
+        pid = self.supervisor.workers()[0]["pid"]
+        os.kill(pid, signal.SIGKILL)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            workers = self.supervisor.workers()
+            if workers[0]["pid"] != pid and workers[0]["alive"]:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.supervisor.workers()[0]["restarts"], 1)
+        observers = self.list_observers()
+        self.assertEqual(sorted(observers), sorted(self.names))
+        self.assertEqual(observers["Observer 1"]["state"], "PAUSED")
+
+    def test_resize_moves_observers(self):
+        self.supervisor.resize(3)
+        observers = self.list_observers()
+        self.assertEqual(sorted(observers), sorted(self.names))
+        ring = HashRing(range(3))
+        for name, observer in observers.items():
+            self.assertEqual(observer["worker"], ring.node(name))
+        self.supervisor.resize(1)
+        observers = self.list_observers()
+        self.assertEqual(sorted(observers), sorted(self.names))
+        self.assertEqual({observer["worker"] for observer in observers.values()}, {0})
+
+
+if __name__ == "__main__":
+    unittest.main()
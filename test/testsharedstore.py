@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The MIT License (MIT)
+
+Copyright (c) 2012 Martin Hammerschmied
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import unittest
+import os
+from adstore import Ad
+from sharedstore import *
+
+
+class TestSharedAdStore(unittest.TestCase):
+
+    path = "./testSharedStore.save"
+
+    def setUp(self):
+        self.store = SharedAdStore(self.path)
+        self.some_ads = [Ad({"id":nr, "dt": nr, "title":"Ad number {}".format(nr)}, "id", "dt")
+                         for nr in range(10)]
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_ads_are_stored_once(self):
+        first = self.store.view("First", "Willhaben")
+        second = self.store.view("Second", "Willhaben")
+        self.assertListEqual(self.some_ads[:6], first.add_ads(self.some_ads[:6]))
+        self.assertListEqual(self.some_ads, second.add_ads(self.some_ads))
+        self.assertListEqual([], second.add_ads(self.some_ads))
+        self.assertEqual(len(self.store), 10)
+        self.assertEqual(first.length(), 6)
+        self.assertEqual(second.length(), 10)
+        self.assertListEqual(self.store.observers_of("Willhaben", 3), ["First", "Second"])
+        self.assertListEqual(self.store.observers_of("Willhaben", 8), ["Second"])
+
+    def test_profiles_are_separated(self):
+        self.store.view("First", "Willhaben").add_ads(self.some_ads)
+        immo = self.store.view("First", "WillhabenImmo")
+        self.assertListEqual(self.some_ads, immo.add_ads(self.some_ads))
+        self.assertEqual(len(self.store), 20)
+
+    def test_remove_ads(self):
+        first = self.store.view("First", "Willhaben")
+        second = self.store.view("Second", "Willhaben")
+        first.add_ads(self.some_ads)
+        second.add_ads(self.some_ads[:5])
+        self.assertListEqual(self.some_ads[:5], first.remove_ads(self.some_ads[:5]))
+        self.assertEqual(len(self.store), 10)  # still referenced by "Second"
+        second.remove_ads(self.some_ads[:5])
+        self.assertEqual(len(self.store), 5)
+        self.assertListEqual([ad.key for ad in first], [5, 6, 7, 8, 9])
+
+    def test_save_and_load(self):
+        self.store.view("First", "Willhaben").add_ads(self.some_ads[:3])
+        self.store.view("Second", "Willhaben").add_ads(self.some_ads)
+        another_store = SharedAdStore(self.path)
+        self.assertEqual(len(another_store), 10)
+        self.assertListEqual([ad.key for ad in another_store.view("First", "Willhaben")], [0, 1, 2])
+        self.assertListEqual(another_store.observers_of("Willhaben", 1), ["First", "Second"])
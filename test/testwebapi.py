@@ -34,6 +34,7 @@ from api.webapi import WebApi
 from server import Server
 from observer import Observer
 from notificationserver import NotificationServer
+from adstore import Ad, AdStore
 
 class TestWebApi(unittest.TestCase):
 
@@ -130,6 +131,23 @@ class TestWebApi(unittest.TestCase):
         observer_data["name"] = observer_serialized["name"]     # not in the original data
         self.assertDictEqual(observer_data, observer_serialized)
 
+    def test_command_update_observer(self):
+        observer_data = dict(profile="Willhaben", url="that wont work for sure", store=False, interval=30,
+                             criteria=[dict(tag="title", type="keywords_all", keywords=["word", "perfect"])])
+        self._api_call("/api/observer/MyObserver", "PUT", self._encode_object(observer_data))
+        observer = self._server["MyObserver"]
+        store = observer.store
+        update = dict(interval=60, criteria=[dict(tag="title", type="keywords_all", keywords=["word"])])
+        self._api_call("/api/observer/MyObserver", "PATCH", self._encode_object(update))
+        self.assertIs(self._server["MyObserver"], observer)
+        self.assertIs(observer.store, store)
+        self.assertEqual(observer.serialize()["interval"], 60)
+        self.assertEqual(observer.serialize()["criteria"], update["criteria"])
+        self._api_call("/api/observer/MyObserver", "PATCH", self._encode_object(dict(max_staleness=10)))
+        self.assertEqual(observer.serialize()["max_staleness"], 10)
+        self._api_call("/api/observer/MyObserver", "PATCH", self._encode_object(dict(max_staleness=None)))
+        self.assertNotIn("max_staleness", observer.serialize())
+
     def test_command_add_notification(self):
         observer = MockObserver("MyObserver")
         self._server.add_observer(observer)
@@ -151,6 +169,26 @@ class TestWebApi(unittest.TestCase):
         self.assertEqual(notification._user, smtp_settings["user"])
         self.assertEqual(notification._pwd, smtp_settings["pwd"])
 
+    def test_command_evaluate_criteria(self):
+        observer = MockObserver("MyObserver")
+        self._server.add_observer(observer)
+        observer.store.add_ads([Ad({"id": nr, "dt": nr, "title": "Ad number {}".format(nr), "price": nr * 10.0},
+                                   "id", "dt") for nr in range(20)])
+        criteria = {"criteria": [{"type": "less_than", "tag": "price", "limit": 95},
+                                 {"type": "keywords_any", "tag": "title", "keywords": ["number 1"]}],
+                    "samples": 2}
+        result = self._api_call("/api/observer/MyObserver/evaluate", "POST", self._encode_object(criteria))
+        self.assertEqual(result["ads"], 20)
+        self.assertEqual(result["hits"], 1)     # only "Ad number 1" is cheap enough
+        self.assertListEqual([sample["id"] for sample in result["samples"]], [1])
+        self.assertListEqual([c["passes"] for c in result["criteria"]], [10, 11])
+
+    def test_command_get_observer_statistics(self):
+        observer = MockObserver("MyObserver")
+        self._server.add_observer(observer)
+        data = self._api_call("/api/observer/MyObserver/statistics", "GET")
+        self.assertDictEqual(data["statistics"], {"assessor": {}, "criteria": []})
+
     def test_commands_pause_resume_observer(self):
         observer = MockObserver("MyObserver")
         self._server.add_observer(observer)
@@ -208,6 +246,7 @@ class MockObserver(object):
         self._state = Observer.RUNNING
         self._is_alive = True
         self._notifications = NotificationServer()
+        self._store = AdStore()
 
     @property
     def name(self):
@@ -221,16 +260,24 @@ class MockObserver(object):
     def state(self, state):
         self._state = state
 
-    def start(self): pass
+    def start(self, scheduler): pass
 
     def quit(self): self._is_alive = False
 
-    def join(self, timeout): pass
+    def join(self, timeout=None): pass
 
     def is_alive(self): return self._is_alive
 
-    def serialize(self): return {"name": self.name}
+    def serialize(self, statistics=False):
+        d = {"name": self.name}
+        if statistics:
+            d["statistics"] = {"assessor": {}, "criteria": []}
+        return d
 
     @property
     def notifications(self):
-        return self._notifications
\ No newline at end of file
+        return self._notifications
+
+    @property
+    def store(self):
+        return self._store